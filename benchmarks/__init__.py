@@ -0,0 +1,80 @@
+"""
+Benchmarks for django-tally. These reuse the test setup so they require the
+same database as the tests, run them as modules from the repository root:
+
+    python -m benchmarks.snapshot
+"""
+import gc
+import time
+import tracemalloc
+
+import tests  # noqa: F401 (configures django)
+
+
+def measure(func, *args, **kwargs):
+    """
+    Measure the duration and peak memory usage of a function call.
+
+    @param func: Function
+        The function to measure.
+    @param args: List[Any]
+        Arguments to call the function with.
+    @param kwargs: Mapping[str, Any]
+        Keyword arguments to call the function with.
+    @return: (float, int, Any)
+        The duration in seconds, the peak memory usage in bytes and the
+        return value of the call.
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        res = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return duration, peak, res
+
+
+def measure_time(func, *args, repeat=5, **kwargs):
+    """
+    Measure the duration of a function call without tracing memory, which
+    slows down code that allocates a lot. The call is repeated and the
+    fastest duration is used.
+
+    @param func: Function
+        The function to measure.
+    @param args: List[Any]
+        Arguments to call the function with.
+    @param repeat: int
+        Number of times to call the function.
+    @param kwargs: Mapping[str, Any]
+        Keyword arguments to call the function with.
+    @return: (float, Any)
+        The duration in seconds and the return value of the last call.
+    """
+    durations = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        res = func(*args, **kwargs)
+        durations.append(time.perf_counter() - start)
+    return min(durations), res
+
+
+def report(title, results):
+    """
+    Print a table of benchmark results.
+
+    @param title: str
+        Title of the benchmark.
+    @param results: List[(str, float, int)]
+        Name, duration in seconds and peak memory in bytes of every variant.
+    """
+    print(title)
+    print('{:<24} {:>12} {:>12}'.format('variant', 'time (ms)', 'peak (KiB)'))
+    for name, duration, peak in results:
+        print('{:<24} {:>12.1f} {:>12.1f}'.format(
+            name, duration * 1000, peak / 1024,
+        ))
@@ -0,0 +1,121 @@
+"""
+Compares running user defined tally scripts with the interpreter against
+running them compiled to closures and to Python functions.
+"""
+from django_tally.user_def.lang import compile, generate, run, parse, Env
+
+from . import measure, measure_time, report
+
+
+N = 10000
+
+BASE, = parse('''
+(defn transform [value]
+  (if (= value null)
+    0
+    (* (get value "amount") (get value "factor" 1))))
+''')
+
+HANDLE_CHANGE, = parse('''
+(do
+  (def delta (- (transform new_value) (transform old_value)))
+  (if (= delta 0)
+    tally
+    (do
+      (def total (+ (get tally "total" 0) delta))
+      (put tally "total" total)
+      (put tally "count"
+        (+ (get tally "count" 0)
+           (if (= old_value null) 1 0)
+           (if (= new_value null) -1 0)))
+      tally)))
+''')
+
+
+FIB, = parse('''
+(do
+  (defn fib [n]
+    (if (< n 2) 1 (+ (fib (- n 1)) (fib (- n 2)))))
+  (fib 18))
+''')
+
+
+def events():
+    return [
+        (None, {'amount': i % 7}) if i % 3 else
+        ({'amount': i % 7}, {'amount': i % 5, 'factor': 2})
+        for i in range(N)
+    ]
+
+
+def interpret(base_env, changes):
+    tally = {}
+    for old_value, new_value in changes:
+        tally = run(HANDLE_CHANGE, Env(
+            env={
+                'tally': tally,
+                'old_value': old_value,
+                'new_value': new_value,
+            },
+            base_env=base_env,
+        ))
+    return tally
+
+
+def execute(base_env, program, changes):
+    tally = {}
+    for old_value, new_value in changes:
+        tally = program(Env(
+            env={
+                'tally': tally,
+                'old_value': old_value,
+                'new_value': new_value,
+            },
+            base_env=base_env,
+        ))
+    return tally
+
+
+def main():
+    changes = events()
+
+    interpreted_env = Env()
+    run(BASE, interpreted_env)
+    compiled_env = Env()
+    compile(BASE, compiled_env)(compiled_env)
+    bound = ['tally', 'old_value', 'new_value']
+    program = compile(HANDLE_CHANGE, compiled_env, bound=bound)
+    generated = generate(HANDLE_CHANGE, compiled_env, bound=bound)
+
+    results = []
+    expected = None
+    for name, func, args in [
+        ('run', interpret, (interpreted_env, changes)),
+        ('compile', execute, (compiled_env, program, changes)),
+        ('generate', execute, (compiled_env, generated, changes)),
+    ]:
+        _, peak, _ = measure(func, *args)
+        duration, tally = measure_time(func, *args)
+        assert expected is None or tally == expected, 'results differ'
+        expected = tally
+        results.append((name, duration, peak))
+
+    report(
+        'Handling {} changes with a user defined script:'.format(N),
+        results,
+    )
+
+    results = []
+    for name, func in [
+        ('run', lambda: run(FIB, Env())),
+        ('compile', lambda: compile(FIB)()),
+        ('generate', lambda: generate(FIB)()),
+    ]:
+        _, peak, _ = measure(func)
+        duration, _ = measure_time(func)
+        results.append((name, duration, peak))
+    report('Computing the 18th Fibonacci number recursively:', results)
+
+
+if __name__ == '__main__':
+    main()
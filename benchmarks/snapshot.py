@@ -0,0 +1,55 @@
+"""
+Compares snapshotting instances with deepcopy against tracked_fields.
+"""
+from django_tally import Tally, Sum
+
+from tests.testapp.models import Foo, Baz
+
+from . import measure, report
+
+
+N = 10000
+
+
+class DeepcopyCounter(Sum, Tally):
+
+    def aggregate_transform(self, value):
+        return 1
+
+
+class TrackedCounter(Sum, Tally):
+
+    tracked_fields = ('foo',)
+
+    def aggregate_transform(self, value):
+        return 1
+
+
+def load(foo):
+    # Initializing an instance with a pk mimics loading it from a queryset,
+    # the related foo is cached on every instance like with select_related.
+    return [Baz(pk=pk, foo=foo) for pk in range(1, N + 1)]
+
+
+def main():
+    foo = Foo(pk=1, value=1)
+    baseline, baseline_peak, _ = measure(load, foo)
+
+    results = []
+    for name, tally in [
+        ('deepcopy', DeepcopyCounter()),
+        ('tracked_fields', TrackedCounter()),
+    ]:
+        with tally.on(Baz):
+            duration, peak, _ = measure(load, foo)
+        results.append((name, duration - baseline, peak - baseline_peak))
+
+    report(
+        'Snapshotting {} loaded instances (excluding the instances):'
+        .format(N),
+        results,
+    )
+
+
+if __name__ == '__main__':
+    main()
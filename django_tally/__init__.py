@@ -2,6 +2,7 @@ from .tally import Tally
 from .aggregate import Aggregate, Sum, Product
 from .group import Group
 from .crud import CRUD
+from .concurrent import Concurrent
 
 
-__all__ = [Tally, Aggregate, Sum, Product, Group, CRUD]
+__all__ = [Tally, Aggregate, Sum, Product, Group, CRUD, Concurrent]
@@ -1,5 +1,7 @@
 import operator
 
+from django.db import models
+
 
 class Aggregate:
     """
@@ -10,6 +12,12 @@ class Aggregate:
 
     # The identity of the aggregation operation
     aggregate_id = None
+    # ORM expression that does the same as get_value, filter_value, and
+    # aggregate_transform for a row in the database, like F('value'). Used
+    # together with aggregate_function to rebuild the tally with a query.
+    aggregate_expression = None
+    # ORM aggregate that combines values like aggregate_add, like Sum.
+    aggregate_function = None
 
     def aggregate_add(self, aggregate, value):
         """
@@ -49,9 +57,60 @@ class Aggregate:
         """
         return value
 
+    def get_aggregate_expression(self):
+        """
+        Get the ORM expression to aggregate the transformed values of a
+        queryset with.
+
+        @return: Aggregate
+            The expression or None if the aggregate can not be done in the
+            database.
+        """
+        if (
+            self.aggregate_expression is None or
+            self.aggregate_function is None
+        ):
+            return None
+        return self.aggregate_function(self.aggregate_expression)
+
     def get_tally(self):
         return self.aggregate_id
 
+    def get_delta(self, pairs):
+        """
+        Get the net effect of a batch of changes as a value that can be
+        applied to any value of the tally with apply_delta.
+
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        @return: Any
+            The delta of the changes.
+        """
+        return self.handle_changes(self.aggregate_id, pairs)
+
+    def apply_delta(self, tally, delta):
+        """
+        Apply a delta obtained with get_delta to the tally.
+
+        @param tally: Any
+            Current value of the tally.
+        @param delta: Any
+            The delta to apply.
+        @return: Any
+            New tally value.
+        """
+        return self.aggregate_add(tally, delta)
+
+    def fold_queryset(self, tally, queryset):
+        expression = self.get_aggregate_expression()
+        if expression is None:
+            return super().fold_queryset(tally, queryset)
+
+        value = queryset.aggregate(tally_value=expression)['tally_value']
+        if value is None:
+            return tally
+        return self.aggregate_add(tally, value)
+
     def handle_change(self, tally, old_value, new_value):
         if old_value is None:
             old_value = self.aggregate_id
@@ -77,6 +136,7 @@ class Sum(Aggregate):
     aggregate_id = 0
     aggregate_add = operator.add
     aggregate_sub = operator.sub
+    aggregate_function = models.Sum
 
 
 class Product(Aggregate):
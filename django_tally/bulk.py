@@ -0,0 +1,180 @@
+import threading
+
+from contextlib import contextmanager
+
+from django.db import models, transaction
+
+from .signals import post_bulk_change
+
+
+_local = threading.local()
+
+
+def is_bulk_deleted(instance):
+    """
+    Check if an instance is being deleted by a bulk delete that will report
+    the deletion through a post_bulk_change signal.
+
+    @param instance: Model
+        The instance to check.
+    @return: bool
+        Whether the instance is being deleted in bulk.
+    """
+    keys = getattr(_local, 'deleting', None)
+    return bool(keys) and (type(instance), instance.pk) in keys
+
+
+@contextmanager
+def _bulk_deleting(instances):
+    """
+    Context manager that marks instances as being deleted in bulk.
+
+    @param instances: List[Model]
+        The instances to mark.
+    """
+    if not hasattr(_local, 'deleting'):
+        _local.deleting = set()
+    keys = {(type(instance), instance.pk) for instance in instances}
+    keys -= _local.deleting
+    _local.deleting |= keys
+    try:
+        yield
+    finally:
+        _local.deleting -= keys
+
+
+@contextmanager
+def _silenced():
+    """
+    Context manager that stops TallyQuerySet from sending signals, used when
+    an operation is implemented with other bulk operations.
+    """
+    silent = getattr(_local, 'silent', False)
+    _local.silent = True
+    try:
+        yield
+    finally:
+        _local.silent = silent
+
+
+def _sends_signals(model):
+    """
+    Check if a bulk operation on a model should send signals.
+
+    @param model: Class
+        The model the operation is on.
+    @return: bool
+        Whether to send signals.
+    """
+    return (
+        not getattr(_local, 'silent', False) and
+        post_bulk_change.has_listeners(model)
+    )
+
+
+class TallyQuerySet(models.QuerySet):
+    """
+    QuerySet that reports bulk operations to tallies with a single
+    post_bulk_change signal per operation instead of bypassing them.
+    """
+
+    def _send_bulk_change(self, changes):
+        """
+        Send a post_bulk_change signal for this queryset.
+
+        @param changes: List[(Model, Model)]
+            List of (old_instance, new_instance) pairs that changed.
+        """
+        if changes:
+            post_bulk_change.send(
+                sender=self.model, changes=changes, using=self.db,
+            )
+
+    def _in_bulk(self, pks, lock=False):
+        """
+        Fetch instances of the model by pk from the database of this
+        queryset.
+
+        @param pks: List[Any]
+            The pks of the instances to fetch.
+        @param lock: bool
+            Whether to lock the rows of the instances until the end of the
+            transaction.
+        @return: Mapping[Any, Model]
+            The instances that exist by pk.
+        """
+        queryset = self.model._base_manager.using(self.db)
+        if lock:
+            queryset = queryset.select_for_update()
+        return queryset.in_bulk(pks)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if kwargs.get('ignore_conflicts') and _sends_signals(self.model):
+            # Objects that conflicted are not inserted but can not be told
+            # apart from objects that were
+            raise ValueError(
+                'bulk_create with ignore_conflicts can not be reported to '
+                'tallies listening on {}'.format(self.model.__name__)
+            )
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if _sends_signals(self.model):
+            self._send_bulk_change([(None, obj) for obj in objs if obj.pk])
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        if not _sends_signals(self.model):
+            return super().bulk_update(objs, *args, **kwargs)
+
+        objs = list(objs)
+        pks = [obj.pk for obj in objs]
+        with transaction.atomic(using=self.db, savepoint=False):
+            old_instances = self._in_bulk(pks, lock=True)
+            with _silenced():
+                res = super().bulk_update(objs, *args, **kwargs)
+            # Only the given fields are written, so the new values are read
+            # back instead of taken from the objects
+            new_instances = self._in_bulk(list(old_instances))
+            self._send_bulk_change([
+                (old_instances[pk], new_instances.get(pk))
+                for pk in dict.fromkeys(pks)
+                if pk in old_instances
+            ])
+        return res
+
+    def update(self, **kwargs):
+        if not _sends_signals(self.model):
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            old_instances = list(self.select_for_update())
+            res = super().update(**kwargs)
+            new_instances = self._in_bulk(
+                [instance.pk for instance in old_instances],
+            )
+            self._send_bulk_change([
+                (instance, new_instances.get(instance.pk))
+                for instance in old_instances
+            ])
+        return res
+
+    update.alters_data = True
+
+    def delete(self):
+        if not _sends_signals(self.model):
+            return super().delete()
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            old_instances = list(self.select_for_update())
+            with _bulk_deleting(old_instances):
+                res = super().delete()
+            self._send_bulk_change([
+                (instance, None)
+                for instance in old_instances
+            ])
+        return res
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+TallyManager = models.Manager.from_queryset(TallyQuerySet)
@@ -0,0 +1,164 @@
+import threading
+import weakref
+
+from copy import copy
+
+from .aggregate import Aggregate
+from .group import Group
+
+
+class Partial:
+    """
+    Accumulator for the changes made to an aggregate by a single thread.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Concurrent:
+    """
+    Mixin that makes an in-memory tally safe to change from multiple threads
+    at once without serializing every change on a single lock.
+
+    Aggregates keep a partial aggregate per thread that starts at the identity
+    and only that thread writes to. Reading the tally adds all partials to the
+    base value. This requires the aggregate to be invertible, which it already
+    has to be for updates and deletes. Partials of threads that stopped are
+    folded into the base value.
+    Groups lock the stripes of the groups affected by a change instead, so
+    changes to unrelated groups do not wait on each other. Reading the tally
+    of a group returns a copy.
+    Other tallies fall back to a lock per tally.
+
+    Replacing the tally, like reset and rebuild do, is not synchronized with
+    changes that are in flight at the same time.
+    """
+
+    # Number of locks to divide the groups of a Group over.
+    lock_stripes = 64
+
+    def __init__(self, *args):
+        self.__base = None
+        self.__partials = []
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        if isinstance(self, Group):
+            self.__stripes = [
+                threading.Lock() for _ in range(self.lock_stripes)
+            ]
+        else:
+            self.__stripes = None
+        super().__init__(*args)
+
+    def _uses_partials(self):
+        """
+        Whether changes are accumulated in partials per thread.
+
+        @return: bool
+        """
+        return isinstance(self, Aggregate) and not isinstance(self, Group)
+
+    @property
+    def tally(self):
+        if self.__stripes is not None:
+            for lock in self.__stripes:
+                lock.acquire()
+            try:
+                # Other threads keep changing the groups in place
+                return copy(self.__base)
+            finally:
+                for lock in reversed(self.__stripes):
+                    lock.release()
+        if not self._uses_partials():
+            return self.__base
+        with self.__lock:
+            self._fold_partials()
+            tally = self.__base
+            partials = [partial for _, partial in self.__partials]
+        for partial in partials:
+            tally = self.aggregate_add(tally, partial.value)
+        return tally
+
+    @tally.setter
+    def tally(self, tally):
+        if self.__stripes is None:
+            locks = [self.__lock]
+        else:
+            locks = self.__stripes
+        for lock in locks:
+            lock.acquire()
+        try:
+            self.__base = tally
+            for _, partial in self.__partials:
+                partial.value = self.aggregate_id
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _get_partial(self):
+        """
+        Get the partial aggregate of the current thread.
+
+        @return: Partial
+        """
+        try:
+            return self.__local.partial
+        except AttributeError:
+            partial = self.__local.partial = Partial(self.aggregate_id)
+            thread = weakref.ref(threading.current_thread())
+            with self.__lock:
+                self._fold_partials()
+                self.__partials.append((thread, partial))
+            return partial
+
+    def _fold_partials(self):
+        """
+        Add the partials of threads that stopped to the base value, so the
+        amount of partials does not grow with every thread that ever changed
+        the tally. Must be called while holding the lock.
+        """
+        partials = []
+        for thread, partial in self.__partials:
+            alive = thread()
+            if alive is not None and alive.is_alive():
+                partials.append((thread, partial))
+            else:
+                # The thread does not change its partial anymore
+                self.__base = self.aggregate_add(self.__base, partial.value)
+        self.__partials = partials
+
+    def _get_stripes(self, pairs):
+        """
+        Get the locks guarding the groups affected by a batch of changes.
+
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        @return: List[Lock]
+            The locks in the order they should be acquired in.
+        """
+        indices = set()
+        for old_value, new_value in pairs:
+            for value in (old_value, new_value):
+                group = self.get_group(value)
+                if group is not None:
+                    indices.add(hash(group) % len(self.__stripes))
+        return [self.__stripes[index] for index in sorted(indices)]
+
+    def _apply_changes(self, pairs):
+        if self._uses_partials():
+            partial = self._get_partial()
+            partial.value = self.handle_changes(partial.value, pairs)
+        elif self.__stripes is not None:
+            locks = self._get_stripes(pairs)
+            for lock in locks:
+                lock.acquire()
+            try:
+                # Groups are changed in place
+                self.handle_changes(self.__base, pairs)
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+        else:
+            with self.__lock:
+                self.__base = self.handle_changes(self.__base, pairs)
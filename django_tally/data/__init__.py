@@ -1,4 +1,4 @@
-from .db_stored import DBStored
+from .db_stored import DBStored, ensure_data_many
 
 
-__all__ = [DBStored]
+__all__ = [DBStored, ensure_data_many]
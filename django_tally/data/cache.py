@@ -0,0 +1,239 @@
+import logging
+import select
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+
+
+# Channel DBStored tallies notify with the name of the data they changed
+CHANNEL = 'tally_changed'
+
+logger = logging.getLogger(__name__)
+
+
+def notify_changed(names, using=DEFAULT_DB_ALIAS):
+    """
+    Notify listeners that data has changed. Notifications are delivered when
+    the transaction commits.
+
+    @param names: List[str]
+        The names of the changed data.
+    @param using: str
+        Alias of the database.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_notify(%s, name) FROM unnest(%s::text[]) AS name',
+            [CHANNEL, list(names)],
+        )
+
+
+class DataCache:
+    """
+    Process local read-through cache of Data values. A background thread
+    listens for notifications of changed data on its own connection and
+    evicts the changed values. Values are only cached while listening and
+    when read outside of a transaction, so the cache never holds values that
+    might be rolled back. Listening has to be started explicitly with start,
+    until then all reads go to the database.
+    DBStored tallies evict the data they write from the cache of their own
+    process when their transaction commits, but only notify other processes
+    when db_notify is enabled. So every tally that writes data that is read
+    through a started cache in another process has to enable db_notify.
+    """
+
+    def __init__(self, using=None, retry_interval=1):
+        """
+        Initialize DataCache.
+
+        @param using: str
+            Alias of the database to read from and listen on, when None the
+            database Data is written to.
+        @param retry_interval: float
+            Seconds to wait before listening again when the connection is
+            lost.
+        """
+        self.using = using
+        self.retry_interval = retry_interval
+        self._values = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listening = threading.Event()
+        self._stopped = threading.Event()
+
+    def get_using(self):
+        """
+        Get the alias of the database to read from and listen on.
+
+        @return: str
+        """
+        from .models import Data
+
+        if self.using is not None:
+            return self.using
+        return router.db_for_write(Data)
+
+    def start(self, timeout=None):
+        """
+        Start listening for changes in the background if not already.
+
+        @param timeout: float
+            Seconds to wait for the listener to be ready, does not wait when
+            None.
+        @return: bool
+            Whether the cache is listening.
+        """
+        with self._lock:
+            if self._listener is None:
+                self._stopped.clear()
+                self._listener = threading.Thread(
+                    target=self._listen, name='tally-data-cache', daemon=True,
+                )
+                self._listener.start()
+        if timeout is not None:
+            self._listening.wait(timeout)
+        return self._listening.is_set()
+
+    def stop(self):
+        """
+        Stop listening for changes and clear the cache.
+        """
+        self._stopped.set()
+        with self._lock:
+            listener, self._listener = self._listener, None
+        if listener is not None:
+            listener.join()
+        self.evict()
+
+    def evict(self, name=None):
+        """
+        Evict a cached value.
+
+        @param name: str
+            Name of the data to evict, evicts all data when None.
+        """
+        with self._lock:
+            self._generation += 1
+            if name is None:
+                self._values.clear()
+            else:
+                self._values.pop(name, None)
+
+    def evict_on_commit(self, names, using=None):
+        """
+        Evict cached values when the current transaction commits, or right
+        away outside of a transaction.
+
+        @param names: Iterable[str]
+            Names of the data to evict.
+        @param using: str
+            Alias of the database of the transaction.
+        """
+        names = list(names)
+
+        def evict():
+            for name in names:
+                self.evict(name)
+
+        transaction.on_commit(evict, using=using)
+
+    def get(self, name):
+        """
+        Get the value of data.
+
+        @param name: str
+            Name of the data.
+        @return: Any
+            The value of the data.
+        """
+        from .models import Data
+
+        try:
+            return self.get_many([name])[name]
+        except KeyError:
+            raise Data.DoesNotExist(
+                'No data associated with {}'.format(name)
+            )
+
+    def get_many(self, names):
+        """
+        Get the values of data with at most one query.
+
+        @param names: Iterable[str]
+            Names of the data.
+        @return: Mapping[str, Any]
+            The values of the data by name, data that does not exist is left
+            out.
+        """
+        from .models import Data
+
+        using = self.get_using()
+        cacheable = not connections[using].in_atomic_block
+
+        values = {}
+        missing = []
+        with self._lock:
+            for name in names:
+                try:
+                    values[name] = self._values[name]
+                except KeyError:
+                    missing.append(name)
+            generation = self._generation
+        if not missing:
+            return values
+
+        # Check before querying so changes after the query are evicted
+        cacheable = cacheable and self._listening.is_set()
+        fetched = {
+            data.name: data.stored_value
+            for data in (
+                Data.objects
+                .using(using)
+                .filter(name__in=missing)
+                .only('name', 'value', 'int_value', 'float_value')
+            )
+        }
+        values.update(fetched)
+        if cacheable:
+            with self._lock:
+                # Values might be stale if anything was evicted meanwhile
+                if self._generation == generation:
+                    self._values.update(fetched)
+        return values
+
+    def _listen(self):
+        """
+        Listen for notifications of changed data until stopped.
+        """
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                wrapper = connections[self.get_using()]
+                connection = wrapper.get_new_connection(
+                    wrapper.get_connection_params()
+                )
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('LISTEN {}'.format(CHANNEL))
+                self._listening.set()
+
+                while not self._stopped.is_set():
+                    if select.select([connection], [], [], 0.1)[0]:
+                        connection.poll()
+                        while connection.notifies:
+                            notify = connection.notifies.pop(0)
+                            self.evict(notify.payload)
+            except Exception:
+                logger.exception('Lost connection of tally data cache')
+            finally:
+                self._listening.clear()
+                # Changes might have been missed
+                self.evict()
+                if connection is not None:
+                    connection.close()
+            self._stopped.wait(self.retry_interval)
+
+
+# Cache shared by the process
+cache = DataCache()
@@ -1,4 +1,519 @@
-from django.db import transaction
+import atexit
+import json
+import logging
+import operator
+import random
+import threading
+import weakref
+from copy import deepcopy
+
+from django.db import connection as default_connection
+from django.db import connections, router, transaction
+
+from ..aggregate import Aggregate
+from ..group import Group, decode_group
+from ..unit_of_work import get_unit_of_work
+from .cache import CHANNEL, cache, notify_changed
+
+
+# SQL operators for aggregate_add implementations that can be done in the
+# database directly.
+DELTA_OPERATORS = {
+    operator.add: '+',
+    operator.mul: '*',
+}
+
+logger = logging.getLogger(__name__)
+
+# Tallies that buffer changes, flushed when the process exits
+_buffered = weakref.WeakSet()
+
+
+def is_number(value):
+    """
+    Whether a value is a number that can be used in SQL arithmetic.
+
+    @param value: Any
+    @return: bool
+    """
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# Columns of Data a tally can be stored in with their placeholders
+DATA_COLUMNS = {
+    'value': '%s::jsonb',
+    'int_value': '%s::bigint',
+    'float_value': '%s::double precision',
+}
+
+
+def get_numeric_expression(column, quote_name, table=None):
+    """
+    Get an SQL expression for the numeric value of a Data row. The value is
+    read from a column, or from the other columns when that column is empty
+    because the tally switched to it.
+
+    @param column: str
+        The column the value should be stored in.
+    @param quote_name: Callable[[str], str]
+        Function to quote names with.
+    @param table: str
+        The quoted table to qualify the columns with.
+    @return: str
+        The SQL expression.
+    """
+    expressions = []
+    for data_column in [column] + [
+        data_column for data_column in DATA_COLUMNS if data_column != column
+    ]:
+        name = quote_name(data_column)
+        if table is not None:
+            name = '{}.{}'.format(table, name)
+        if data_column == 'value':
+            expressions.append("({} #>> '{{}}')::numeric".format(name))
+        else:
+            expressions.append('{}::numeric'.format(name))
+    return 'COALESCE({})'.format(', '.join(expressions))
+
+
+def get_clear_columns(column, quote_name):
+    """
+    Get the SQL assignments that clear the columns of a Data row other than
+    the column the value is stored in.
+
+    @param column: str
+        The column the value is stored in.
+    @param quote_name: Callable[[str], str]
+        Function to quote names with.
+    @return: str
+        The assignments, prefixed with a comma.
+    """
+    return ''.join(
+        ', {} = NULL'.format(quote_name(data_column))
+        for data_column in DATA_COLUMNS
+        if data_column != column
+    )
+
+
+def get_column_values(column, value):
+    """
+    Get the values of all columns of a Data row that stores a value in a
+    column.
+
+    @param column: str
+        The column to store the value in.
+    @param value: Any
+        The value.
+    @return: Mapping[str, Any]
+        The values by column.
+    """
+    values = dict.fromkeys(DATA_COLUMNS)
+    values[column] = value
+    return values
+
+
+# Marks a path that was removed in a diff
+_deleted = object()
+
+
+def normalize_json(value):
+    """
+    Normalize a value to how it is stored as JSON, like tuples becoming
+    lists and keys becoming strings.
+
+    @param value: Any
+        The value to normalize.
+    @return: Any
+        The normalized value.
+    """
+    return json.loads(json.dumps(value))
+
+
+def diff_json(old_value, new_value, path=()):
+    """
+    Get the paths that have to be changed to turn one JSON value into
+    another.
+
+    @param old_value: Any
+        The old JSON value.
+    @param new_value: Any
+        The new JSON value.
+    @param path: Tuple[str]
+        Path of the values in the document.
+    @return: List[(Tuple[str], Any)]
+        The paths with their new values, or _deleted if the path has to be
+        removed. When the whole value changes the only path is the path of
+        the value itself.
+    """
+    if type(old_value) is not type(new_value):
+        return [(path, new_value)]
+
+    if isinstance(new_value, dict):
+        operations = []
+        for key in old_value:
+            if key not in new_value:
+                operations.append((path + (key,), _deleted))
+        for key, value in new_value.items():
+            if key not in old_value:
+                operations.append((path + (key,), value))
+            else:
+                operations.extend(
+                    diff_json(old_value[key], value, path + (key,))
+                )
+        return operations
+
+    if isinstance(new_value, list) and len(old_value) == len(new_value):
+        operations = []
+        for index, new_item in enumerate(new_value):
+            operations.extend(
+                diff_json(old_value[index], new_item, path + (str(index),))
+            )
+        return operations
+
+    if old_value == new_value:
+        return []
+    return [(path, new_value)]
+
+
+def get_patch_expression(old_value, new_value, column):
+    """
+    Get an SQL expression that turns the JSON value of a column into a new
+    value by only changing the paths that differ.
+
+    @param old_value: Any
+        The current value of the column.
+    @param new_value: Any
+        The new value.
+    @param column: str
+        The quoted column.
+    @return: (str, List[Any])
+        The expression and its parameters, or None if nothing changed.
+    """
+    new_value = normalize_json(new_value)
+    operations = diff_json(normalize_json(old_value), new_value)
+    if not operations:
+        return None
+    patch_size = sum(
+        len(json.dumps(value))
+        for _, value in operations
+        if value is not _deleted
+    )
+    if patch_size >= len(json.dumps(new_value)):
+        # Writing the whole value is cheaper
+        operations = [((), new_value)]
+
+    expression = column
+    params = []
+    for path, value in operations:
+        if value is _deleted:
+            expression = '({} #- %s::text[])'.format(expression)
+            params.append(list(path))
+        elif not path:
+            expression = '%s::jsonb'
+            params = [json.dumps(value)]
+        else:
+            expression = 'jsonb_set({}, %s::text[], %s::jsonb)'.format(
+                expression,
+            )
+            params.extend([list(path), json.dumps(value)])
+    return expression, params
+
+
+@atexit.register
+def flush_all():
+    """
+    Flush the buffered changes of all DBStored tallies.
+    """
+    for tally in list(_buffered):
+        tally.flush()
+
+
+def ensure_data_many(tallies, batch_size=5000):
+    """
+    Create the missing Data rows of DBStored tallies with a single INSERT per
+    batch of rows.
+
+    @param tallies: Iterable[DBStored]
+        The tallies to ensure the data of.
+    @param batch_size: int
+        Maximum number of rows to insert per query.
+    """
+    from .models import Data
+
+    rows = {}
+    for tally in tallies:
+        if tally.group_rows:
+            tally.ensure_data()
+            continue
+        for name, value in tally.get_initial_data():
+            rows.setdefault(name, (tally.db_column, value))
+    rows = list(rows.items())
+
+    using = router.db_for_write(Data)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            params = []
+            for name, (column, value) in batch:
+                params.append(name)
+                for data_column in DATA_COLUMNS:
+                    if data_column != column or value is None:
+                        params.append(None)
+                    elif column == 'value':
+                        params.append(json.dumps(value))
+                    else:
+                        params.append(value)
+            cursor.execute(
+                'INSERT INTO {table} ({name}, {columns}) VALUES {values} '
+                'ON CONFLICT ({name}) DO NOTHING'
+                .format(
+                    table=quote_name(Data._meta.db_table),
+                    name=quote_name('name'),
+                    columns=', '.join(map(quote_name, DATA_COLUMNS)),
+                    values=', '.join(
+                        ['(%s, {})'.format(', '.join(DATA_COLUMNS.values()))] *
+                        len(batch)
+                    ),
+                ),
+                params,
+            )
+
+
+class DataWriter:
+    """
+    Writes the changes of all DBStored tallies in a unit of work together.
+    Rows that are changed in Python are locked and read with one query and
+    written with one query, deltas are written with one query per column
+    and operator.
+    """
+
+    def __init__(self, using):
+        """
+        Initialize DataWriter.
+
+        @param using: str
+            Alias of the database to write to.
+        """
+        self.using = using
+        self.changes = []
+
+    def add(self, tally, pairs):
+        """
+        Add changes to a tally.
+
+        @param tally: DBStored
+            The tally.
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        """
+        self.changes.append((tally, pairs))
+
+    def commit(self):
+        """
+        Write the collected changes.
+        """
+        if len(self.changes) == 1:
+            tally, pairs = self.changes[0]
+            tally._write_changes(pairs)
+            return
+
+        deltas = {}
+        changes = []
+        names = set()
+        notify = set()
+        for tally, pairs in self.changes:
+            name = tally._choose_shard()
+            names.add(name)
+            if tally.db_notify:
+                notify.add(name)
+            operator = tally.get_delta_operator()
+            if operator is not None:
+                delta = tally.get_delta(pairs)
+                if is_number(delta):
+                    if delta == tally.aggregate_id:
+                        continue
+                    batch = deltas.setdefault((tally.db_column, operator), {})
+                    if name in batch:
+                        delta = tally.apply_delta(batch[name], delta)
+                    batch[name] = delta
+                    continue
+            changes.append((tally, name, pairs))
+
+        connection = connections[self.using]
+        with transaction.atomic(using=self.using):
+            with connection.cursor() as cursor:
+                if changes:
+                    self._write_changes(cursor, changes)
+                for (column, operator), batch in deltas.items():
+                    self._write_deltas(cursor, column, operator, batch)
+            if notify:
+                notify_changed(sorted(notify), self.using)
+            cache.evict_on_commit(names, self.using)
+
+    def _write_changes(self, cursor, changes):
+        """
+        Apply changes to rows in Python and write the rows.
+
+        @param cursor: CursorWrapper
+            The cursor to write with.
+        @param changes: List[(DBStored, str, List[(Any, Any)])]
+            The tallies with the names of their rows and their changes.
+        """
+        from .models import Data
+
+        names = {name for _, name, _ in changes}
+        rows = {
+            data.name: data
+            for data in (
+                Data.objects
+                .using(self.using)
+                .select_for_update()
+                .filter(name__in=names)
+            )
+        }
+
+        old_values = {}
+        new_values = {}
+        columns = {}
+        patch = {}
+        for tally, name, pairs in changes:
+            if name not in rows:
+                raise Data.DoesNotExist(
+                    'No data associated with {}'.format(name)
+                )
+            if name not in new_values:
+                old_values[name] = rows[name].get_column(tally.db_column)
+                new_values[name] = deepcopy(old_values[name])
+                columns[name] = tally.db_column
+                patch[name] = True
+            if tally.shards is not None:
+                new_values[name] = tally.apply_delta(
+                    new_values[name], tally.get_delta(pairs),
+                )
+            else:
+                new_values[name] = tally.handle_changes(
+                    new_values[name], pairs,
+                )
+            patch[name] = (
+                patch[name] and tally.db_patch and tally.db_column == 'value'
+            )
+
+        quote_name = cursor.db.ops.quote_name
+        table = quote_name(Data._meta.db_table)
+        name_column = quote_name('name')
+        value_column = quote_name('value')
+
+        # Rows are either patched with a CASE or written whole
+        cases = []
+        case_params = []
+        patched = []
+        values = []
+        params = []
+        for name, new_value in new_values.items():
+            if patch[name]:
+                expression = get_patch_expression(
+                    old_values[name], new_value, value_column,
+                )
+                if expression is not None:
+                    cases.append('WHEN %s THEN {}'.format(expression[0]))
+                    case_params.extend([name] + expression[1])
+                    patched.append(name)
+                continue
+
+            params.append(name)
+            for column in DATA_COLUMNS:
+                if column != columns[name] or new_value is None:
+                    params.append(None)
+                elif column == 'value':
+                    params.append(json.dumps(new_value))
+                else:
+                    params.append(new_value)
+            values.append(
+                '(%s, {})'.format(', '.join(DATA_COLUMNS.values()))
+            )
+
+        if values:
+            cursor.execute(
+                'UPDATE {table} SET {sets} FROM (VALUES {values}) '
+                'AS changed ({name}, {columns}) '
+                'WHERE {table}.{name} = changed.{name}'
+                .format(
+                    table=table,
+                    sets=', '.join(
+                        '{column} = changed.{column}'.format(
+                            column=quote_name(column),
+                        )
+                        for column in DATA_COLUMNS
+                    ),
+                    values=', '.join(values),
+                    name=name_column,
+                    columns=', '.join(map(quote_name, DATA_COLUMNS)),
+                ),
+                params,
+            )
+
+        if cases:
+            cursor.execute(
+                'UPDATE {table} SET {value} = CASE {name} {cases} END{clear} '
+                'WHERE {name} IN ({names})'
+                .format(
+                    table=table,
+                    value=value_column,
+                    clear=get_clear_columns('value', quote_name),
+                    name=name_column,
+                    cases=' '.join(cases),
+                    names=', '.join(['%s'] * len(patched)),
+                ),
+                case_params + patched,
+            )
+
+    def _write_deltas(self, cursor, column, operator, deltas):
+        """
+        Apply deltas to a column of rows in the database.
+
+        @param cursor: CursorWrapper
+            The cursor to write with.
+        @param column: str
+            The column to apply the deltas to.
+        @param operator: str
+            The SQL operator to apply the deltas with.
+        @param deltas: Mapping[str, Union[int, float]]
+            The deltas by the name of their row.
+        """
+        from .models import Data
+
+        quote_name = cursor.db.ops.quote_name
+        table = quote_name(Data._meta.db_table)
+        update = '{} {} changed.delta'.format(
+            get_numeric_expression(column, quote_name, table), operator,
+        )
+        if column == 'value':
+            update = 'to_jsonb({})'.format(update)
+
+        params = []
+        for name, delta in deltas.items():
+            params.extend([name, delta])
+        cursor.execute(
+            'UPDATE {table} SET {column} = {update}{clear} '
+            'FROM (VALUES {values}) AS changed ({name}, delta) '
+            'WHERE {table}.{name} = changed.{name}'
+            .format(
+                table=table,
+                column=quote_name(column),
+                update=update,
+                clear=get_clear_columns(column, quote_name),
+                values=', '.join(['(%s, %s::numeric)'] * len(deltas)),
+                name=quote_name('name'),
+            ),
+            params,
+        )
+        if cursor.rowcount < len(deltas):
+            raise Data.DoesNotExist(
+                'No data associated with some of {}'
+                .format(', '.join(sorted(deltas)))
+            )
 
 
 class DBStored:
@@ -8,23 +523,654 @@ class DBStored:
 
     # Name associated with the data
     db_name = None
+    # Number of rows to spread writes over to avoid contention on a single
+    # row, the stored value is the combination of all rows. Requires the
+    # tally to be an Aggregate.
+    shards = None
+    # Milliseconds to buffer changes in memory for before writing them to
+    # the database in the background. Requires the tally to be an Aggregate.
+    flush_interval = None
+    # Number of changes to buffer in memory before writing them to the
+    # database in the background. Requires the tally to be an Aggregate.
+    flush_events = None
+    # Maximum number of changes to buffer. Changes that would exceed it wake
+    # up the background flush and wait until it drained the buffer.
+    max_pending = 10000
+    # Milliseconds a change waits for the buffer to drain below max_pending.
+    # After that it is buffered anyway so committed changes are never lost,
+    # the buffer only grows past max_pending when flushing is slower than
+    # this or keeps failing.
+    max_pending_wait = 1000
+    # Column of Data to store the tally in, either value for any JSON value,
+    # or int_value or float_value for scalar tallies.
+    db_column = 'value'
+    # Whether to notify the data cache of other processes of changes with
+    # pg_notify, notifications are sent when the transaction commits. Commits
+    # of notifying transactions are serialized by Postgres. Has to be enabled
+    # when other processes read the data through a started cache, the cache
+    # of this process is evicted on commit either way.
+    db_notify = False
+    # Whether to write only the parts of the JSON value that changed instead
+    # of the whole value.
+    db_patch = False
+    # Whether to store every group of a grouped aggregate in its own
+    # GroupData row, so a change only writes the groups it affects.
+    group_rows = False
 
     def __init__(self):
+        if not isinstance(self, Aggregate):
+            if self.shards is not None:
+                raise TypeError('only aggregates can be sharded')
+            if self.is_buffered():
+                raise TypeError('only aggregates can be buffered')
+        if self.group_rows:
+            if not isinstance(self, Group) or not isinstance(self, Aggregate):
+                raise TypeError('only grouped aggregates can use group rows')
+            if self.shards is not None:
+                raise TypeError('group rows can not be sharded')
+        if self.db_column not in DATA_COLUMNS:
+            raise ValueError(
+                'db_column must be one of {}'.format(', '.join(DATA_COLUMNS))
+            )
+        if self.db_column != 'value' and isinstance(self, Group):
+            raise TypeError('groups can only be stored in value')
         super().__init__(None)
+        self.__pending = None
+        self.__pending_events = 0
+        # Notified when the buffer drains
+        self.__pending_lock = threading.Condition()
+        self.__flush_lock = threading.Lock()
+        self.__flusher = None
+        self.__flusher_lock = threading.Lock()
+        self.__wakeup = threading.Event()
+        self.__stopped = threading.Event()
         self.ensure_data()
 
+    def is_buffered(self):
+        """
+        Whether changes are buffered in memory before they are written.
+
+        @return: bool
+        """
+        return self.flush_interval is not None or self.flush_events is not None
+
+    def get_shard_names(self):
+        """
+        Get the names of the rows the data is stored in. The first row holds
+        the tally, the other rows deltas on top of it.
+
+        @return: List[str]
+            The names of the rows.
+        """
+        if self.shards is None:
+            return [self.db_name]
+        return [self.db_name] + [
+            '{}#{}'.format(self.db_name, shard)
+            for shard in range(1, self.shards)
+        ]
+
+    def get_initial_data(self):
+        """
+        Get the Data rows to create when the tally is not stored yet.
+
+        @return: List[(str, Any)]
+            The names and values of the rows.
+        """
+        return [(self.db_name, self.get_tally())] + [
+            (name, self.get_delta([]))
+            for name in self.get_shard_names()[1:]
+        ]
+
     def ensure_data(self):
         from .models import Data
 
-        if not Data.objects.filter(name=self.db_name).exists():
-            Data(name=self.db_name, value=self.get_tally()).save()
+        if not self.group_rows:
+            ensure_data_many([self])
+        elif not Data.objects.filter(name=self.db_name).exists():
+            # The groups are stored as GroupData, the Data only marks that
+            # they were initialized.
+            with transaction.atomic():
+                Data(name=self.db_name, value=None).save()
+                self._store_groups(self.get_tally())
+
+    def get_stored(self):
+        """
+        Get the stored value of the tally.
+
+        @return: Any
+            The stored value, combined over all shards.
+        """
+        from .models import Data, GroupData
+
+        if self.group_rows:
+            return {
+                decode_group(group_key): value
+                for group_key, value in (
+                    GroupData.objects
+                    .filter(name=self.db_name)
+                    .values_list('group_key', 'value')
+                )
+            }
+
+        names = self.get_shard_names()
+        values = cache.get_many(names)
+        try:
+            tally = values[self.db_name]
+        except KeyError:
+            raise Data.DoesNotExist(
+                'No data associated with {}'.format(self.db_name)
+            )
+        for name in names[1:]:
+            if name in values:
+                tally = self.apply_delta(tally, values[name])
+        return tally
+
+    def get_stored_group(self, group):
+        """
+        Get the stored value of a single group when group_rows is enabled.
+
+        @param group: Any
+            The group.
+        @return: Any
+            The stored value of the group, the identity of the aggregate
+            when the group has no row.
+        """
+        from .models import GroupData
+
+        try:
+            return GroupData.objects.get(
+                name=self.db_name, group_key=self.encode_group(group),
+            ).value
+        except GroupData.DoesNotExist:
+            return self.aggregate_id
+
+    def encode_group(self, group):
+        """
+        Encode a group as the group_key of a GroupData row.
+
+        @param group: Any
+            The group, has to be JSON serializable.
+        @return: str
+            The group key.
+        """
+        return json.dumps(group, sort_keys=True)
+
+    def get_delta_operator(self):
+        """
+        Get the SQL operator to apply a delta to the stored value with in a
+        single query.
+
+        @return: str
+            The operator or None if deltas can not be applied in the
+            database.
+        """
+        if not isinstance(self, Aggregate):
+            return None
+        if isinstance(self, Group) and not self.group_rows:
+            return None
+        return DELTA_OPERATORS.get(type(self).aggregate_add)
 
-    def handle_change(self, tally, old_value, new_value):
+    def _choose_shard(self):
+        """
+        Choose the row to write changes to.
+
+        @return: str
+            The name of the row.
+        """
+        return random.choice(self.get_shard_names())
+
+    def _execute_update(self, cursor, sql, params, name):
+        """
+        Execute an UPDATE of a Data row, notifying the data cache of the
+        updated row if db_notify is enabled.
+
+        @param cursor: CursorWrapper
+            The cursor to execute the query with.
+        @param sql: str
+            The UPDATE query.
+        @param params: List[Any]
+            The parameters of the query.
+        @param name: str
+            The name of the updated row.
+        @return: int
+            The number of updated rows.
+        """
+        cache.evict_on_commit([name], cursor.db.alias)
+        if self.db_notify:
+            name = cursor.db.ops.quote_name('name')
+            sql = (
+                'WITH updated AS ({sql} RETURNING {name}) '
+                'SELECT pg_notify(%s, {name}) FROM updated'
+                .format(sql=sql, name=name)
+            )
+            params = params + [CHANNEL]
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+    def _notify(self, names):
+        """
+        Evict changed rows from the data cache of this process when the
+        transaction commits, and notify the data cache of other processes if
+        db_notify is enabled.
+
+        @param names: List[str]
+            Names of the changed rows.
+        """
         from .models import Data
 
-        with transaction.atomic():
-            data = Data.objects.get(name=self.db_name)
-            data.value = super().handle_change(
-                data.value, old_value, new_value
+        using = router.db_for_write(Data)
+        cache.evict_on_commit(names, using)
+        if self.db_notify:
+            notify_changed(names, using)
+
+    def _apply_delta(self, delta, name):
+        """
+        Apply a numeric delta to a stored row in a single UPDATE.
+
+        @param delta: Union[int, float]
+            The delta to apply.
+        @param name: str
+            Name of the row.
+        """
+        from .models import Data
+
+        if delta == self.aggregate_id:
+            return
+
+        using = router.db_for_write(Data)
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        update = '{} {} %s'.format(
+            get_numeric_expression(self.db_column, quote_name),
+            self.get_delta_operator(),
+        )
+        if self.db_column == 'value':
+            update = 'to_jsonb({})'.format(update)
+        with connection.cursor() as cursor:
+            rowcount = self._execute_update(
+                cursor,
+                'UPDATE {table} SET {column} = {update}{clear} '
+                'WHERE {name} = %s'
+                .format(
+                    table=quote_name(Data._meta.db_table),
+                    column=quote_name(self.db_column),
+                    update=update,
+                    clear=get_clear_columns(self.db_column, quote_name),
+                    name=quote_name('name'),
+                ),
+                [delta, name],
+                name,
             )
+            if rowcount == 0:
+                raise Data.DoesNotExist(
+                    'No data associated with {}'.format(name)
+                )
+
+    def _store_delta(self, delta):
+        """
+        Write a delta obtained with get_delta to the database.
+
+        @param delta: Any
+            The delta to write.
+        """
+        from .models import Data
+
+        if self.group_rows:
+            self._store_group_delta(delta)
+            return
+
+        name = self._choose_shard()
+        if self.get_delta_operator() is not None and is_number(delta):
+            self._apply_delta(delta, name)
+            return
+
+        with transaction.atomic():
+            # Other writers can pick the same shard
+            data = Data.objects.select_for_update().get(name=name)
+            data.set_column(self.db_column, self.apply_delta(
+                data.get_column(self.db_column), delta,
+            ))
             data.save()
+            self._notify([name])
+
+    def _apply_changes(self, pairs):
+        from .models import Data
+
+        work = get_unit_of_work()
+        if self.is_buffered():
+            # Changes are only buffered once they are committed, rolled back
+            # changes are never written
+            delta = self.get_delta(pairs)
+            transaction.on_commit(
+                lambda: self._buffer_delta(delta, len(pairs)),
+                using=None if work is None else work.using,
+            )
+        elif work is not None and not self.group_rows:
+            work.get_writer(
+                (DataWriter, router.db_for_write(Data)),
+                lambda: DataWriter(router.db_for_write(Data)),
+            ).add(self, pairs)
+        else:
+            self._write_changes(pairs)
+
+    def _write_changes(self, pairs):
+        """
+        Write a batch of changes to the database right away.
+
+        @param pairs: List[(Any, Any)]
+            Non empty list of (old_value, new_value) pairs of the changed
+            models.
+        """
+        from .models import Data
+
+        if (
+            self.group_rows or
+            self.shards is not None or
+            self.get_delta_operator() is not None
+        ):
+            self._store_delta(self.get_delta(pairs))
+        elif self.db_patch and self.db_column == 'value':
+            with transaction.atomic():
+                old_value = (
+                    Data.objects
+                    .select_for_update()
+                    .get(name=self.db_name)
+                    .get_column('value')
+                )
+                new_value = self.handle_changes(deepcopy(old_value), pairs)
+                self._patch_value(old_value, new_value)
+        else:
+            with transaction.atomic():
+                data = Data.objects.select_for_update().get(name=self.db_name)
+                data.set_column(self.db_column, self.handle_changes(
+                    data.get_column(self.db_column), pairs,
+                ))
+                data.save()
+                self._notify([self.db_name])
+
+    def _patch_value(self, old_value, new_value):
+        """
+        Update the stored value by only writing the paths that changed.
+
+        @param old_value: Any
+            The stored value.
+        @param new_value: Any
+            The value to store.
+        """
+        from .models import Data
+
+        using = router.db_for_write(Data)
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        patch = get_patch_expression(
+            old_value, new_value, quote_name('value'),
+        )
+        if patch is None:
+            return
+        expression, params = patch
+
+        with connection.cursor() as cursor:
+            self._execute_update(
+                cursor,
+                'UPDATE {table} SET {value} = {expression}{clear} '
+                'WHERE {name} = %s'
+                .format(
+                    table=quote_name(Data._meta.db_table),
+                    value=quote_name('value'),
+                    expression=expression,
+                    clear=get_clear_columns('value', quote_name),
+                    name=quote_name('name'),
+                ),
+                params + [self.db_name],
+                self.db_name,
+            )
+
+    def _store_group_delta(self, delta):
+        """
+        Write a delta of a grouped aggregate to the GroupData rows of the
+        affected groups.
+
+        @param delta: Mapping[Any, Any]
+            The delta per group.
+        """
+        from .models import GroupData
+
+        delta = {
+            group: value
+            for group, value in delta.items()
+            if value != self.aggregate_id
+        }
+        if not delta:
+            return
+
+        operator = self.get_delta_operator()
+        if operator is not None and all(map(is_number, delta.values())):
+            # The delta of a new group is its value
+            self._upsert_groups(delta, operator)
+            return
+
+        with transaction.atomic():
+            keys = {self.encode_group(group): group for group in delta}
+            tally = {
+                keys[group_key]: value
+                for group_key, value in (
+                    GroupData.objects
+                    .select_for_update()
+                    .filter(name=self.db_name, group_key__in=keys)
+                    .values_list('group_key', 'value')
+                )
+            }
+            tally = self.apply_delta(tally, delta)
+            self._upsert_groups({group: tally[group] for group in delta})
+
+    def _store_groups(self, groups):
+        """
+        Replace all GroupData rows of the tally.
+
+        @param groups: Mapping[Any, Any]
+            The value per group.
+        """
+        from .models import GroupData
+
+        GroupData.objects.filter(name=self.db_name).delete()
+        GroupData.objects.bulk_create([
+            GroupData(
+                name=self.db_name,
+                group_key=self.encode_group(group),
+                value=value,
+            )
+            for group, value in groups.items()
+        ])
+
+    def _upsert_groups(self, groups, operator=None):
+        """
+        Insert or update the GroupData rows of groups in a single query.
+
+        @param groups: Mapping[Any, Any]
+            The value per group.
+        @param operator: str
+            SQL operator to combine the values with the stored values with.
+            When None the stored values are replaced.
+        """
+        from .models import GroupData
+
+        using = router.db_for_write(GroupData)
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        table = quote_name(GroupData._meta.db_table)
+        value = quote_name('value')
+
+        if operator is None:
+            update = 'EXCLUDED.{value}'.format(value=value)
+        else:
+            update = (
+                "to_jsonb(({table}.{value} #>> '{{}}')::numeric {operator} "
+                "(EXCLUDED.{value} #>> '{{}}')::numeric)"
+                .format(table=table, value=value, operator=operator)
+            )
+
+        params = []
+        for group, group_value in groups.items():
+            params.extend([
+                self.db_name, self.encode_group(group),
+                json.dumps(group_value),
+            ])
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} ({name}, {group_key}, {value}) '
+                'VALUES {values} '
+                'ON CONFLICT ({name}, {group_key}) '
+                'DO UPDATE SET {value} = {update}'
+                .format(
+                    table=table,
+                    name=quote_name('name'),
+                    group_key=quote_name('group_key'),
+                    value=value,
+                    values=', '.join(['(%s, %s, %s::jsonb)'] * len(groups)),
+                    update=update,
+                ),
+                params,
+            )
+
+    def _buffer_delta(self, delta, events):
+        """
+        Add a committed delta to the buffer. Flushing is left to the
+        background flusher so it never writes inside the transaction of the
+        thread that made the change.
+
+        @param delta: Any
+            The delta obtained with get_delta.
+        @param events: int
+            The number of changes in the delta.
+        """
+        with self.__pending_lock:
+            if self.__pending_events >= self.max_pending:
+                self._start_flusher()
+                self.__wakeup.set()
+                if not self.__pending_lock.wait_for(
+                    lambda: self.__pending_events < self.max_pending,
+                    self.max_pending_wait / 1000,
+                ):
+                    logger.warning(
+                        'Buffer of tally {} is still full after {}ms'
+                        .format(self.db_name, self.max_pending_wait)
+                    )
+            if self.__pending is None:
+                self.__pending = delta
+            else:
+                self.__pending = self.apply_delta(self.__pending, delta)
+            self.__pending_events += events
+            events = self.__pending_events
+
+        _buffered.add(self)
+        if (
+            events >= self.max_pending or
+            (self.flush_events is not None and events >= self.flush_events)
+        ):
+            self._start_flusher()
+            self.__wakeup.set()
+        elif self.flush_interval is not None:
+            self._start_flusher()
+
+    def _start_flusher(self):
+        """
+        Start the background flusher if it is not running yet.
+        """
+        with self.__flusher_lock:
+            if self.__flusher is not None:
+                return
+            self.__stopped.clear()
+            self.__flusher = threading.Thread(
+                target=self._run_flusher,
+                name='tally-flush-{}'.format(self.db_name),
+                daemon=True,
+            )
+            self.__flusher.start()
+
+    def _run_flusher(self):
+        """
+        Flush the buffer every flush_interval milliseconds, or when woken up
+        because the buffer is full, until stopped.
+        """
+        timeout = (
+            None if self.flush_interval is None
+            else self.flush_interval / 1000
+        )
+        try:
+            while True:
+                self.__wakeup.wait(timeout)
+                if self.__stopped.is_set():
+                    return
+                self.__wakeup.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    logger.exception(
+                        'Failed to flush tally {}'.format(self.db_name)
+                    )
+        finally:
+            default_connection.close()
+
+    def flush(self):
+        """
+        Write the buffered changes to the database in a single transaction.
+        Changes are put back in the buffer when writing fails.
+        """
+        with self.__flush_lock:
+            with self.__pending_lock:
+                delta = self.__pending
+                events = self.__pending_events
+                self.__pending = None
+                self.__pending_events = 0
+            if delta is None:
+                return
+
+            try:
+                self._store_delta(delta)
+            except Exception:
+                with self.__pending_lock:
+                    if self.__pending is not None:
+                        delta = self.apply_delta(delta, self.__pending)
+                    self.__pending = delta
+                    self.__pending_events += events
+                raise
+
+            with self.__pending_lock:
+                self.__pending_lock.notify_all()
+
+    def stop(self):
+        """
+        Stop flushing in the background and flush the buffered changes.
+        """
+        with self.__flusher_lock:
+            flusher, self.__flusher = self.__flusher, None
+            self.__stopped.set()
+            self.__wakeup.set()
+        if flusher is not None:
+            flusher.join()
+        self.__wakeup.clear()
+        self.flush()
+
+    def _replace_tally(self, tally):
+        from .models import Data
+
+        if self.is_buffered():
+            # The new tally already includes the buffered changes
+            with self.__pending_lock:
+                self.__pending = None
+                self.__pending_events = 0
+                self.__pending_lock.notify_all()
+
+        with transaction.atomic():
+            if self.group_rows:
+                self._store_groups(tally)
+                return
+            Data.objects.filter(name=self.db_name).update(
+                **get_column_values(self.db_column, tally)
+            )
+            for name in self.get_shard_names()[1:]:
+                Data.objects.filter(name=name).update(
+                    **get_column_values(self.db_column, self.get_delta([]))
+                )
+            self._notify(self.get_shard_names())
@@ -0,0 +1,29 @@
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0003_data_to_json'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupData',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID',
+                )),
+                ('name', models.TextField()),
+                ('group_key', models.TextField()),
+                ('value', django.contrib.postgres.fields.jsonb.JSONField(
+                    blank=True, null=True,
+                )),
+            ],
+            options={
+                'unique_together': {('name', 'group_key')},
+            },
+        ),
+    ]
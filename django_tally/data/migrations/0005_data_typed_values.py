@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data', '0004_groupdata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='data',
+            name='int_value',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='data',
+            name='float_value',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+    ]
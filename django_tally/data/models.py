@@ -9,3 +9,59 @@ class Data(models.Model):
 
     name = models.TextField(primary_key=True)
     value = pg_fields.JSONField(blank=True, null=True)
+    # Typed columns for scalar tallies that set DBStored.db_column
+    int_value = models.BigIntegerField(blank=True, null=True, db_index=True)
+    float_value = models.FloatField(blank=True, null=True, db_index=True)
+
+    @property
+    def stored_value(self):
+        """
+        The value of the data, from the column it is stored in.
+        """
+        if self.int_value is not None:
+            return self.int_value
+        if self.float_value is not None:
+            return self.float_value
+        return self.value
+
+    def get_column(self, column):
+        """
+        Get the value of the data from a column. When the column is empty
+        the value is taken from the column the data was stored in before, so
+        tallies can switch columns.
+
+        @param column: str
+            The column the value should be stored in.
+        @return: Any
+            The value of the data.
+        """
+        value = getattr(self, column)
+        if value is None:
+            value = self.stored_value
+        return value
+
+    def set_column(self, column, value):
+        """
+        Set the value of the data in a column and clear the other columns.
+
+        @param column: str
+            The column to store the value in.
+        @param value: Any
+            The value of the data.
+        """
+        self.value = self.int_value = self.float_value = None
+        setattr(self, column, value)
+
+
+class GroupData(models.Model):
+    """
+    Saves the tally of a single group on behalf of the DBStored mixin when
+    group_rows is enabled.
+    """
+
+    name = models.TextField()
+    group_key = models.TextField()
+    value = pg_fields.JSONField(blank=True, null=True)
+
+    class Meta:
+        unique_together = [('name', 'group_key')]
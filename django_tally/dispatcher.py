@@ -0,0 +1,147 @@
+import threading
+
+from django.db.models.signals import (
+    post_init, pre_save, post_save, pre_delete, post_delete,
+)
+
+from .signals import post_bulk_change
+from .unit_of_work import unit_of_work
+
+
+class TallyDispatcher:
+    """
+    Receives the signals of a single model and fans them out to all tallies
+    listening on that model. This way every signal has one receiver per
+    model, no matter how many tallies listen on it, and values are shared
+    between tallies with the same value spec.
+    """
+
+    _dispatchers = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model):
+        """
+        Get the dispatcher for a model.
+
+        @param model: Class
+            The model to get the dispatcher for.
+        @return: TallyDispatcher
+            The dispatcher for the model.
+        """
+        try:
+            return cls._dispatchers[model]
+        except KeyError:
+            with cls._lock:
+                return cls._dispatchers.setdefault(model, cls(model))
+
+    def __init__(self, model):
+        """
+        Initialize TallyDispatcher.
+
+        @param model: Class
+            The model to dispatch the signals of.
+        """
+        self.model = model
+        self.tallies = {}
+        self._receivers = [
+            (post_init, self._handle_post_init),
+            (pre_save, self._handle_pre_change),
+            (post_save, self._handle_post_save),
+            (pre_delete, self._handle_pre_change),
+            (post_delete, self._handle_post_delete),
+            (post_bulk_change, self._handle_post_bulk_change),
+        ]
+
+    def connect(self, tally):
+        """
+        Start dispatching signals to a tally.
+
+        @param tally: Tally
+            The tally to dispatch signals to.
+        """
+        if tally in self.tallies:
+            return
+        if not self.tallies:
+            for signal, handler in self._receivers:
+                signal.connect(handler, sender=self.model, weak=False)
+        self.tallies[tally] = None
+        tally._subscribe()
+
+    def disconnect(self, tally):
+        """
+        Stop dispatching signals to a tally.
+
+        @param tally: Tally
+            The tally to stop dispatching signals to.
+        """
+        if tally not in self.tallies:
+            return
+        del self.tallies[tally]
+        tally._unsubscribe()
+        if not self.tallies:
+            for signal, handler in self._receivers:
+                signal.disconnect(handler, sender=self.model)
+
+    def _handle_post_init(self, **kwargs):
+        values = {}
+        for tally in list(self.tallies):
+            tally._handle_post_init(values=values, **kwargs)
+
+    def _handle_pre_change(self, **kwargs):
+        values = {}
+        for tally in list(self.tallies):
+            if tally._fetches_missing():
+                tally._handle_pre_change(values=values, **kwargs)
+
+    def _handle_post_save(self, **kwargs):
+        values = {}
+        with unit_of_work(kwargs.get('using')):
+            for tally in list(self.tallies):
+                tally._handle_post_save(values=values, **kwargs)
+
+    def _handle_post_delete(self, **kwargs):
+        values = {}
+        with unit_of_work(kwargs.get('using')):
+            for tally in list(self.tallies):
+                tally._handle_post_delete(values=values, **kwargs)
+
+    def _handle_post_bulk_change(self, **kwargs):
+        values = {}
+        with unit_of_work(kwargs.get('using')):
+            for tally in list(self.tallies):
+                tally._handle_post_bulk_change(values=values, **kwargs)
+
+
+class Dispatch:
+    """
+    Signal like interface to the dispatchers so that a tally can be added to
+    a Subscription as a receiver of a sender.
+    """
+
+    def connect(self, tally, sender=None, weak=True):
+        """
+        Connect a tally to the dispatcher of a model.
+
+        @param tally: Tally
+            The tally to connect.
+        @param sender: Class
+            The model to connect to.
+        @param weak: bool
+            Ignored, the dispatcher always keeps a strong reference.
+        """
+        TallyDispatcher.for_model(sender).connect(tally)
+
+    def disconnect(self, tally, sender=None):
+        """
+        Disconnect a tally from the dispatcher of a model.
+
+        @param tally: Tally
+            The tally to disconnect.
+        @param sender: Class
+            The model to disconnect from.
+        """
+        TallyDispatcher.for_model(sender).disconnect(tally)
+
+
+dispatch = Dispatch()
@@ -1,3 +1,36 @@
+import json
+
+from collections import defaultdict
+
+
+def _as_tuples(value):
+    """
+    Convert the lists in a decoded JSON value to tuples.
+
+    @param value: Any
+        The decoded JSON value.
+    @return: Any
+        The value with tuples instead of lists.
+    """
+    if isinstance(value, list):
+        return tuple(map(_as_tuples, value))
+    return value
+
+
+def decode_group(group_key):
+    """
+    Decode a group that was encoded as JSON.
+
+    @param group_key: str
+        The JSON encoded group.
+    @return: Any
+        The group.
+    """
+    # JSON has no tuples, lists can not be groups since they are not hashable
+    # so they must have been tuples
+    return _as_tuples(json.loads(group_key))
+
+
 class Group:
     """
     Mixin that allows for keeping seperate tallies for certain groups based on
@@ -6,6 +39,10 @@ class Group:
     as a delete on the old group and as a create on the new group.
     """
 
+    # ORM expression that does the same as get_group for a row in the
+    # database. Used to rebuild grouped aggregates with a single query.
+    group_expression = None
+
     def get_group(self, value):
         """
         Method to determine to which group a value belongs. A return value of
@@ -37,6 +74,39 @@ class Group:
     def get_tally(self):
         return {}
 
+    def get_delta(self, pairs):
+        delta = self.handle_changes(defaultdict(super().get_tally), pairs)
+        return dict(delta)
+
+    def apply_delta(self, tally, delta):
+        for group, value in delta.items():
+            if group not in tally:
+                tally[group] = super().get_tally()
+            tally[group] = super().apply_delta(tally[group], value)
+        return tally
+
+    def fold_queryset(self, tally, queryset):
+        get_expression = getattr(super(), 'get_aggregate_expression', None)
+        expression = None if get_expression is None else get_expression()
+        if self.group_expression is None or expression is None:
+            return NotImplemented
+
+        rows = (
+            queryset
+            .order_by()
+            .values(tally_group=self.group_expression)
+            .annotate(tally_value=expression)
+        )
+        for row in rows:
+            group = row['tally_group']
+            if group is None or row['tally_value'] is None:
+                continue
+            if group not in tally:
+                tally[group] = super().get_tally()
+            tally[group] = self.aggregate_add(tally[group], row['tally_value'])
+
+        return tally
+
     def handle_change(self, tally, old_value, new_value):
         old_group = self.get_group(old_value)
         new_group = self.get_group(new_value)
@@ -0,0 +1,221 @@
+import threading
+import weakref
+
+from collections import deque
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+# Marker for the snapshot of an instance that was deleted
+DELETED = object()
+
+
+class Segment:
+    """
+    The changes journaled during a contiguous stretch of time at one level of
+    savepoints. A segment is flushed through a transaction.on_commit hook
+    registered at that level, so Django discards the hook when one of the
+    savepoints, or the whole transaction, is rolled back.
+    """
+
+    def __init__(self, savepoint_ids):
+        """
+        Initialize Segment.
+
+        @param savepoint_ids: Tuple[str]
+            The ids of the savepoints that were active when the segment was
+            started.
+        """
+        self.savepoint_ids = savepoint_ids
+        self.snapshots = {}
+        self.changes = {}
+        self.flushed = False
+        # Weak reference to the on_commit hook, only Django keeps the hook
+        # alive so it dies when Django discards it on a rollback
+        self.hook = None
+
+    @property
+    def alive(self):
+        """
+        Whether the segment was neither flushed nor rolled back.
+        """
+        return not self.flushed and self.hook() is not None
+
+    def merge(self, other):
+        """
+        Add the changes of a later segment, netting the changes of an
+        instance in both segments into a single change.
+
+        @param other: Segment
+            The later segment.
+        """
+        self.snapshots.update(other.snapshots)
+        for key, change in other.changes.items():
+            if key in self.changes:
+                change = (self.changes[key][0], change[1])
+            self.changes[key] = change
+
+
+class ChangeJournal:
+    """
+    Journals changes to model instances made inside a database transaction
+    per savepoint. Segments of rolled back savepoints are discarded, the
+    other segments are merged when the transaction commits and handed over
+    at once, with the changes of an instance netted into a single
+    (old_value, new_value) pair. Changes made outside of a transaction are
+    handed over immediately.
+    """
+
+    def __init__(self, handle_segment):
+        """
+        Initialize ChangeJournal.
+
+        @param handle_segment: Function
+            Function that is called with a mapping of keys to new snapshots
+            and a list of (old_value, new_value) pairs when a transaction is
+            committed.
+        """
+        self._handle_segment = handle_segment
+        self._local = threading.local()
+
+    def add(self, key, snapshot, change=None, using=None):
+        """
+        Add a change to the journal.
+
+        @param key: Hashable
+            Key identifying the changed instance.
+        @param snapshot: Any
+            New snapshot of the instance, DELETED if it was deleted.
+        @param change: (Any, Any)
+            The (old_value, new_value) pair of the change, None if only the
+            snapshot changed.
+        @param using: str
+            Alias of the database the change was made in.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        connection = transaction.get_connection(using)
+        if not connection.in_atomic_block:
+            self._handle_segment(
+                {key: snapshot},
+                [] if change is None else [change],
+            )
+            return
+
+        segments, index, committed = self._get_state(using)
+        segment = self._get_segment(using, connection)
+        if key not in segment.snapshots:
+            index.setdefault(key, []).append(segment)
+        segment.snapshots[key] = snapshot
+        if change is not None:
+            if key in segment.changes:
+                change = (segment.changes[key][0], change[1])
+            segment.changes[key] = change
+
+    def get(self, key, using=None, default=None):
+        """
+        Get the latest snapshot of an instance journaled in the current
+        transaction.
+
+        @param key: Hashable
+            Key identifying the instance.
+        @param using: str
+            Alias of the database.
+        @param default: Any
+            Value to return when there is no snapshot in the journal.
+        @return: Any
+            The latest snapshot, DELETED if the instance was deleted.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        connection = transaction.get_connection(using)
+        if not connection.in_atomic_block:
+            return default
+        segments, index, committed = self._get_state(using)
+        key_segments = index.get(key)
+        # Segments that are not alive anymore are dropped on the way
+        while key_segments:
+            if key_segments[-1].alive:
+                return key_segments[-1].snapshots[key]
+            key_segments.pop()
+        index.pop(key, None)
+        return default
+
+    def _get_state(self, using):
+        """
+        Get the journal of the current thread for a database.
+
+        @param using: str
+            Alias of the database.
+        @return: (Deque[Segment], Mapping[Hashable, List[Segment]], Segment)
+            The segments in the order they were started, per key the
+            segments with a snapshot of that key in the same order, and the
+            segment the segments flushed so far in a commit are merged into.
+        """
+        journals = self._local.__dict__.setdefault('journals', {})
+        try:
+            return journals[using]
+        except KeyError:
+            state = journals[using] = (deque(), {}, Segment(()))
+            return state
+
+    def _prune(self, using):
+        """
+        Drop the oldest segments that are not alive anymore, and forget all
+        snapshots when no segment is left.
+
+        @param using: str
+            Alias of the database.
+        """
+        segments, index, committed = self._get_state(using)
+        while segments and not segments[0].alive:
+            segments.popleft()
+        if not segments:
+            index.clear()
+
+    def _get_segment(self, using, connection):
+        """
+        Get the segment to journal changes in, starting a new one when the
+        savepoints changed since the last segment was started.
+
+        @param using: str
+            Alias of the database.
+        @param connection: BaseDatabaseWrapper
+            Connection to the database.
+        @return: Segment
+            The segment to journal changes in.
+        """
+        segments, index, committed = self._get_state(using)
+        # Atomic blocks without a savepoint are registered as None, they can
+        # not be rolled back on their own
+        savepoint_ids = tuple(
+            savepoint_id
+            for savepoint_id in connection.savepoint_ids
+            if savepoint_id is not None
+        )
+        if (
+            segments and
+            segments[-1].savepoint_ids == savepoint_ids and
+            segments[-1].alive
+        ):
+            return segments[-1]
+
+        self._prune(using)
+        segment = Segment(savepoint_ids)
+
+        def flush():
+            segment.flushed = True
+            committed.merge(segment)
+            self._prune(using)
+            # The hooks of the segments that are still alive run later in
+            # the same commit
+            if segments:
+                return
+            snapshots = dict(committed.snapshots)
+            changes = list(committed.changes.values())
+            committed.snapshots.clear()
+            committed.changes.clear()
+            self._handle_segment(snapshots, changes)
+
+        segment.hook = weakref.ref(flush)
+        segments.append(segment)
+        transaction.on_commit(flush, using=using)
+        return segment
@@ -0,0 +1,342 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+
+from .group import Group, decode_group
+
+
+# Layout of a slot: hash of the key (0 for an empty slot), kind of the value
+# (b'i' for int64, b'f' for float64), the JSON encoded key, and the value.
+SLOT = struct.Struct('<Qc7x64s8s')
+HASH = struct.Struct('<Q')
+KEY_OFFSET = 16
+KEY_SIZE = 64
+VALUE_OFFSET = 80
+VALUE_TYPES = {b'i': struct.Struct('<q'), b'f': struct.Struct('<d')}
+
+# Key used for the slot of a tally that is not grouped
+TOTAL_KEY = b'null'
+
+_maps = {}
+_maps_lock = threading.Lock()
+
+
+class SharedMap:
+    """
+    Hash table of numbers in a memory mapped file that is shared between
+    processes. Every slot has its own lock so updates to different keys do not
+    wait on each other. Slots are never freed except when the whole map is
+    cleared.
+    """
+
+    def __init__(self, path, slots):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = os.fstat(fd).st_size
+        if size < SLOT.size:
+            # New file, size it while holding a lock on the whole file so
+            # another process doing the same waits.
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                size = os.fstat(fd).st_size
+                if size < SLOT.size:
+                    size = slots * SLOT.size
+                    os.ftruncate(fd, size)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+
+        self.fd = fd
+        self.slots = size // SLOT.size
+        self.map = mmap.mmap(fd, self.slots * SLOT.size)
+        # fcntl locks are held by the process, threads are excluded with this
+        self.lock = threading.RLock()
+
+    def _lock(self, index, kind=fcntl.LOCK_EX):
+        if index is None:
+            fcntl.lockf(self.fd, kind)
+        else:
+            fcntl.lockf(self.fd, kind, SLOT.size, index * SLOT.size)
+
+    def _read(self, index):
+        return SLOT.unpack_from(self.map, index * SLOT.size)
+
+    def _hash(self, key):
+        """
+        Get the hash of a key and the key as it is stored in a slot.
+
+        @param key: bytes
+            The encoded key.
+        @return: (int, bytes)
+            The hash, never 0, and the padded key.
+        """
+        # blake2b would be faster but needs Python 3.6
+        key_hash = int.from_bytes(hashlib.sha256(key).digest()[:8], 'big') or 1
+        return key_hash, key.ljust(KEY_SIZE, b'\0')
+
+    def _find(self, key, initial=None, locked=False):
+        """
+        Find the slot of a key.
+
+        @param key: bytes
+            The encoded key.
+        @param initial: Union[int, float]
+            Value to claim an empty slot for the key with if it has none. No
+            slot is claimed when None.
+        @param locked: bool
+            Whether the caller holds a lock on the whole map.
+        @return: int
+            The index of the slot or None if there is no slot for the key.
+        """
+        key_hash, padded_key = self._hash(key)
+        start = key_hash % self.slots
+        for offset in range(self.slots):
+            index = (start + offset) % self.slots
+            slot_hash, _, slot_key, _ = self._read(index)
+            if slot_hash == 0:
+                if initial is None:
+                    return None
+                if not locked:
+                    self._lock(index)
+                try:
+                    slot_hash, _, slot_key, _ = self._read(index)
+                    if slot_hash == 0:
+                        # Slots are probed without locks, so the hash is
+                        # written last and fields are written separately.
+                        offset = index * SLOT.size
+                        self._write(index, initial)
+                        self.map[
+                            offset + KEY_OFFSET:offset + VALUE_OFFSET
+                        ] = padded_key
+                        HASH.pack_into(self.map, offset, key_hash)
+                        return index
+                finally:
+                    if not locked:
+                        self._lock(index, fcntl.LOCK_UN)
+            if slot_hash == key_hash and slot_key == padded_key:
+                return index
+        if initial is not None:
+            raise ValueError('shared map is full')
+        return None
+
+    def _find_locked(self, key, initial=None, kind=fcntl.LOCK_EX):
+        """
+        Find the slot of a key and lock it. Slots are found without locks, so
+        another process can replace the map before the slot is locked. In
+        that case the slot is found again.
+
+        @param key: bytes
+            The encoded key.
+        @param initial: Union[int, float]
+            Value to claim an empty slot for the key with if it has none. No
+            slot is claimed when None.
+        @param kind: int
+            The kind of lock to take.
+        @return: int
+            The index of the locked slot or None if there is no slot for the
+            key.
+        """
+        key_hash, padded_key = self._hash(key)
+        while True:
+            index = self._find(key, initial)
+            if index is None:
+                return None
+            self._lock(index, kind)
+            slot_hash, _, slot_key, _ = self._read(index)
+            if slot_hash == key_hash and slot_key == padded_key:
+                return index
+            self._lock(index, fcntl.LOCK_UN)
+
+    def get(self, key, default):
+        """
+        Get the value of a key.
+
+        @param key: bytes
+            The encoded key.
+        @param default: Any
+            Value to return when the key has no slot.
+        @return: Union[int, float]
+            The value of the key.
+        """
+        with self.lock:
+            index = self._find_locked(key, kind=fcntl.LOCK_SH)
+            if index is None:
+                return default
+            try:
+                _, kind, _, value = self._read(index)
+            finally:
+                self._lock(index, fcntl.LOCK_UN)
+        return VALUE_TYPES[kind].unpack(value)[0]
+
+    def items(self):
+        """
+        Get all keys and their values.
+
+        @return: List[(bytes, Union[int, float])]
+            The encoded keys with their values.
+        """
+        items = []
+        with self.lock:
+            self._lock(None, fcntl.LOCK_SH)
+            try:
+                for index in range(self.slots):
+                    slot_hash, kind, key, value = self._read(index)
+                    if slot_hash != 0:
+                        items.append((
+                            key.rstrip(b'\0'),
+                            VALUE_TYPES[kind].unpack(value)[0],
+                        ))
+            finally:
+                self._lock(None, fcntl.LOCK_UN)
+        return items
+
+    def update(self, key, func, default):
+        """
+        Atomically update the value of a key.
+
+        @param key: bytes
+            The encoded key.
+        @param func: Callable[[Union[int, float]], Union[int, float]]
+            Function that gets the new value based on the current one.
+        @param default: Union[int, float]
+            The current value of a key that has no slot yet.
+        """
+        with self.lock:
+            index = self._find_locked(key, default)
+            try:
+                _, kind, _, value = self._read(index)
+                value = VALUE_TYPES[kind].unpack(value)[0]
+                self._write(index, func(value))
+            finally:
+                self._lock(index, fcntl.LOCK_UN)
+
+    def replace(self, items):
+        """
+        Atomically replace the contents of the map.
+
+        @param items: Iterable[(bytes, Union[int, float])]
+            The encoded keys with their values.
+        """
+        with self.lock:
+            self._lock(None)
+            try:
+                self.map[:] = bytes(len(self.map))
+                for key, value in items:
+                    self._find(key, value, locked=True)
+            finally:
+                self._lock(None, fcntl.LOCK_UN)
+
+    def _write(self, index, value):
+        if isinstance(value, int):
+            kind = b'i'
+        elif isinstance(value, float):
+            kind = b'f'
+        else:
+            raise TypeError(
+                'can not store {} in a shared map'
+                .format(type(value).__name__)
+            )
+        offset = index * SLOT.size
+        self.map[offset + HASH.size] = kind[0]
+        VALUE_TYPES[kind].pack_into(self.map, offset + VALUE_OFFSET, value)
+
+
+def get_map(path, slots):
+    """
+    Get the shared map of a file. Maps are opened once per process since
+    closing any descriptor of a file releases all locks the process holds on
+    it.
+
+    @param path: str
+        Path of the file.
+    @param slots: int
+        Number of slots to create the file with if it does not exist.
+    @return: SharedMap
+        The shared map.
+    """
+    path = os.path.abspath(path)
+    with _maps_lock:
+        try:
+            return _maps[path]
+        except KeyError:
+            shared_map = _maps[path] = SharedMap(path, slots)
+            return shared_map
+
+
+class MMapStored:
+    """
+    Mixin to make an Aggregate keep it's tally in a memory mapped file, so all
+    processes on a machine that use the same file share a single tally.
+    Group keys and aggregates have to be JSON serializable, keys of at most
+    64 bytes and aggregates ints or floats. Group keys can be tuples, but no
+    lists or dicts.
+    """
+
+    # Path of the file to map
+    mmap_path = None
+    # Number of slots to create the file with, one slot is used per group
+    mmap_slots = 1024
+
+    def __init__(self):
+        self.__map = None
+        super().__init__(None)
+        self.ensure_data()
+
+    def ensure_data(self):
+        self.__map = get_map(self.mmap_path, self.mmap_slots)
+
+    def _encode_key(self, group):
+        key = json.dumps(group, sort_keys=True).encode()
+        if len(key) > KEY_SIZE:
+            raise ValueError(
+                'group key {!r} is longer than {} bytes'
+                .format(group, KEY_SIZE)
+            )
+        return key
+
+    def _decode_key(self, key):
+        return decode_group(key.decode())
+
+    @property
+    def tally(self):
+        if self.__map is None:
+            return None
+        if isinstance(self, Group):
+            return {
+                self._decode_key(key): value
+                for key, value in self.__map.items()
+            }
+        return self.__map.get(TOTAL_KEY, self.aggregate_id)
+
+    @tally.setter
+    def tally(self, tally):
+        # Tally.__init__ sets the tally before the map is opened, the value
+        # in the map is kept in that case.
+        if self.__map is None:
+            return
+        if isinstance(self, Group):
+            items = [
+                (self._encode_key(group), value)
+                for group, value in tally.items()
+            ]
+        else:
+            items = [(TOTAL_KEY, tally)]
+        self.__map.replace(items)
+
+    def _apply_changes(self, pairs):
+        delta = self.get_delta(pairs)
+        if isinstance(self, Group):
+            items = [
+                (self._encode_key(group), value)
+                for group, value in delta.items()
+            ]
+        else:
+            items = [(TOTAL_KEY, delta)]
+        for key, value in items:
+            self.__map.update(
+                key,
+                lambda tally, value=value: self.aggregate_add(tally, value),
+                self.aggregate_id,
+            )
@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+
+# Sent once after a bulk operation on a model with a list of (old_instance,
+# new_instance) pairs as changes. For created instances old_instance is None
+# and for deleted instances new_instance is None.
+post_bulk_change = Signal(providing_args=['changes', 'using'])
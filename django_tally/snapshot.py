@@ -0,0 +1,221 @@
+import sys
+import threading
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+class SnapshotStore(MutableMapping):
+    """
+    Store for the snapshots a Tally keeps of model instances, keyed by a
+    (model, pk) tuple. Lookups through item access are counted as hits and
+    misses so that the effectiveness of the store can be monitored.
+    """
+
+    def __init__(self):
+        """
+        Initialize SnapshotStore.
+        """
+        self._snapshots = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        """
+        The fraction of lookups that found a snapshot, or None when no lookups
+        have been done yet.
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return self.hits / lookups
+
+    @property
+    def bounded(self):
+        """
+        Whether the store can evict snapshots.
+        """
+        return False
+
+    def get_config(self):
+        """
+        Get a description of how the store keeps snapshots. Only tallies
+        with stores with the same config share their snapshots.
+
+        @return: Hashable
+            The config of the store.
+        """
+        return (type(self),)
+
+    def merge(self, other):
+        """
+        Add the snapshots of another store that this store has no snapshot
+        of yet. Snapshots already in this store are newer and kept.
+
+        @param other: SnapshotStore
+            The store to add the snapshots of.
+        """
+        for key, snapshot in list(other._snapshots.items()):
+            if key not in self:
+                self[key] = snapshot
+
+    def __getitem__(self, key):
+        try:
+            snapshot = self._snapshots[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return snapshot
+
+    def __setitem__(self, key, snapshot):
+        self._snapshots[key] = snapshot
+
+    def __delitem__(self, key):
+        del self._snapshots[key]
+
+    def __contains__(self, key):
+        return key in self._snapshots
+
+    def __iter__(self):
+        return iter(self._snapshots)
+
+    def __len__(self):
+        return len(self._snapshots)
+
+
+class LRUSnapshotStore(SnapshotStore):
+    """
+    Snapshot store that is bounded by an amount of entries and/or an
+    approximate amount of bytes. When a bound is exceeded the least recently
+    used snapshots are evicted.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """
+        Initialize LRUSnapshotStore.
+
+        @param max_entries: int
+            Maximum amount of snapshots to keep, None for no maximum.
+        @param max_bytes: int
+            Maximum amount of bytes the snapshots may take up, None for no
+            maximum.
+        """
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._snapshots = OrderedDict()
+        self._sizes = {}
+
+    def get_size(self, snapshot):
+        """
+        Get the approximate size of a snapshot. Tuples, like the snapshots
+        created for tracked_fields, are measured including their items.
+
+        @param snapshot: Any
+            The snapshot to measure.
+        @return: int
+            The approximate size in bytes.
+        """
+        size = sys.getsizeof(snapshot)
+        if isinstance(snapshot, tuple):
+            size += sum(map(sys.getsizeof, snapshot))
+        return size
+
+    @property
+    def bounded(self):
+        return self.max_entries is not None or self.max_bytes is not None
+
+    def get_config(self):
+        return super().get_config() + (self.max_entries, self.max_bytes)
+
+    def __getitem__(self, key):
+        snapshot = super().__getitem__(key)
+        self._snapshots.move_to_end(key)
+        return snapshot
+
+    def __setitem__(self, key, snapshot):
+        if key in self._snapshots:
+            del self[key]
+        super().__setitem__(key, snapshot)
+        if self.max_bytes is not None:
+            self._sizes[key] = self.get_size(snapshot)
+            self.size += self._sizes[key]
+        self._evict()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.size -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        """
+        Evict least recently used snapshots until the store is within its
+        bounds again.
+        """
+        while self._snapshots and (
+            (
+                self.max_entries is not None and
+                len(self._snapshots) > self.max_entries
+            ) or (
+                self.max_bytes is not None and
+                self.size > self.max_bytes
+            )
+        ):
+            del self[next(iter(self._snapshots))]
+            self.evictions += 1
+
+
+class SnapshotRegistry:
+    """
+    Process wide registry of snapshot stores that are shared between tallies
+    with the same value spec, coalescing, and store config. Stores are
+    reference counted and dropped when the last tally releases them.
+    """
+
+    def __init__(self):
+        """
+        Initialize SnapshotRegistry.
+        """
+        self._stores = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, spec, get_store):
+        """
+        Acquire the store for a value spec, creating it if needed.
+
+        @param spec: Hashable
+            The value spec of the tally acquiring the store.
+        @param get_store: Function
+            Function to create the store when there is none for the spec.
+        @return: SnapshotStore
+            The store shared by tallies with this value spec.
+        """
+        with self._lock:
+            store, count = self._stores.get(spec, (None, 0))
+            if store is None:
+                store = get_store()
+            self._stores[spec] = (store, count + 1)
+            return store
+
+    def release(self, spec):
+        """
+        Release the store for a value spec.
+
+        @param spec: Hashable
+            The value spec of the tally releasing the store.
+        """
+        with self._lock:
+            store, count = self._stores[spec]
+            if count == 1:
+                del self._stores[spec]
+            else:
+                self._stores[spec] = (store, count - 1)
+
+    def __contains__(self, spec):
+        return spec in self._stores
+
+
+registry = SnapshotRegistry()
@@ -1,12 +1,81 @@
+import datetime
+import decimal
+import uuid
+
 from copy import deepcopy
-from collections import defaultdict
+from collections import namedtuple
 
 from django.db import models
-from django.db.models.signals import post_init, post_save, post_delete
-
+from django.db.models.fields.files import FieldFile
+from .journal import ChangeJournal, DELETED
+from .bulk import is_bulk_deleted
+from .dispatcher import dispatch
+from .snapshot import SnapshotStore, registry
 from .subscription import Subscription
 
 
+_missing = object()
+_snapshot_types = {}
+# Types of field values that can not change in place, so snapshots can
+# reference them instead of copying them
+IMMUTABLE_TYPES = (
+    type(None), bool, int, float, complex, str, bytes, tuple, frozenset,
+    decimal.Decimal, datetime.date, datetime.time, datetime.timedelta,
+    uuid.UUID,
+)
+
+
+def get_snapshot_type(model, fields):
+    """
+    Get the namedtuple type used to snapshot certain fields of a model.
+
+    @param model: Class
+        The model to snapshot.
+    @param fields: Tuple[str]
+        The names of the fields to snapshot.
+    @return: Class
+        The namedtuple type for snapshots of these fields of the model.
+    """
+    try:
+        return _snapshot_types[model, fields]
+    except KeyError:
+        snapshot_type = _snapshot_types[model, fields] = namedtuple(
+            '{}Snapshot'.format(model.__name__), fields,
+        )
+        snapshot_type.attnames = tuple(
+            model._meta.get_field(field).attname
+            for field in fields
+        )
+        return snapshot_type
+
+
+def get_snapshot(instance, fields):
+    """
+    Snapshot the values of certain fields of a model instance. Foreign keys
+    are snapshotted by their raw value so that no related objects are loaded,
+    and files by their name so that the snapshot does not reference the
+    instance. Values that can change in place, like those of JSON and array
+    fields, are copied.
+
+    @param instance: Model
+        The instance to snapshot.
+    @param fields: Iterable[str]
+        The names of the fields to snapshot.
+    @return: namedtuple
+        The snapshot of the instance.
+    """
+    snapshot_type = get_snapshot_type(type(instance), tuple(fields))
+    values = []
+    for attname in snapshot_type.attnames:
+        value = getattr(instance, attname)
+        if isinstance(value, FieldFile):
+            value = value.name
+        elif not isinstance(value, IMMUTABLE_TYPES):
+            value = deepcopy(value)
+        values.append(value)
+    return snapshot_type._make(values)
+
+
 class Tally:
     """
     Base class for a Tally.
@@ -14,6 +83,23 @@ class Tally:
     based on changes happening to model instances.
     """
 
+    # Names of the model fields to snapshot as the value of an instance. When
+    # None the value of an instance is a deepcopy of the instance itself.
+    tracked_fields = None
+    # Whether to fetch the old value of an instance from the database when
+    # there is no snapshot of it right before it is saved or deleted. When
+    # False such changes are ignored. When None missing values are fetched
+    # only if the snapshot store can evict snapshots.
+    fetch_missing = None
+    # Whether to journal changes made inside a transaction and handle them
+    # when the transaction commits, netted into a single change per instance.
+    # Changes in savepoints or transactions that are rolled back are
+    # discarded.
+    coalesce = False
+    # Whether to share snapshots with other tallies with the same value spec
+    # while subscribed.
+    share_snapshots = True
+
     def get_tally(self):
         """
         Get initial value for the tally.
@@ -32,7 +118,34 @@ class Tally:
         @return: Any
             Value of model instance.
         """
-        return deepcopy(instance)
+        if self.tracked_fields is None:
+            return deepcopy(instance)
+        return get_snapshot(instance, self.tracked_fields)
+
+    def get_value_spec(self):
+        """
+        Get a description of how get_value computes values. Tallies with the
+        same value spec share the values they compute for an instance, so
+        these values should not be mutated.
+
+        @return: Hashable
+            The value spec, or None when values can not be shared.
+        """
+        if (
+            self.tracked_fields is None or
+            type(self).get_value is not Tally.get_value
+        ):
+            return None
+        return ('tracked_fields', tuple(self.tracked_fields))
+
+    def get_snapshot_store(self):
+        """
+        Get the store to keep snapshots of model instances in.
+
+        @return: SnapshotStore
+            Store to keep snapshots in.
+        """
+        return SnapshotStore()
 
     def get_nonexisting_value(self):
         """
@@ -69,6 +182,36 @@ class Tally:
         """
         raise NotImplementedError
 
+    def handle_changes(self, tally, pairs):
+        """
+        Change tally based on a batch of changes to model instances.
+
+        @param tally: Any
+            Current value of the tally.
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        @return: Any
+            New tally value.
+        """
+        for old_value, new_value in pairs:
+            tally = self.handle_change(tally, old_value, new_value)
+        return tally
+
+    def fold_queryset(self, tally, queryset):
+        """
+        Fold all instances of a queryset into the tally inside the database
+        instead of in Python. Used by rebuild when possible.
+
+        @param tally: Any
+            Current value of the tally.
+        @param queryset: QuerySet
+            The instances to fold into the tally.
+        @return: Any
+            New tally value or NotImplemented when the tally can not be
+            computed in the database.
+        """
+        return NotImplemented
+
     def __init__(self, *args):
         """
         Initialize Tally.
@@ -83,7 +226,12 @@ class Tally:
         else:
             self.tally = self.get_tally()
 
-        self.__model_data = defaultdict(dict)
+        self.__model_data = self.get_snapshot_store()
+        self.__subscriptions = 0
+        self.__shared_spec = None
+        self.__journal = (
+            ChangeJournal(self._handle_segment) if self.coalesce else None
+        )
 
     def _handle(self, old_value, new_value):
         """
@@ -94,12 +242,183 @@ class Tally:
         @param new_value: Mapping
             New value of the model.
         """
-        if old_value is None and new_value is None:
-            return
+        self._handle_changes([(old_value, new_value)])
+
+    def _handle_changes(self, pairs):
+        """
+        Handle a batch of updates to model instances.
+
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        """
+        pairs = [
+            (old_value, new_value)
+            for old_value, new_value in pairs
+            if old_value is not None or new_value is not None
+        ]
+        if pairs:
+            self._apply_changes(pairs)
+
+    def _subscribe(self):
+        """
+        Called when the tally starts listening on a model. Switches to the
+        shared snapshot store for the value spec, coalescing, and snapshot
+        store config of the tally if possible. Snapshots the tally took
+        before, like those of a rebuild, are added to the shared store.
+        """
+        self.__subscriptions += 1
+        if self.__subscriptions == 1 and self.share_snapshots:
+            spec = self.get_value_spec()
+            if spec is not None:
+                store = self.get_snapshot_store()
+                # Coalescing tallies only store committed snapshots so they
+                # can not share with tallies that store them right away
+                spec = (spec, self.coalesce, store.get_config())
+                self.__shared_spec = spec
+                snapshots = self.__model_data
+                self.__model_data = registry.acquire(spec, lambda: store)
+                self.__model_data.merge(snapshots)
+
+    def _unsubscribe(self):
+        """
+        Called when the tally stops listening on a model. Releases the shared
+        snapshot store when the tally is not listening anymore.
+        """
+        self.__subscriptions -= 1
+        if self.__subscriptions == 0 and self.__shared_spec is not None:
+            registry.release(self.__shared_spec)
+            self.__shared_spec = None
+            self.__model_data = self.get_snapshot_store()
+
+    def _fetches_missing(self):
+        """
+        Whether the tally fetches the old value of instances it has no
+        snapshot of.
+
+        @return: bool
+        """
+        if self.fetch_missing is None:
+            return self.__model_data.bounded
+        return self.fetch_missing
+
+    def _get_instance_value(self, instance, values=None):
+        """
+        Get value of a model instance, sharing it with other tallies with the
+        same value spec.
+
+        @param instance: Model
+            Instance to get the value of.
+        @param values: Mapping
+            Values computed for the current signal so far.
+        @return: Any
+            Value of model instance.
+        """
+        if values is None:
+            return self.get_value(instance)
+        spec = self.get_value_spec()
+        if spec is None:
+            return self.get_value(instance)
+
+        key = (spec, id(instance))
+        try:
+            return values[key]
+        except KeyError:
+            value = values[key] = self.get_value(instance)
+            return value
+
+    def _get_snapshot(self, key, using=None, values=None):
+        """
+        Get the snapshot of a model instance, taking changes journaled in the
+        current transaction into account.
+
+        @param key: (Class, Any)
+            The model and pk of the instance.
+        @param using: str
+            Alias of the database.
+        @param values: Mapping
+            Values computed for the current signal so far. Shared snapshots
+            are remembered here so that all tallies see the snapshot from
+            before the signal.
+        @return: Any
+            The snapshot of the instance or _missing if there is none.
+        """
+        if self.__journal is not None:
+            snapshot = self.__journal.get(key, using, _missing)
+            if snapshot is DELETED:
+                return _missing
+            elif snapshot is not _missing:
+                return snapshot
+
+        if values is None or self.__shared_spec is None:
+            return self.__model_data.get(key, _missing)
+
+        cache_key = ('snapshot', self.__shared_spec, key)
+        try:
+            return values[cache_key]
+        except KeyError:
+            snapshot = values[cache_key] = self.__model_data.get(
+                key, _missing,
+            )
+            return snapshot
+
+    def _handle_instance(self, key, snapshot, change=None, using=None):
+        """
+        Handle update to a specific model instance. When coalescing the
+        update is journaled until the current transaction commits.
+
+        @param key: (Class, Any)
+            The model and pk of the instance.
+        @param snapshot: Any
+            New snapshot of the instance, DELETED if it was deleted.
+        @param change: (Any, Any)
+            The (old_value, new_value) pair of the update, None if only the
+            snapshot changed.
+        @param using: str
+            Alias of the database the update was made in.
+        """
+        if self.__journal is None:
+            self._update_snapshots({key: snapshot})
+            if change is not None:
+                self._handle(*change)
+        else:
+            self.__journal.add(key, snapshot, change, using)
+
+    def _handle_segment(self, snapshots, pairs):
+        """
+        Handle a committed segment of the journal.
+
+        @param snapshots: Mapping[(Class, Any), Any]
+            The new snapshots of the changed instances.
+        @param pairs: List[(Any, Any)]
+            List of (old_value, new_value) pairs of the changed models.
+        """
+        self._update_snapshots(snapshots)
+        self._handle_changes(pairs)
+
+    def _update_snapshots(self, snapshots):
+        """
+        Update the snapshots of model instances.
+
+        @param snapshots: Mapping[(Class, Any), Any]
+            The new snapshots, DELETED for deleted instances.
+        """
+        for key, snapshot in snapshots.items():
+            if snapshot is DELETED:
+                self.__model_data.pop(key, None)
+            else:
+                self.__model_data[key] = snapshot
 
-        self.tally = self.handle_change(self.tally, old_value, new_value)
+    def _apply_changes(self, pairs):
+        """
+        Apply a batch of updates to the tally.
+
+        @param pairs: List[(Any, Any)]
+            Non empty list of (old_value, new_value) pairs of the changed
+            models.
+        """
+        self.tally = self.handle_changes(self.tally, pairs)
 
-    def _handle_post_init(self, sender, instance, **kwargs):
+    def _handle_post_init(self, sender, instance, values=None, **kwargs):
         """
         Handle post_init signal from a connected model.
 
@@ -107,16 +426,62 @@ class Tally:
             Model that sent the event.
         @param instance: sender
             Instance that was initialized.
+        @param values: Mapping
+            Values computed for this signal so far, shared between tallies.
         @param kwargs: Mapping
             Remaining keyword arguments.
         """
         if instance.pk is None:
             return
-        self.__model_data[type(instance)][instance.pk] = (
-            self.get_value(instance)
+        key = (type(instance), instance.pk)
+        if (
+            self.__journal is not None and
+            self.__journal.get(key, instance._state.db, _missing)
+            is not _missing
+        ):
+            # The journal already has a more reliable snapshot
+            return
+        self.__model_data[key] = self._get_instance_value(instance, values)
+
+    def _handle_pre_change(
+        self, sender, instance, using=None, values=None, **kwargs
+    ):
+        """
+        Handle pre_save and pre_delete signals from a connected model when
+        fetch_missing is enabled. Snapshots the value stored in the database
+        if the instance has no snapshot yet.
+
+        @param sender: Class
+            Model that sent the event.
+        @param instance: sender
+            Instance that will be saved or deleted.
+        @param using: str
+            Alias of the database the instance will be saved to.
+        @param values: Mapping
+            Values computed for this signal so far, shared between tallies.
+        @param kwargs: Mapping
+            Remaining keyword arguments.
+        """
+        key = (type(instance), instance.pk)
+        if (
+            instance.pk is None or
+            self._get_snapshot(key, using, values) is not _missing
+        ):
+            return
+        old_instance = (
+            type(instance)._base_manager
+            .using(using)
+            .filter(pk=instance.pk)
+            .first()
         )
+        if old_instance is not None:
+            self.__model_data[key] = self._get_instance_value(
+                old_instance, values,
+            )
 
-    def _handle_post_save(self, sender, instance, created, **kwargs):
+    def _handle_post_save(
+        self, sender, instance, created, using=None, values=None, **kwargs
+    ):
         """
         Handle post_save signal from a connected model.
 
@@ -126,29 +491,35 @@ class Tally:
             Instance that was saved.
         @param created: bool
             If the instance was created with this save.
+        @param using: str
+            Alias of the database the instance was saved to.
+        @param values: Mapping
+            Values computed for this signal so far, shared between tallies.
         @param kwargs: Mapping
             Remaining keyword arguments.
         """
-        new_value = self.get_value(instance)
+        key = (type(instance), instance.pk)
+        new_value = self._get_instance_value(instance, values)
 
         if created:
             old_value = self.get_nonexisting_value()
-        elif instance.pk in self.__model_data[type(instance)]:
-            old_value = self.__model_data[type(instance)][instance.pk]
+        else:
+            old_value = self._get_snapshot(key, using, values)
+            if old_value is _missing:
+                self._handle_instance(key, new_value, using=using)
+                return
             if not self.filter_value(old_value):
                 old_value = self.get_nonexisting_value()
-        else:
-            self.__model_data[type(instance)][instance.pk] = new_value
-            return
-
-        self.__model_data[type(instance)][instance.pk] = new_value
 
+        snapshot = new_value
         if not self.filter_value(new_value):
             new_value = self.get_nonexisting_value()
 
-        self._handle(old_value, new_value)
+        self._handle_instance(key, snapshot, (old_value, new_value), using)
 
-    def _handle_post_delete(self, sender, instance, **kwargs):
+    def _handle_post_delete(
+        self, sender, instance, using=None, values=None, **kwargs
+    ):
         """
         Handle post_delete signal from a connected model.
 
@@ -156,22 +527,81 @@ class Tally:
             Model that sent the event.
         @param instance: sender
             Instance that was deleted.
+        @param using: str
+            Alias of the database the instance was deleted from.
+        @param values: Mapping
+            Values computed for this signal so far, shared between tallies.
         @param kwargs: Mapping
             Remaining keyword arguments.
         """
-        if instance.pk not in self.__model_data[type(instance)]:
+        if is_bulk_deleted(instance):
             return
 
-        old_value = self.__model_data[type(instance)][instance.pk]
-        del self.__model_data[type(instance)][instance.pk]
+        key = (type(instance), instance.pk)
+        old_value = self._get_snapshot(key, using, values)
+        if old_value is _missing:
+            return
 
         if not self.filter_value(old_value):
             old_value = self.get_nonexisting_value()
-        self._handle(
-            old_value,
-            self.get_nonexisting_value(),
+        self._handle_instance(
+            key,
+            DELETED,
+            (old_value, self.get_nonexisting_value()),
+            using,
         )
 
+    def _handle_post_bulk_change(
+        self, sender, changes, using=None, values=None, **kwargs
+    ):
+        """
+        Handle post_bulk_change signal from a connected model.
+
+        @param sender: Class
+            Model that sent the event.
+        @param changes: List[(sender, sender)]
+            List of (old_instance, new_instance) pairs that changed.
+        @param using: str
+            Alias of the database the changes were made in.
+        @param values: Mapping
+            Values computed for this signal so far, shared between tallies.
+        @param kwargs: Mapping
+            Remaining keyword arguments.
+        """
+        snapshots = {}
+        pairs = []
+        for old_instance, new_instance in changes:
+            instance = new_instance if old_instance is None else old_instance
+            key = (type(instance), instance.pk)
+
+            if old_instance is None:
+                old_value = self.get_nonexisting_value()
+            else:
+                old_value = self._get_instance_value(old_instance, values)
+                if not self.filter_value(old_value):
+                    old_value = self.get_nonexisting_value()
+
+            if new_instance is None:
+                snapshot = DELETED
+                new_value = self.get_nonexisting_value()
+            else:
+                snapshot = new_value = self._get_instance_value(
+                    new_instance, values,
+                )
+                if not self.filter_value(new_value):
+                    new_value = self.get_nonexisting_value()
+
+            if self.__journal is None:
+                snapshots[key] = snapshot
+                pairs.append((old_value, new_value))
+            else:
+                self.__journal.add(
+                    key, snapshot, (old_value, new_value), using,
+                )
+
+        if snapshots:
+            self._handle_segment(snapshots, pairs)
+
     def on(self, *senders, sub=None):
         """
         Create a subscription to signals from certain senders and their
@@ -193,9 +623,7 @@ class Tally:
                 hasattr(sender, '_meta') and
                 getattr(sender._meta, 'abstract', False)
             ):
-                sub.add(post_init, self._handle_post_init, sender)
-                sub.add(post_save, self._handle_post_save, sender)
-                sub.add(post_delete, self._handle_post_delete, sender)
+                sub.add(dispatch, self, sender)
 
             for subclass in sender.__subclasses__():
                 self.on(subclass, sub=sub)
@@ -219,9 +647,73 @@ class Tally:
         sub.open()
         return sub
 
+    def rebuild(self, *querysets, chunk_size=2000, progress=None):
+        """
+        Rebuild the tally from scratch based on the instances in certain
+        querysets. When fold_queryset can compute the tally for a queryset in
+        the database that is used. Otherwise instances are streamed and
+        folded in batches so memory usage does not depend on the amount of
+        instances, the snapshots of the instances are updated along the way.
+        Changes that are handled while rebuilding are lost, so the senders
+        should not be changed concurrently.
+
+        @param *querysets: (QuerySet|Class)[]
+            Querysets to rebuild the tally from. When given a model all
+            instances of that model are used.
+        @param chunk_size: int
+            Amount of instances to fetch and fold at once.
+        @param progress: Function
+            Function that is called with the amount of instances that have
+            been processed after every chunk.
+        """
+        tally = self.get_tally()
+        count = 0
+
+        for queryset in querysets:
+            if isinstance(queryset, type):
+                queryset = queryset._base_manager.all()
+
+            folded = self.fold_queryset(tally, queryset)
+            if folded is not NotImplemented:
+                tally = folded
+                continue
+
+            pairs = []
+            for instance in queryset.iterator(chunk_size=chunk_size):
+                value = self.get_value(instance)
+                self.__model_data[type(instance), instance.pk] = value
+                if self.filter_value(value):
+                    pairs.append((self.get_nonexisting_value(), value))
+                count += 1
+
+                if count % chunk_size == 0:
+                    tally = self.handle_changes(tally, pairs)
+                    pairs = []
+                    if progress is not None:
+                        progress(count)
+
+            if pairs:
+                tally = self.handle_changes(tally, pairs)
+
+        if progress is not None and count % chunk_size != 0:
+            progress(count)
+
+        self._replace_tally(tally)
+
+    def _replace_tally(self, tally):
+        """
+        Replace the value of the tally.
+
+        @param tally: Any
+            The new value of the tally.
+        """
+        self.tally = tally
+
     def reset(self):
         """
-        Resets the tally to it's original value.
+        Resets the tally to it's original value and forgets the snapshots it
+        kept. Shared snapshots are kept since other tallies rely on them.
         """
         self.tally = self.get_tally()
-        self.__model_data = defaultdict(dict)
+        if self.__shared_spec is None:
+            self.__model_data = self.get_snapshot_store()
@@ -0,0 +1,80 @@
+import threading
+
+from contextlib import contextmanager
+
+
+_local = threading.local()
+
+
+class UnitOfWork:
+    """
+    Collects the writes of tallies made while handling a single signal, so
+    they can be written together when the signal is handled.
+    """
+
+    def __init__(self, using=None):
+        """
+        Initialize UnitOfWork.
+
+        @param using: str
+            Alias of the database the change that is handled was made in.
+        """
+        self.using = using
+        self.writers = {}
+
+    def get_writer(self, key, factory):
+        """
+        Get the writer for a key, creating it if it does not exist yet.
+
+        @param key: Hashable
+            Key of the writer.
+        @param factory: Callable[[], Any]
+            Creates the writer, the writer must have a commit method.
+        @return: Any
+            The writer.
+        """
+        try:
+            return self.writers[key]
+        except KeyError:
+            writer = self.writers[key] = factory()
+            return writer
+
+    def commit(self):
+        """
+        Commit the writers in the order they were created.
+        """
+        for writer in self.writers.values():
+            writer.commit()
+
+
+def get_unit_of_work():
+    """
+    Get the unit of work of the current thread.
+
+    @return: UnitOfWork
+        The unit of work or None if there is none.
+    """
+    return getattr(_local, 'unit_of_work', None)
+
+
+@contextmanager
+def unit_of_work(using=None):
+    """
+    Context manager that collects the writes of tallies inside it in a unit of
+    work and commits it when the context exits without an exception. Nested
+    contexts join the outer unit of work.
+
+    @param using: str
+        Alias of the database the change that is handled was made in.
+    """
+    current = get_unit_of_work()
+    if current is not None:
+        yield current
+        return
+
+    current = _local.unit_of_work = UnitOfWork(using)
+    try:
+        yield current
+    finally:
+        _local.unit_of_work = None
+    current.commit()
@@ -4,8 +4,7 @@ from django.contrib.postgres import fields as pg_fields
 from ..data import DBStored
 from ..group import Group
 from .tally import UserDefTallyBaseNonStored
-from .lang import run, Env
-from .lang.json import decode
+from .lang import Env
 
 
 class UserDefGroupTallyBaseNonStored(UserDefTallyBaseNonStored):
@@ -15,18 +14,19 @@ class UserDefGroupTallyBaseNonStored(UserDefTallyBaseNonStored):
         blank=True, null=True,
     )
 
-    def as_tally(self, **kwargs):
-        return super().as_tally(get_group=decode(self.get_group), **kwargs)
-
     class UserTally(Group, UserDefTallyBaseNonStored.UserTally):
 
-        def __init__(self, get_group=None, **kwargs):
+        bound = dict(
+            UserDefTallyBaseNonStored.UserTally.bound,
+            get_group=['value'],
+        )
+
+        def __init__(self, get_group, **kwargs):
             super(Group, self).__init__(**kwargs)
             self._get_group = get_group
 
         def get_group(self, value):
-            return run(
-                self._get_group,
+            return self._get_group(
                 Env(
                     env={'value': value},
                     base_env=self._env,
@@ -42,15 +42,18 @@ class UserDefGroupTallyBase(UserDefGroupTallyBaseNonStored):
 
     db_name = models.TextField(unique=True)
 
-    def as_tally(self):
-        return super().as_tally(db_name=self.db_name)
+    def as_tally(self, ensure=True):
+        return super().as_tally(db_name=self.db_name, ensure=ensure)
 
     class UserTally(DBStored, UserDefGroupTallyBaseNonStored.UserTally):
 
-        def __init__(self, db_name=None, **kwargs):
+        db_patch = True
+
+        def __init__(self, db_name=None, ensure=True, **kwargs):
             super(DBStored, self).__init__(**kwargs)
             self.db_name = db_name
-            self.ensure_data()
+            if ensure:
+                self.ensure_data()
 
     class Meta:
         abstract = True
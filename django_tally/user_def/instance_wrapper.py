@@ -7,11 +7,15 @@ from django.core.exceptions import FieldDoesNotExist
 from .lang import KW
 
 
+# Key of the name of the class of the instance
+KW_CLASS = KW('__class__')
+
+
 class InstanceWrapper(defaultdict):
 
     def __init__(self, instance):
         self._instance = deepcopy(instance)
-        self[KW('__class__')] = type(instance).__name__
+        self[KW_CLASS] = type(instance).__name__
 
     def __missing__(self, key):
         if isinstance(key, KW):
@@ -1,6 +1,11 @@
 from .lang import run, KW, Func, LangException, Env
+from .compiler import compile, Program
+from .codegen import generate
 from .parser import parse
 from .serializer import serialize
 
 
-__all__ = [run, KW, Func, LangException, Env, parse, serialize]
+__all__ = [
+    run, compile, generate, Program, KW, Func, LangException, Env, parse,
+    serialize,
+]
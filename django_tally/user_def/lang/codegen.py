@@ -0,0 +1,617 @@
+import ast
+import builtins
+import sys
+import warnings
+
+from .compiler import Compiler, Program, compile, copy_quoted, has_unquote
+from .lang import KW, Env, LangException, lang_def, KW_QUOTE, KW_DO
+
+
+# Maximum depth of nested blocks in a generated function, subexpressions that
+# are nested deeper are compiled to closures since Python allows 20 levels.
+MAX_DEPTH = 15
+
+TRACED = '''
+try:
+    pass
+except LangException as exc:
+    exc.trace.insert(0, {name!r})
+    raise exc
+except Exception as exc:
+    raise LangException(exc, trace=[{name!r}])
+'''
+
+LOOKUP = '''
+try:
+    {target} = env[{name!r}]
+except KeyError:
+    raise name_error({name!r}) from None
+'''
+
+
+def name_error(name):
+    """
+    Create the exception for an undefined name.
+
+    @param name: str
+        The name.
+    @return: LangException
+    """
+    return LangException(NameError('name {!r} is not defined'.format(name)))
+
+
+def bind(spec, value, env):
+    """
+    Bind a value to a spec like def does.
+
+    @param spec: Any
+        The spec.
+    @param value: Any
+        The value, this is quoted before it is bound.
+    @param env: Env
+        The environment to bind in.
+    """
+    lang_def([spec, [KW_QUOTE, value]], env)
+
+
+def _load(name):
+    return ast.Name(id=name, ctx=ast.Load())
+
+
+def _store(name):
+    return ast.Name(id=name, ctx=ast.Store())
+
+
+def _assign(target, value):
+    return ast.Assign(targets=[_store(target)], value=value)
+
+
+def _call(func, *args):
+    return ast.Call(func=_load(func), args=list(args), keywords=[])
+
+
+def _isinstance(value, cls):
+    return _call('isinstance', value, _load(cls))
+
+
+def _subscript(value, key, ctx):
+    # Python < 3.9 wraps the key of a subscript in an Index node
+    if sys.version_info < (3, 9):
+        key = ast.Index(value=key)
+    return ast.Subscript(value=value, slice=key, ctx=ctx)
+
+
+def _arguments(*names):
+    fields = {
+        'args': [ast.arg(arg=name, annotation=None) for name in names],
+        'vararg': None,
+        'kwonlyargs': [],
+        'kw_defaults': [],
+        'kwarg': None,
+        'defaults': [],
+    }
+    # Python < 3.8 has no positional only arguments
+    if sys.version_info >= (3, 8):
+        fields['posonlyargs'] = []
+    return ast.arguments(**fields)
+
+
+def _module(body):
+    # Python < 3.8 has no type ignores
+    if sys.version_info >= (3, 8):
+        return ast.Module(body=body, type_ignores=[])
+    return ast.Module(body=body)
+
+
+class Generator:
+    """
+    Generates a Python function from a body of code. Every builtin that is
+    generated becomes a try statement that reports exceptions like the
+    builtin does, its arguments are evaluated in the try statement into
+    local variables. Parts of the body that can not be generated are compiled
+    to closures with Compiler and called from the function.
+    """
+
+    def __init__(self, env, bound=()):
+        """
+        Initialize Generator.
+
+        @param env: Env
+            The environment the code will run in.
+        @param bound: Iterable[str]
+            Names bound by the caller on top of the environment.
+        """
+        self.compiler = Compiler(env, bound)
+        self.namespace = {
+            'LangException': LangException,
+            'name_error': name_error,
+            'bind': bind,
+            'copy_quoted': copy_quoted,
+        }
+        self.constants = 0
+        self.temps = 0
+        self.depth = 0
+        self.block = []
+
+    def generate_function(self, body):
+        """
+        Generate a function that runs a body.
+
+        @param body: Any
+            The body.
+        @return: Callable[[Env], Any]
+            The function.
+        """
+        self.compiler.analyze(body)
+        result = self.generate(body)
+        func = ast.FunctionDef(
+            name='program',
+            args=_arguments('env'),
+            body=[*self.block, ast.Return(value=result)],
+            decorator_list=[],
+            returns=None,
+        )
+        module = ast.fix_missing_locations(_module([func]))
+        with warnings.catch_warnings():
+            # Subscripts of constants that can not be subscripted fail when
+            # they run like they do in the interpreter
+            warnings.simplefilter('ignore', SyntaxWarning)
+            code = builtins.compile(module, '<lang>', 'exec')
+        exec(code, self.namespace)
+        return self.namespace['program']
+
+    def temp(self):
+        """
+        Get the name of a new local variable.
+
+        @return: str
+        """
+        name = '_t{}'.format(self.temps)
+        self.temps += 1
+        return name
+
+    def constant(self, value):
+        """
+        Get an expression for a constant value.
+
+        @param value: Any
+            The value.
+        @return: ast.expr
+        """
+        if value is None or type(value) in (bool, int, float, str):
+            return ast.Constant(value=value)
+        name = '_c{}'.format(self.constants)
+        self.constants += 1
+        self.namespace[name] = value
+        return _load(name)
+
+    def emit(self, *statements):
+        self.block.extend(statements)
+
+    def generate(self, body):
+        """
+        Generate the statements that evaluate a body.
+
+        @param body: Any
+            The body.
+        @return: ast.expr
+            Expression of the value of the body after the statements, this is
+            either a constant or a local variable.
+        """
+        if isinstance(body, KW):
+            target = self.temp()
+            self.emit(*ast.parse(
+                LOOKUP.format(target=target, name=body.value)
+            ).body)
+            return _load(target)
+        elif isinstance(body, list):
+            if (
+                body and
+                isinstance(body[0], KW) and
+                body[0].value in GENERATED and
+                self.depth < MAX_DEPTH and
+                self.compiler.resolve(body[0].value) is not None
+            ):
+                res = self.generate_builtin(body[0].value, body[1:])
+                if res is not None:
+                    return res
+            return self.generate_fallback(body)
+        else:
+            return self.constant(body)
+
+    def generate_builtin(self, name, args):
+        """
+        Generate a builtin in a try statement that reports exceptions like
+        the builtin does.
+
+        @param name: str
+            The name of the builtin.
+        @param args: List[Any]
+            The arguments of the builtin.
+        @return: ast.expr
+            Expression of the value or None if the builtin can not be
+            generated for the arguments.
+        """
+        outer = self.block
+        self.block = []
+        self.depth += 1
+        try:
+            res = getattr(self, GENERATED[name])(args)
+        finally:
+            self.depth -= 1
+            inner, self.block = self.block, outer
+        if res is None:
+            return None
+
+        target = self.temp()
+        inner.append(_assign(target, res))
+        node, = ast.parse(TRACED.format(name=name)).body
+        node.body = inner
+        self.emit(node)
+        return _load(target)
+
+    def generate_fallback(self, body):
+        code = self.constant(self.compiler.compile(body))
+        target = self.temp()
+        self.emit(_assign(target, ast.Call(
+            func=code, args=[_load('env')], keywords=[],
+        )))
+        return _load(target)
+
+    def generate_branch(self, body, target):
+        """
+        Generate a body in a new block that assigns its value to a local
+        variable.
+
+        @param body: Any
+            The body.
+        @param target: str
+            Name of the local variable.
+        @return: List[ast.stmt]
+            The block.
+        """
+        outer, self.block = self.block, []
+        try:
+            self.emit(_assign(target, self.generate(body)))
+            return self.block
+        finally:
+            self.block = outer
+
+    def _generate_chain(self, args, stop, stop_value):
+        """
+        Generate the evaluation of arguments in order until one of them
+        meets a condition.
+
+        @param args: List[Any]
+            The arguments.
+        @param stop: Callable[[ast.expr], ast.expr]
+            Creates the condition to stop at from the value of an argument.
+        @param stop_value: bool
+            Result when the evaluation stops at an argument.
+        @return: ast.expr
+        """
+        target = self.temp()
+        outer = self.block
+        for arg in args:
+            node = ast.If(
+                test=stop(self.generate(arg)),
+                body=[_assign(target, ast.Constant(value=stop_value))],
+                orelse=[],
+            )
+            self.emit(node)
+            self.block = node.orelse
+        self.emit(_assign(target, ast.Constant(value=not stop_value)))
+        self.block = outer
+        return _load(target)
+
+    # Below here only the generated builtins, these return None when the
+    # builtin can not be generated for the arguments.
+
+    def generate_list(self, args):
+        return ast.List(
+            elts=[self.generate(arg) for arg in args], ctx=ast.Load(),
+        )
+
+    def generate_tuple(self, args):
+        return ast.Tuple(
+            elts=[self.generate(arg) for arg in args], ctx=ast.Load(),
+        )
+
+    def generate_set(self, args):
+        # Items are added one at a time so an unhashable item fails before
+        # the next items are evaluated, like in the interpreter
+        target = self.temp()
+        self.emit(_assign(target, _call('set')))
+        for arg in args:
+            self.emit(ast.Expr(value=ast.Call(
+                func=ast.Attribute(
+                    value=_load(target), attr='add', ctx=ast.Load(),
+                ),
+                args=[self.generate(arg)], keywords=[],
+            )))
+        return _load(target)
+
+    def generate_dict(self, args):
+        if len(args) % 2 != 0:
+            return None
+        # Items are set one at a time so an unhashable key fails before the
+        # next items are evaluated, like in the interpreter
+        target = self.temp()
+        self.emit(_assign(target, _call('dict')))
+        for key, value in zip(args[::2], args[1::2]):
+            key = self.generate(key)
+            value = self.generate(value)
+            self.emit(ast.Assign(
+                targets=[_subscript(_load(target), key, ast.Store())],
+                value=value,
+            ))
+        return _load(target)
+
+    def generate_quote(self, args):
+        if len(args) != 1 or has_unquote(args[0]):
+            return None
+        if isinstance(args[0], list):
+            return _call('copy_quoted', self.constant(args[0]))
+        return self.constant(args[0])
+
+    def _generate_arithmetic(self, args, op, initial=None):
+        target = self.temp()
+        if initial is None:
+            if not args:
+                return None
+            initial = self.generate(args[0])
+            args = args[1:]
+        self.emit(_assign(target, initial))
+        for arg in args:
+            self.emit(ast.AugAssign(
+                target=_store(target), op=op, value=self.generate(arg),
+            ))
+        return _load(target)
+
+    def generate_add(self, args):
+        return self._generate_arithmetic(args, ast.Add(), ast.Constant(0))
+
+    def generate_sub(self, args):
+        return self._generate_arithmetic(args, ast.Sub())
+
+    def generate_mul(self, args):
+        return self._generate_arithmetic(args, ast.Mult(), ast.Constant(1))
+
+    def generate_div(self, args):
+        return self._generate_arithmetic(args, ast.Div())
+
+    def _generate_compare(self, args, fails):
+        if not args:
+            return None
+        target = self.temp()
+        outer = self.block
+        lhs = self.generate(args[0])
+        for arg in args[1:]:
+            rhs = self.generate(arg)
+            node = ast.If(
+                test=ast.Compare(left=lhs, ops=[fails()], comparators=[rhs]),
+                body=[_assign(target, ast.Constant(value=False))],
+                orelse=[],
+            )
+            self.emit(node)
+            self.block = node.orelse
+            lhs = rhs
+        self.emit(_assign(target, ast.Constant(value=True)))
+        self.block = outer
+        return _load(target)
+
+    def generate_eq(self, args):
+        return self._generate_compare(args, ast.NotEq)
+
+    def generate_neq(self, args):
+        return self._generate_compare(args, ast.Eq)
+
+    def generate_lt(self, args):
+        return self._generate_compare(args, ast.GtE)
+
+    def generate_gt(self, args):
+        return self._generate_compare(args, ast.LtE)
+
+    def generate_leq(self, args):
+        return self._generate_compare(args, ast.Gt)
+
+    def generate_geq(self, args):
+        return self._generate_compare(args, ast.Lt)
+
+    def generate_and(self, args):
+        return self._generate_chain(
+            args, lambda value: ast.UnaryOp(op=ast.Not(), operand=value),
+            False,
+        )
+
+    def generate_or(self, args):
+        return self._generate_chain(args, lambda value: value, True)
+
+    def generate_not(self, args):
+        return self._generate_chain(args, lambda value: value, False)
+
+    def generate_do(self, args):
+        res = ast.Constant(value=None)
+        for arg in args:
+            res = self.generate(arg)
+        return res
+
+    def generate_if(self, args):
+        if not 2 <= len(args) <= 3:
+            return None
+        target = self.temp()
+        test = self.generate(args[0])
+        self.emit(ast.If(
+            test=test,
+            body=self.generate_branch(args[1], target),
+            orelse=self.generate_branch(
+                args[2] if len(args) == 3 else None, target,
+            ),
+        ))
+        return _load(target)
+
+    def generate_def(self, args):
+        if len(args) != 2 or not isinstance(args[0], KW):
+            return None
+        value = self.generate(args[1])
+        if args[0].value != '_':
+            self.emit(ast.Assign(
+                targets=[_subscript(
+                    _load('env'), ast.Constant(value=args[0].value),
+                    ast.Store(),
+                )],
+                value=value,
+            ))
+        return value
+
+    def generate_for(self, args):
+        if len(args) < 2 or not isinstance(args[0], KW):
+            return None
+        spec = args[0]
+        body = args[2:]
+        body = body[0] if len(body) == 1 else [KW_DO, *body]
+
+        col = self.temp()
+        item = self.temp()
+        target = self.temp()
+        self.emit(
+            _assign(col, self.generate(args[1])),
+            ast.If(
+                test=_isinstance(_load(col), 'dict'),
+                body=[_assign(col, ast.Call(
+                    func=ast.Attribute(
+                        value=_load(col), attr='items', ctx=ast.Load(),
+                    ),
+                    args=[], keywords=[],
+                ))],
+                orelse=[],
+            ),
+            _assign(target, ast.Constant(value=None)),
+        )
+
+        # Binding quotes the item which copies lists
+        copy = ast.Expr(value=_call(
+            'bind', self.constant(spec), _load(item), _load('env'),
+        ))
+        if spec.value == '_':
+            store = []
+        else:
+            store = [ast.Assign(
+                targets=[_subscript(
+                    _load('env'), ast.Constant(value=spec.value),
+                    ast.Store(),
+                )],
+                value=_load(item),
+            )]
+
+        self.depth += 1
+        try:
+            loop_body = [
+                ast.If(
+                    test=_isinstance(_load(item), 'list'),
+                    body=[copy],
+                    orelse=store,
+                ),
+                *self.generate_branch(body, target),
+            ]
+        finally:
+            self.depth -= 1
+        self.emit(ast.For(
+            target=_store(item), iter=_load(col), body=loop_body, orelse=[],
+        ))
+        return _load(target)
+
+    def generate_get(self, args):
+        if not 2 <= len(args) <= 3:
+            return None
+        col = self.generate(args[0])
+        key = self.generate(args[1])
+        lookup = _subscript(col, key, ast.Load())
+        if len(args) == 2:
+            return lookup
+
+        target = self.temp()
+        self.emit(ast.If(
+            test=ast.IfExp(
+                test=_isinstance(col, 'dict'),
+                body=ast.Compare(
+                    left=key, ops=[ast.NotIn()], comparators=[col],
+                ),
+                orelse=ast.UnaryOp(op=ast.Not(), operand=ast.Compare(
+                    left=ast.Constant(value=0),
+                    ops=[ast.LtE(), ast.Lt()],
+                    comparators=[key, _call('len', col)],
+                )),
+            ),
+            body=self.generate_branch(args[2], target),
+            orelse=[_assign(target, lookup)],
+        ))
+        return _load(target)
+
+    def generate_put(self, args):
+        if len(args) != 3:
+            return None
+        value = self.generate(args[2])
+        col = self.generate(args[0])
+        key = self.generate(args[1])
+        self.emit(ast.Assign(
+            targets=[_subscript(col, key, ast.Store())],
+            value=value,
+        ))
+        return value
+
+
+# Names of the methods of Generator that generate builtins
+GENERATED = {
+    'list': 'generate_list',
+    'tuple': 'generate_tuple',
+    'set': 'generate_set',
+    'dict': 'generate_dict',
+    'quote': 'generate_quote',
+    '+': 'generate_add',
+    '-': 'generate_sub',
+    '*': 'generate_mul',
+    '/': 'generate_div',
+    '=': 'generate_eq',
+    '!=': 'generate_neq',
+    '<': 'generate_lt',
+    '>': 'generate_gt',
+    '<=': 'generate_leq',
+    '>=': 'generate_geq',
+    'and': 'generate_and',
+    'or': 'generate_or',
+    'not': 'generate_not',
+    'do': 'generate_do',
+    'if': 'generate_if',
+    'def': 'generate_def',
+    'for': 'generate_for',
+    'get': 'generate_get',
+    'put': 'generate_put',
+}
+
+
+def generate(body, env=None, bound=()):
+    """
+    Compile a body of code to a Python function. This is slower to compile
+    than compile but faster to run for bodies that mostly use the builtins
+    that can be generated. Falls back to compile when the body can not be
+    compiled to a function, for example because it nests too deep or the
+    Python version does not support the generated code.
+
+    @param body: Any
+        The body to compile.
+    @param env: Env
+        The environment the program will run in, or an environment it will
+        run in is based on.
+    @param bound: Iterable[str]
+        Names that environments the program runs in bind on top of env.
+    @return: Program
+        The compiled program.
+    """
+    if env is None:
+        env = Env()
+    try:
+        func = Generator(env, bound).generate_function(body)
+    except Exception:
+        return compile(body, env, bound)
+    return Program(body, func)
@@ -0,0 +1,925 @@
+from collections.abc import MutableMapping
+from operator import iadd, imul, isub
+
+from .lang import (
+    Env, Func, KW, LangException, logger, stdenv, lang_def, lang_get,
+    KW_QUOTE, KW_DO, KW_LIST, FUNC_SPECS,
+)
+
+
+# Builtins that can bind names in the environment they are called in
+BINDERS = frozenset(['def', 'defn', 'undef', 'for', 'eval', '->'])
+
+# Value of a slot of a frame that is not bound
+UNBOUND = object()
+
+
+def _spec_names(spec):
+    """
+    Get the names a spec of def, fn or for might bind.
+
+    @param spec: Any
+        The spec.
+    @return: Iterator[str]
+        The names.
+    """
+    if isinstance(spec, KW):
+        yield spec.value
+    elif isinstance(spec, list):
+        if spec and isinstance(spec[0], KW):
+            spec = spec[1:]
+        for subspec in spec:
+            yield from _spec_names(subspec)
+
+
+def _thread(args):
+    """
+    Rewrite the arguments of -> to the body it runs.
+
+    @param args: List[Any]
+        The arguments of ->.
+    @return: Any
+        The body or None if the arguments are invalid.
+    """
+    if not args or not all(isinstance(arg, list) and arg for arg in args[1:]):
+        return None
+    body = args[0]
+    for arg in args[1:]:
+        body = [arg[0], body, *arg[1:]]
+    return body
+
+
+def _analyze(body, bound):
+    """
+    Collect the names a body might bind.
+
+    @param body: Any
+        The body to analyze.
+    @param bound: Set[str]
+        The set to add the names to.
+    @return: bool
+        Whether the names are known statically, which is not the case when
+        the body evaluates code or uses builtins that bind names as values.
+    """
+    if isinstance(body, KW):
+        return body.value not in BINDERS
+    if not isinstance(body, list) or not body:
+        return True
+
+    head, *args = body
+    static = True
+    if isinstance(head, KW):
+        name = head.value
+        if name in ('def', 'fn', 'for') and args:
+            bound.update(_spec_names(args[0]))
+        elif name == 'defn':
+            for spec in args[:2]:
+                bound.update(_spec_names(spec))
+        elif name == 'undef':
+            for arg in args:
+                bound.update(_spec_names(arg))
+        elif name == 'eval':
+            static = False
+        elif name == '->':
+            threaded = _thread(args)
+            if threaded is None:
+                return False
+            return _analyze(threaded, bound)
+    elif not _analyze(head, bound):
+        static = False
+
+    for arg in args:
+        if not _analyze(arg, bound):
+            static = False
+    return static
+
+
+def _local_names(body, names):
+    """
+    Collect the names a body binds in the environment it runs in, leaving
+    out the bodies of functions it defines.
+
+    @param body: Any
+        The body.
+    @param names: List[str]
+        The list to add the names to.
+    """
+    if not isinstance(body, list) or not body:
+        return
+    head, *args = body
+    if isinstance(head, KW):
+        name = head.value
+        if name in ('def', 'for') and args:
+            names.extend(_spec_names(args[0]))
+        elif name == 'fn':
+            return
+        elif name == 'defn':
+            if args:
+                names.extend(_spec_names(args[0]))
+            return
+        elif name == '->':
+            threaded = _thread(args)
+            if threaded is not None:
+                _local_names(threaded, names)
+            return
+    for item in body:
+        _local_names(item, names)
+
+
+def _uses(body, name):
+    """
+    Check whether a body uses a keyword.
+
+    @param body: Any
+        The body.
+    @param name: str
+        The name of the keyword.
+    @return: bool
+    """
+    if isinstance(body, KW):
+        return body.value == name
+    return isinstance(body, list) and any(_uses(item, name) for item in body)
+
+
+def copy_quoted(value):
+    """
+    Copy a quoted value like quote does, lists are copied and other values
+    are not.
+
+    @param value: Any
+        The quoted value.
+    @return: Any
+        The copy.
+    """
+    if isinstance(value, list):
+        return [copy_quoted(item) for item in value]
+    return value
+
+
+def has_unquote(value):
+    """
+    Check whether quoting a value evaluates any part of it.
+
+    @param value: Any
+        The quoted value.
+    @return: bool
+    """
+    return isinstance(value, list) and (
+        (value and isinstance(value[0], KW) and value[0].value == 'unquote') or
+        any(has_unquote(item) for item in value)
+    )
+
+
+def _traced(name, impl):
+    """
+    Wrap compiled code of a builtin so exceptions are reported like the
+    builtin reports them.
+
+    @param name: str
+        Name of the builtin.
+    @param impl: Callable[[Env], Any]
+        The compiled code.
+    @return: Callable[[Env], Any]
+        The wrapped code.
+    """
+    def code(env):
+        try:
+            return impl(env)
+        except LangException as exc:
+            exc.trace.insert(0, name)
+            raise exc
+        except Exception as exc:
+            raise LangException(exc, trace=[name])
+    return code
+
+
+class Frame(MutableMapping):
+    """
+    Environment of a call of a compiled function. The names the function
+    binds are stored in a list by the slot the compiler assigned them, so
+    compiled code can access them by index. Slots that are not bound yet
+    fall through to the environment the function was defined in like names
+    in an Env do.
+    """
+
+    __slots__ = ('slots', 'values', 'parent', 'extra', 'filtered')
+
+    def __init__(self, slots, parent):
+        """
+        Initialize Frame.
+
+        @param slots: Mapping[str, int]
+            The slot of every name the function binds.
+        @param parent: Mapping
+            The environment the function was defined in.
+        """
+        self.slots = slots
+        self.values = [UNBOUND] * len(slots)
+        self.parent = parent
+        # Names bound without a slot, created when needed
+        self.extra = None
+        # Names removed that should not fall through to the parent
+        self.filtered = None
+
+    def __getitem__(self, key):
+        slot = self.slots.get(key)
+        if slot is not None:
+            value = self.values[slot]
+            if value is not UNBOUND:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        if self.filtered is not None and key in self.filtered:
+            raise KeyError(key)
+        return self.parent[key]
+
+    def __setitem__(self, key, value):
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.values[slot] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.values[slot] = UNBOUND
+        if self.extra is not None:
+            self.extra.pop(key, None)
+        if key in self.parent:
+            if self.filtered is None:
+                self.filtered = set()
+            self.filtered.add(key)
+
+    def __iter__(self):
+        own = {
+            key for key, slot in self.slots.items()
+            if self.values[slot] is not UNBOUND
+        }
+        own.update(self.extra or ())
+        filtered = self.filtered or ()
+        yield from own
+        yield from (
+            key for key in self.parent
+            if key not in own and key not in filtered
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+class CompiledFunc(Func):
+    """
+    A function in the language of which the body is compiled. Calls bind the
+    arguments in a Frame.
+    """
+
+    def __init__(
+        self, spec, body, env, code, slots=None, name='<anonymous>',
+    ):
+        self.code = code
+        self.slots = {} if slots is None else slots
+        # Slots of the parameters if the spec only lists names
+        if spec[0] is KW_LIST and all(
+            isinstance(param, KW) for param in spec[1:]
+        ):
+            self.params = [
+                None if param.value == '_' else
+                self.slots.get(param.value, param.value)
+                for param in spec[1:]
+            ]
+        else:
+            self.params = None
+        super().__init__(spec, body, env, name=name)
+
+    def call(self, values):
+        frame = Frame(self.slots, self.env)
+        params = self.params
+        if params is None or len(values) != len(params):
+            lang_def([self.spec, [KW_QUOTE, values]], frame)
+        else:
+            for param, value in zip(params, values):
+                if isinstance(value, list):
+                    # Binding quotes the values which copies lists
+                    lang_def([self.spec, [KW_QUOTE, values]], frame)
+                    break
+                elif isinstance(param, int):
+                    frame.values[param] = value
+                elif param is not None:
+                    frame[param] = value
+        try:
+            return self.code(frame)
+        except LangException as exc:
+            exc.trace.insert(0, self.name)
+            raise exc
+
+    def run_body(self, env):
+        return self.code(env)
+
+
+# Functions that can be called with evaluated arguments, subclasses might
+# override how they are called.
+CALLABLE_FUNCS = frozenset([Func, CompiledFunc])
+
+
+class Program:
+    """
+    A compiled body of code.
+    """
+
+    def __init__(self, body, code):
+        self.body = body
+        self.code = code
+
+    def __call__(self, env=None, log=False):
+        """
+        Run the program, this behaves like running the body with run.
+
+        @param env: Env
+            The environment, this has to be the environment the program was
+            compiled for or an environment based on it that does not bind any
+            builtins.
+        @param log: bool
+            Whether to log exceptions of the language instead of raising them.
+        @return: Any
+            The result of running the program.
+        """
+        if env is None:
+            env = Env()
+        try:
+            return self.code(env)
+        except LangException as e:
+            if log:
+                logger.error(str(e))
+            else:
+                raise
+
+
+class Compiler:
+    """
+    Compiles bodies of code to nested closures. Builtins are looked up once
+    at compile time when no code in the body can bind their name, and the
+    most common ones are compiled to specialized closures. Everything else
+    is dispatched like run does.
+    """
+
+    def __init__(self, env, bound=()):
+        """
+        Initialize Compiler.
+
+        @param env: Env
+            The environment the code will run in.
+        @param bound: Iterable[str]
+            Names bound by the caller on top of the environment.
+        """
+        self.env = env
+        self.bound = set(bound)
+        self.static = True
+        # Whether names bound by functions are stored in frame slots
+        self.addressed = True
+        # Slots of the names bound by the functions the compiler is in
+        self.scopes = []
+
+    def analyze(self, body):
+        """
+        Analyze a body before compiling it, so the builtins it can use can be
+        resolved.
+
+        @param body: Any
+            The body.
+        """
+        if not _analyze(body, self.bound):
+            self.static = False
+        # Frames only know the names they bind when they are static, and
+        # undef would have to hide slots from compiled code.
+        self.addressed = self.static and not _uses(body, 'undef')
+
+        if self.static:
+            binders = {id(stdenv[name]) for name in BINDERS}
+            for name, value in self.env.items():
+                if id(value) in binders and value is not stdenv.get(name):
+                    # Aliases of binders can bind anything
+                    self.static = False
+                    break
+
+    def resolve(self, name):
+        """
+        Resolve a name to a builtin at compile time.
+
+        @param name: str
+            The name.
+        @return: Callable[[List[Any], Env], Any]
+            The builtin or None if the name might not refer to it when run.
+        """
+        if not self.static or name in self.bound or name not in stdenv:
+            return None
+        try:
+            value = self.env[name]
+        except KeyError:
+            return None
+        if value is not stdenv[name]:
+            return None
+        return value
+
+    def compile(self, body):
+        """
+        Compile a body.
+
+        @param body: Any
+            The body.
+        @return: Callable[[Env], Any]
+            Code that runs the body in an environment.
+        """
+        if isinstance(body, KW):
+            return self.compile_name(body.value)
+        elif isinstance(body, list):
+            if not body:
+                def code(env):
+                    raise LangException(ValueError(
+                        'can\'t execute empty s-expression'
+                    ))
+                return code
+
+            head, *args = body
+            if isinstance(head, KW):
+                func = self.resolve(head.value)
+                if func is not None:
+                    compile_builtin = getattr(
+                        self, SPECIALIZED.get(head.value, ''), None,
+                    )
+                    code = None
+                    if compile_builtin is not None:
+                        code = compile_builtin(args)
+                    if code is not None:
+                        return _traced(head.value, code)
+                    return lambda env: func(args, env)
+            return self.compile_call(head, args)
+        else:
+            return lambda env: body
+
+    def compile_all(self, args):
+        return [self.compile(arg) for arg in args]
+
+    def address(self, name):
+        """
+        Get the address of a name bound by a function the compiler is in.
+
+        @param name: str
+            The name.
+        @return: (int, int)
+            The number of frames to go up and the slot in that frame, or
+            None if no function binds the name.
+        """
+        for depth, slots in enumerate(reversed(self.scopes)):
+            if name in slots:
+                return depth, slots[name]
+        return None
+
+    def compile_function(self, spec, body):
+        """
+        Compile the body of a function, assigning slots to the names it
+        binds.
+
+        @param spec: Any
+            The spec of the parameters.
+        @param body: Any
+            The body.
+        @return: (Callable[[Env], Any], Mapping[str, int])
+            The code and the slots.
+        """
+        if not self.addressed:
+            return self.compile(body), {}
+        names = list(_spec_names(spec))
+        _local_names(body, names)
+        slots = {}
+        for name in names:
+            if name != '_' and name not in slots:
+                slots[name] = len(slots)
+        self.scopes.append(slots)
+        try:
+            return self.compile(body), slots
+        finally:
+            self.scopes.pop()
+
+    def compile_name(self, name):
+        def lookup(env):
+            try:
+                return env[name]
+            except KeyError:
+                raise LangException(NameError(
+                    'name {!r} is not defined'
+                    .format(name)
+                )) from None
+
+        address = self.address(name)
+        if address is None:
+            depth = len(self.scopes)
+            if not depth:
+                return lookup
+
+            # Frames only bind names that have slots, so they are skipped
+            def code(env):
+                for _ in range(depth):
+                    env = env.parent
+                return lookup(env)
+            return code
+        depth, slot = address
+
+        # Slots that are not bound yet fall through to the parent
+        if depth == 0:
+            def code(env):
+                value = env.values[slot]
+                return lookup(env) if value is UNBOUND else value
+        elif depth == 1:
+            def code(env):
+                value = env.parent.values[slot]
+                return lookup(env) if value is UNBOUND else value
+        else:
+            def code(env):
+                frame = env
+                for _ in range(depth):
+                    frame = frame.parent
+                value = frame.values[slot]
+                return lookup(env) if value is UNBOUND else value
+        return code
+
+    def local_slot(self, name):
+        """
+        Get the slot of a name in the frame of the function the compiler is
+        in.
+
+        @param name: str
+            The name.
+        @return: int
+            The slot or None if the name has no slot.
+        """
+        if not self.scopes:
+            return None
+        return self.scopes[-1].get(name)
+
+    def compile_call(self, head, args):
+        head = self.compile(head)
+        compiled_args = self.compile_all(args)
+
+        def code(env):
+            func = head(env)
+            if type(func) in CALLABLE_FUNCS:
+                return func.call([arg(env) for arg in compiled_args])
+            elif isinstance(func, (list, dict, tuple)):
+                return lang_get([[KW_QUOTE, func], *args], env)
+            elif not callable(func):
+                raise LangException(ValueError(
+                    'first argument of s-expression does not evaluate to '
+                    'callable'
+                ))
+            return func(args, env)
+        return code
+
+    # Below here only the specialized builtins, these return None when the
+    # builtin can not be specialized for the arguments.
+
+    def compile_list(self, args):
+        args = self.compile_all(args)
+        return lambda env: [arg(env) for arg in args]
+
+    def compile_tuple(self, args):
+        args = self.compile_all(args)
+        return lambda env: tuple(arg(env) for arg in args)
+
+    def compile_set(self, args):
+        args = self.compile_all(args)
+        return lambda env: {arg(env) for arg in args}
+
+    def compile_dict(self, args):
+        if len(args) % 2 != 0:
+            return None
+        pairs = list(zip(
+            self.compile_all(args[::2]), self.compile_all(args[1::2]),
+        ))
+        return lambda env: {key(env): val(env) for key, val in pairs}
+
+    def compile_quote(self, args):
+        if len(args) != 1 or has_unquote(args[0]):
+            return None
+        value = args[0]
+        return lambda env: copy_quoted(value)
+
+    def compile_add(self, args):
+        args = self.compile_all(args)
+        if len(args) == 2:
+            lhs, rhs = args
+            return lambda env: iadd(iadd(0, lhs(env)), rhs(env))
+
+        def code(env):
+            res = 0
+            for arg in args:
+                res += arg(env)
+            return res
+        return code
+
+    def compile_sub(self, args):
+        if not args:
+            return None
+        first, *args = self.compile_all(args)
+        if len(args) == 1:
+            rhs, = args
+            return lambda env: isub(first(env), rhs(env))
+
+        def code(env):
+            res = first(env)
+            for arg in args:
+                res -= arg(env)
+            return res
+        return code
+
+    def compile_mul(self, args):
+        args = self.compile_all(args)
+        if len(args) == 2:
+            lhs, rhs = args
+            return lambda env: imul(imul(1, lhs(env)), rhs(env))
+
+        def code(env):
+            res = 1
+            for arg in args:
+                res *= arg(env)
+            return res
+        return code
+
+    def compile_div(self, args):
+        if not args:
+            return None
+        first, *args = self.compile_all(args)
+
+        def code(env):
+            res = first(env)
+            for arg in args:
+                res /= arg(env)
+            return res
+        return code
+
+    def _compile_compare(self, args, fails):
+        if not args:
+            return None
+        first, *args = self.compile_all(args)
+        if len(args) == 1:
+            rhs, = args
+            return lambda env: not fails(first(env), rhs(env))
+
+        def code(env):
+            lhs = first(env)
+            for rhs in args:
+                rhs = rhs(env)
+                if fails(lhs, rhs):
+                    return False
+                lhs = rhs
+            return True
+        return code
+
+    def compile_eq(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs != rhs)
+
+    def compile_neq(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs == rhs)
+
+    def compile_lt(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs >= rhs)
+
+    def compile_gt(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs <= rhs)
+
+    def compile_leq(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs > rhs)
+
+    def compile_geq(self, args):
+        return self._compile_compare(args, lambda lhs, rhs: lhs < rhs)
+
+    def compile_and(self, args):
+        args = self.compile_all(args)
+        return lambda env: all(arg(env) for arg in args)
+
+    def compile_or(self, args):
+        args = self.compile_all(args)
+        return lambda env: any(arg(env) for arg in args)
+
+    def compile_not(self, args):
+        args = self.compile_all(args)
+        return lambda env: all(not arg(env) for arg in args)
+
+    def compile_do(self, args):
+        args = self.compile_all(args)
+
+        def code(env):
+            res = None
+            for arg in args:
+                res = arg(env)
+            return res
+        return code
+
+    def compile_if(self, args):
+        if not 2 <= len(args) <= 3:
+            return None
+        test, then, *otherwise = self.compile_all(args)
+        if otherwise:
+            otherwise, = otherwise
+            return lambda env: then(env) if test(env) else otherwise(env)
+        return lambda env: then(env) if test(env) else None
+
+    def compile_def(self, args):
+        if len(args) != 2 or not isinstance(args[0], KW):
+            return None
+        name = args[0].value
+        value = self.compile(args[1])
+        if name == '_':
+            return value
+
+        slot = self.local_slot(name)
+        if slot is not None:
+            def code(env):
+                res = env.values[slot] = value(env)
+                return res
+        else:
+            def code(env):
+                res = env[name] = value(env)
+                return res
+        return code
+
+    def compile_fn(self, args):
+        if len(args) < 2 or not (
+            isinstance(args[0], list) and
+            len(args[0]) >= 1 and
+            args[0][0] in FUNC_SPECS
+        ):
+            return None
+        spec, *body = args
+        body = [KW_DO, *body] if len(body) > 1 else body[0]
+        body_code, slots = self.compile_function(spec, body)
+        return lambda env: CompiledFunc(spec, body, env, body_code, slots)
+
+    def compile_defn(self, args):
+        if len(args) < 3 or not isinstance(args[0], KW) or not (
+            isinstance(args[1], list) and
+            len(args[1]) >= 1 and
+            args[1][0] in FUNC_SPECS
+        ):
+            return None
+        name = args[0].value
+        spec, *body = args[1:]
+        body = [KW_DO, *body] if len(body) > 1 else body[0]
+        body_code, slots = self.compile_function(spec, body)
+        return lambda env: CompiledFunc(
+            spec, body, env, body_code, slots, name=name,
+        )
+
+    def compile_for(self, args):
+        if len(args) < 2 or not isinstance(args[0], KW):
+            return None
+        spec = args[0]
+        name = spec.value
+        slot = self.local_slot(name)
+        col = self.compile(args[1])
+        body = args[2:]
+        body = self.compile(body[0] if len(body) == 1 else [KW_DO, *body])
+
+        def code(env):
+            col_value = col(env)
+            if isinstance(col_value, dict):
+                col_value = col_value.items()
+            res = None
+            for item in col_value:
+                if isinstance(item, list):
+                    # Binding quotes the item which copies lists
+                    lang_def([spec, [KW_QUOTE, item]], env)
+                elif slot is not None:
+                    env.values[slot] = item
+                elif name != '_':
+                    env[name] = item
+                res = body(env)
+            return res
+        return code
+
+    def compile_len(self, args):
+        args = self.compile_all(args)
+        return lambda env: sum(len(arg(env)) for arg in args)
+
+    def compile_in(self, args):
+        if not args:
+            return None
+        col, *args = self.compile_all(args)
+
+        def code(env):
+            col_value = col(env)
+            for arg in args:
+                if arg(env) not in col_value:
+                    return False
+            return True
+        return code
+
+    def compile_get(self, args):
+        if not 2 <= len(args) <= 3:
+            return None
+        col, key, *default = self.compile_all(args)
+        if not default:
+            return lambda env: col(env)[key(env)]
+        default, = default
+
+        def code(env):
+            col_value = col(env)
+            key_value = key(env)
+            if (
+                key_value not in col_value
+                if isinstance(col_value, dict) else
+                not 0 <= key_value < len(col_value)
+            ):
+                return default(env)
+            return col_value[key_value]
+        return code
+
+    def compile_put(self, args):
+        if len(args) != 3:
+            return None
+        col, key, value = self.compile_all(args)
+
+        def code(env):
+            res = value(env)
+            col(env)[key(env)] = res
+            return res
+        return code
+
+    def compile_str(self, args):
+        args = self.compile_all(args)
+        return lambda env: ''.join(str(arg(env)) for arg in args)
+
+    def compile_null_check(self, args):
+        args = self.compile_all(args)
+        return lambda env: all(arg(env) is None for arg in args)
+
+    def compile_not_null_check(self, args):
+        args = self.compile_all(args)
+        return lambda env: not all(arg(env) is None for arg in args)
+
+    def compile_thread(self, args):
+        body = _thread(args)
+        if body is None:
+            return None
+        return self.compile(body)
+
+
+# Names of the methods of Compiler that specialize builtins
+SPECIALIZED = {
+    'list': 'compile_list',
+    'tuple': 'compile_tuple',
+    'set': 'compile_set',
+    'dict': 'compile_dict',
+    'quote': 'compile_quote',
+    '+': 'compile_add',
+    '-': 'compile_sub',
+    '*': 'compile_mul',
+    '/': 'compile_div',
+    '=': 'compile_eq',
+    '!=': 'compile_neq',
+    '<': 'compile_lt',
+    '>': 'compile_gt',
+    '<=': 'compile_leq',
+    '>=': 'compile_geq',
+    'and': 'compile_and',
+    'or': 'compile_or',
+    'not': 'compile_not',
+    'do': 'compile_do',
+    'if': 'compile_if',
+    'def': 'compile_def',
+    'fn': 'compile_fn',
+    'defn': 'compile_defn',
+    'for': 'compile_for',
+    'len': 'compile_len',
+    'in': 'compile_in',
+    'get': 'compile_get',
+    'put': 'compile_put',
+    'str': 'compile_str',
+    'null?': 'compile_null_check',
+    'not_null?': 'compile_not_null_check',
+    '->': 'compile_thread',
+}
+
+
+def compile(body, env=None, bound=()):
+    """
+    Compile a body of code, running the result behaves like running the body
+    with run but avoids dispatching on every node of the body again.
+
+    @param body: Any
+        The body to compile.
+    @param env: Env
+        The environment the program will run in, or an environment it will
+        run in is based on.
+    @param bound: Iterable[str]
+        Names that environments the program runs in bind on top of env.
+    @return: Program
+        The compiled program.
+    """
+    if env is None:
+        env = Env()
+    compiler = Compiler(env, bound)
+    compiler.analyze(body)
+    return Program(body, compiler.compile(body))
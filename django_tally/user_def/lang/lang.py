@@ -1,5 +1,7 @@
 import json
 import logging
+import threading
+import weakref
 
 from collections.abc import MutableMapping
 
@@ -66,22 +68,60 @@ class LangException(Exception):
         return '{}: {}'.format(type(self.exc).__name__, self.exc)
 
 
+# Keywords that are alive by value, so every value has a single keyword
+_keywords = weakref.WeakValueDictionary()
+_keywords_lock = threading.Lock()
+
+
 class KW:
     """
-    A keyword in the language.
+    A keyword in the language. Keywords are interned, creating a keyword
+    with the value of an existing keyword returns the existing keyword. So
+    keywords are compared and hashed by identity, which is faster than by
+    value. The value of a keyword must not be changed.
     """
 
-    def __init__(self, value):
-        self.value = value
+    __slots__ = ('value', '__weakref__')
+
+    def __new__(cls, value):
+        try:
+            return _keywords[value]
+        except KeyError:
+            pass
+        with _keywords_lock:
+            keyword = _keywords.get(value)
+            if keyword is None:
+                keyword = super().__new__(cls)
+                keyword.value = value
+                _keywords[value] = keyword
+        return keyword
 
     def __repr__(self):
         return self.value
 
-    def __eq__(self, other):
-        return isinstance(other, KW) and self.value == other.value
+    def __reduce__(self):
+        return (KW, (self.value,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
 
-    def __hash__(self):
-        return hash((KW, self.value))
+
+# Keywords used by the builtins
+KW_QUOTE = KW('quote')
+KW_DO = KW('do')
+KW_LIST = KW('list')
+KW_TUPLE = KW('tuple')
+KW_DICT = KW('dict')
+KW_SET = KW('set')
+KW_INTO_LIST = KW('into_list')
+KW_INTO_TUPLE = KW('into_tuple')
+KW_INTO_DICT = KW('into_dict')
+KW_INTO_SET = KW('into_set')
+# Keywords the spec of the parameters of a function can start with
+FUNC_SPECS = frozenset([KW_LIST, KW('list_into')])
 
 
 class Func:
@@ -99,15 +139,36 @@ class Func:
             self.env[name] = self
 
     def __call__(self, args, env):
+        return self.call([run(arg, env) for arg in args])
+
+    def call(self, values):
+        """
+        Call the function with evaluated arguments.
+
+        @param values: List[Any]
+            The values of the arguments.
+        @return: Any
+            The result of the function.
+        """
         func_env = Env(base_env=self.env)
-        args = [KW('quote'), [run(arg, env) for arg in args]]
-        lang_def([self.spec, args], func_env)
+        lang_def([self.spec, [KW_QUOTE, values]], func_env)
         try:
-            return run(self.body, func_env)
+            return self.run_body(func_env)
         except LangException as exc:
             exc.trace.insert(0, self.name)
             raise exc
 
+    def run_body(self, env):
+        """
+        Run the body of the function.
+
+        @param env: Env
+            The environment of the call with the arguments bound.
+        @return: Any
+            The result of the body.
+        """
+        return run(self.body, env)
+
 
 def run(body, env=None, log=False):
     """
@@ -138,7 +199,7 @@ def run(body, env=None, log=False):
 
             func = run(body[0], env)
             if isinstance(func, (list, dict, tuple)):
-                params = [[KW('quote'), func], *body[1:]]
+                params = [[KW_QUOTE, func], *body[1:]]
                 func = lang_get
             elif not callable(func):
                 raise LangException(ValueError(
@@ -414,7 +475,7 @@ def lang_def(args, env):
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('list')
+        spec[0] is KW_LIST
     ):
         assert isinstance(value, list), 'value must be a list'
         spec = spec[1:]
@@ -424,7 +485,7 @@ def lang_def(args, env):
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('tuple')
+        spec[0] is KW_TUPLE
     ):
         assert isinstance(value, tuple), 'value must be a tuple'
         spec = spec[1:]
@@ -434,7 +495,7 @@ def lang_def(args, env):
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('dict')
+        spec[0] is KW_DICT
     ):
         assert isinstance(value, dict), 'value must be a dict'
         spec = {
@@ -448,7 +509,7 @@ def lang_def(args, env):
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('set')
+        spec[0] is KW_SET
     ):
         assert isinstance(value, set), 'value must be a set'
         spec = {run(key, env) for key in spec[1:]}
@@ -458,14 +519,14 @@ def lang_def(args, env):
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('into_list')
+        spec[0] is KW_INTO_LIST
     ):
         assert isinstance(value, list), 'value must be a list'
         for subspec in spec[1:]:
             if (
                 isinstance(subspec, list) and
                 len(subspec) >= 1 and
-                subspec[0] == KW('list')
+                subspec[0] is KW_LIST
             ):
                 assert len(value) >= len(subspec) - 1, (
                     'value has incorrect length'
@@ -475,18 +536,18 @@ def lang_def(args, env):
             else:
                 subvalue = value
                 value = []
-            lang_def([subspec, [KW('quote'), subvalue]], env)
+            lang_def([subspec, [KW_QUOTE, subvalue]], env)
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('into_tuple')
+        spec[0] is KW_INTO_TUPLE
     ):
         assert isinstance(value, tuple), 'value must be a tuple'
         for subspec in spec[1:]:
             if (
                 isinstance(subspec, list) and
                 len(subspec) >= 1 and
-                subspec[0] == KW('tuple')
+                subspec[0] is KW_TUPLE
             ):
                 assert len(value) >= len(subspec) - 1, (
                     'value has incorrect length'
@@ -496,11 +557,11 @@ def lang_def(args, env):
             else:
                 subvalue = value
                 value = ()
-            lang_def([subspec, [KW('quote'), subvalue]], env)
+            lang_def([subspec, [KW_QUOTE, subvalue]], env)
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('into_dict')
+        spec[0] is KW_INTO_DICT
     ):
         assert isinstance(value, dict), 'value must be a dict'
         value = dict(value)
@@ -508,21 +569,21 @@ def lang_def(args, env):
             if (
                 isinstance(subspec, list) and
                 len(subspec) >= 1 and
-                subspec[0] == KW('dict')
+                subspec[0] is KW_DICT
             ):
                 for key, subsubspec in zip(subspec[1::2], subspec[2::2]):
                     key = run(key, env)
                     assert key in value, 'value lacks key: ' + str(key)
                     subvalue = value.pop(key)
-                    lang_def([subsubspec, [KW('quote'), subvalue]], env)
+                    lang_def([subsubspec, [KW_QUOTE, subvalue]], env)
             else:
                 subvalue = value
                 value = {}
-                lang_def([subspec, [KW('quote'), subvalue]], env)
+                lang_def([subspec, [KW_QUOTE, subvalue]], env)
     elif (
         isinstance(spec, list) and
         len(spec) >= 1 and
-        spec[0] == KW('into_set')
+        spec[0] is KW_INTO_SET
     ):
         assert isinstance(value, set), 'value must be a set'
         value = set(value)
@@ -530,7 +591,7 @@ def lang_def(args, env):
             if (
                 isinstance(subspec, list) and
                 len(subspec) >= 1 and
-                subspec[0] == KW('set')
+                subspec[0] is KW_SET
             ):
                 for key in subspec[1:]:
                     key = run(key, env)
@@ -539,7 +600,7 @@ def lang_def(args, env):
             else:
                 subvalue = value
                 value = set()
-                lang_def([subspec, [KW('quote'), subvalue]], env)
+                lang_def([subspec, [KW_QUOTE, subvalue]], env)
     else:
         spec = run(spec)
         assert value == spec, 'value has incorrect value'
@@ -574,13 +635,13 @@ def lang_fn(args, env):
     if not (
         isinstance(args[0], list) and
         len(args[0]) >= 1 and
-        args[0][0] in {KW('list'), KW('list_into')}
+        args[0][0] in FUNC_SPECS
     ):
         raise TypeError(
             'argument 0 must be a list that starts with list or list_into'
         )
     if len(args) > 2:
-        body = [KW('do')] + list(args[1:])
+        body = [KW_DO] + list(args[1:])
     else:
         body = args[1]
     return Func(args[0], body, env)
@@ -598,14 +659,14 @@ def lang_defn(args, env):
     if not (
         isinstance(args[1], list) and
         len(args[1]) >= 1 and
-        args[1][0] in {KW('list'), KW('list_into')}
+        args[1][0] in FUNC_SPECS
     ):
         raise TypeError(
             'argument 1 must be a list that starts with list or list_into'
         )
     name = args[0].value
     if len(args) > 3:
-        body = [KW('do')] + args[2:]
+        body = [KW_DO] + args[2:]
     else:
         body = args[2]
     func = Func(args[1], body, env, name=name)
@@ -851,8 +912,12 @@ def lang_get_tally(args, env):
     if not isinstance(args[0], KW):
         raise TypeError('argument 0 must be KW')
 
-    from ...data.models import Data
-    return json.loads(Data.objects.get(name=args[0]).value)
+    from ...data.cache import cache
+    value = cache.get(args[0].value)
+    # Typed columns hold numbers, the value column JSON
+    if isinstance(value, str):
+        value = json.loads(value)
+    return value
 
 
 @register('for')
@@ -866,7 +931,7 @@ def lang_for(args, env):
     if len(body) == 1:
         body = body[0]
     else:
-        body = [KW('do'), *body]
+        body = [KW_DO, *body]
 
     col = run(col, env)
     if isinstance(col, dict):
@@ -874,7 +939,7 @@ def lang_for(args, env):
 
     res = None
     for item in col:
-        lang_def([spec, [KW('quote'), item]], env)
+        lang_def([spec, [KW_QUOTE, item]], env)
         res = run(body, env)
     return res
 
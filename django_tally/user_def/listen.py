@@ -1,7 +1,10 @@
+import inspect
+
 from django.db.models import Model
 from django.db.models.signals import post_save, post_delete
 from django.db.utils import ProgrammingError
 
+from ..data import DBStored, ensure_data_many
 from ..subscription import Subscription
 from .tally import UserDefTallyBase
 from .group_tally import UserDefGroupTallyBase
@@ -9,6 +12,30 @@ from .group_tally import UserDefGroupTallyBase
 
 DEFAULT_TALLIES = (UserDefTallyBase, UserDefGroupTallyBase)
 
+# Whether the as_tally method of a class accepts ensure, by class
+_accepts_ensure = {}
+
+
+def accepts_ensure(cls):
+    """
+    Check if the as_tally method of a user defined tally class accepts the
+    ensure argument, subclasses might override it without it.
+
+    @param cls: Class
+        The user defined tally class.
+    @return: bool
+    """
+    try:
+        return _accepts_ensure[cls]
+    except KeyError:
+        parameters = inspect.signature(cls.as_tally).parameters.values()
+        accepts = _accepts_ensure[cls] = any(
+            parameter.name == 'ensure' or
+            parameter.kind == inspect.Parameter.VAR_KEYWORD
+            for parameter in parameters
+        )
+        return accepts
+
 
 class TallySubscription(Subscription):
     """
@@ -21,9 +48,18 @@ class TallySubscription(Subscription):
         self._senders = senders
         self._active_tallies = {}
 
-    def _open_tally(self, instance):
+    def _as_tally(self, instance, ensure=True):
+        if (
+            isinstance(instance, DEFAULT_TALLIES) and
+            accepts_ensure(type(instance))
+        ):
+            return instance.as_tally(ensure=ensure)
+        return instance.as_tally()
+
+    def _open_tally(self, instance, tally=None):
         old_tally = self._close_tally(instance)
-        tally = instance.as_tally()
+        if tally is None:
+            tally = self._as_tally(instance)
         if old_tally is not None:
             tally._Tally__model_data = old_tally._Tally__model_data
         self._active_tallies[instance] = (tally, tally.listen(*self._senders))
@@ -45,14 +81,25 @@ class TallySubscription(Subscription):
         for signal, handler, sender in self._receivers:
             if signal == post_save and handler == self.handle_post_save:
                 try:
-                    for instance in sender.objects.all():
-                        self._open_tally(instance)
+                    instances = list(sender.objects.all())
                 except ProgrammingError as e:
                     if not str(e).startswith(
                         'relation "{}" does not exist\n'
                         .format(sender._meta.db_table)
                     ):
                         raise
+                    continue
+
+                # Create the data of all tallies at once
+                tallies = [
+                    self._as_tally(instance, ensure=False)
+                    for instance in instances
+                ]
+                ensure_data_many(
+                    tally for tally in tallies if isinstance(tally, DBStored)
+                )
+                for instance, tally in zip(instances, tallies):
+                    self._open_tally(instance, tally)
 
     def close(self):
         for instance in list(self._active_tallies):
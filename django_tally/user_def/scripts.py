@@ -0,0 +1,102 @@
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+
+from .lang import compile, Env
+from .lang.json import decode
+
+
+class ScriptCache:
+    """
+    Cache of the compiled scripts of user defined tallies by the hash of
+    their content, so tallies with the same scripts, like tallies created
+    from the same template, decode and compile them once. The environment
+    base evaluates to is shared by these tallies as well, so scripts should
+    not change the values base defines. The least recently used scripts are
+    evicted when the cache is full.
+    """
+
+    def __init__(self, max_entries=1024):
+        """
+        Initialize ScriptCache.
+
+        @param max_entries: int
+            Maximum amount of compiled scripts to keep, None for no maximum.
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_key(self, base, scripts, bound, compile_script):
+        """
+        Get the key of scripts in the cache.
+
+        @param base: Any
+            The JSON encoded base script.
+        @param scripts: Mapping[str, Any]
+            The JSON encoded scripts by name.
+        @param bound: Mapping[str, List[str]]
+            The names the scripts are run with bound by name of the script.
+        @param compile_script: Callable
+            The function the scripts are compiled with.
+        @return: Hashable
+        """
+        content = json.dumps(
+            [base, scripts, bound], sort_keys=True,
+        ).encode()
+        return (hashlib.sha256(content).hexdigest(), compile_script)
+
+    def get(self, base, scripts, bound, compile_script=compile):
+        """
+        Get the compiled scripts, compiling them if they are not cached.
+
+        @param base: Any
+            The JSON encoded base script, this is run in the environment the
+            other scripts run in.
+        @param scripts: Mapping[str, Any]
+            The JSON encoded scripts by name.
+        @param bound: Mapping[str, List[str]]
+            The names the scripts are run with bound by name of the script.
+        @param compile_script: Callable
+            The function to compile the scripts with, like lang.compile.
+        @return: (Env, Mapping[str, Program])
+            The environment base evaluated to and the compiled scripts by
+            name.
+        """
+        key = self.get_key(base, scripts, bound, compile_script)
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        env = Env()
+        compile(decode(base), env)(env, log=True)
+        entry = (env, {
+            name: compile_script(decode(script), env, bound=bound[name])
+            for name, script in scripts.items()
+        })
+
+        with self._lock:
+            # Another thread might have compiled the scripts meanwhile
+            entry = self._entries.setdefault(key, entry)
+            if (
+                self.max_entries is not None and
+                len(self._entries) > self.max_entries
+            ):
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """
+        Remove all compiled scripts.
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+# Cache shared by the process
+cache = ScriptCache()
@@ -4,9 +4,9 @@ from django.contrib.postgres import fields as pg_fields
 from ..data import DBStored
 from ..tally import Tally
 
-from .lang import run, Env
-from .lang.json import decode
+from .lang import compile, Env
 from .instance_wrapper import InstanceWrapper
+from .scripts import cache
 
 
 class UserDefTallyBaseNonStored(models.Model):
@@ -36,35 +36,46 @@ class UserDefTallyBaseNonStored(models.Model):
         blank=True, null=True,
     )
 
+    def get_scripts(self):
+        """
+        Get the scripts the tally runs besides base.
+
+        @return: Mapping[str, Any]
+            The JSON encoded scripts by name.
+        """
+        return {name: getattr(self, name) for name in self.UserTally.bound}
+
     def as_tally(self, **kwargs):
-        base = decode(self.base)
-        get_tally = decode(self.get_tally)
-        get_value = decode(self.get_value)
-        get_nonexisting_value = decode(self.get_nonexisting_value)
-        filter_value = decode(self.filter_value)
-        handle_change = decode(self.handle_change)
-
-        env = Env()
-        run(base, env, log=True)
-
-        return self.UserTally(
-            env=env,
-            get_tally=get_tally,
-            get_value=get_value,
-            get_nonexisting_value=get_nonexisting_value,
-            filter_value=filter_value,
-            handle_change=handle_change,
-            **kwargs
+        # Tallies with the same scripts share the compiled scripts and the
+        # environment base evaluated to
+        env, programs = cache.get(
+            self.base, self.get_scripts(), self.UserTally.bound,
+            self.UserTally.compile_script,
         )
+        return self.UserTally(env=env, **programs, **kwargs)
 
     class UserTally(Tally):
 
+        # Compiles the scripts of the tally, lang.generate compiles them to
+        # Python functions which pays off for heavy scripts.
+        compile_script = staticmethod(compile)
+
+        # Names the scripts are run with bound by name of the script
+        bound = {
+            'get_tally': [],
+            'get_value': ['instance'],
+            'get_nonexisting_value': [],
+            'filter_value': ['value'],
+            'handle_change': ['tally', 'old_value', 'new_value'],
+        }
+
         def __init__(
             self, env, get_tally, get_value, get_nonexisting_value,
             filter_value, handle_change,
         ):
             super().__init__(None)
             self._env = env
+            # Compiled programs that are run for every event
             self._get_tally = get_tally
             self._get_value = get_value
             self._get_nonexisting_value = get_nonexisting_value
@@ -72,11 +83,10 @@ class UserDefTallyBaseNonStored(models.Model):
             self._handle_change = handle_change
 
         def get_tally(self):
-            return run(self._get_tally, Env(base_env=self._env), log=True)
+            return self._get_tally(Env(base_env=self._env), log=True)
 
         def get_value(self, instance):
-            return run(
-                self._get_value,
+            return self._get_value(
                 Env(
                     env={'instance': InstanceWrapper(instance)},
                     base_env=self._env,
@@ -85,22 +95,19 @@ class UserDefTallyBaseNonStored(models.Model):
             )
 
         def get_nonexisting_value(self):
-            return run(
-                self._get_nonexisting_value,
+            return self._get_nonexisting_value(
                 Env(base_env=self._env),
                 log=True,
             )
 
         def filter_value(self, value):
-            return run(
-                self._filter_value,
+            return self._filter_value(
                 Env(env={'value': value}, base_env=self._env),
                 log=True,
             )
 
         def handle_change(self, tally, old_value, new_value):
-            return run(
-                self._handle_change,
+            return self._handle_change(
                 Env(
                     env={
                         'tally': tally,
@@ -120,15 +127,18 @@ class UserDefTallyBase(UserDefTallyBaseNonStored):
 
     db_name = models.TextField(unique=True)
 
-    def as_tally(self):
-        return super().as_tally(db_name=self.db_name)
+    def as_tally(self, ensure=True):
+        return super().as_tally(db_name=self.db_name, ensure=ensure)
 
     class UserTally(DBStored, UserDefTallyBaseNonStored.UserTally):
 
-        def __init__(self, db_name, **kwargs):
+        db_patch = True
+
+        def __init__(self, db_name, ensure=True, **kwargs):
             super(DBStored, self).__init__(**kwargs)
             self.db_name = db_name
-            self.ensure_data()
+            if ensure:
+                self.ensure_data()
 
     class Meta:
         abstract = True
@@ -25,7 +25,7 @@ setup(
         'Topic :: Utilities',
     ],
     install_requires=[
-        'django>=1.11',
+        'django>=2.2',
         'psycopg2>=2.5.4',
     ],
 )
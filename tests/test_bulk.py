@@ -0,0 +1,95 @@
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from django_tally import Tally, Sum
+from django_tally.data import DBStored
+from django_tally.data.models import Data
+
+from .testapp.models import Qux
+
+
+class ValueSum(Sum, Tally):
+
+    tracked_fields = ('value',)
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class StoredValueSum(DBStored, ValueSum):
+
+    db_name = 'value_sum'
+
+
+class BulkTest(TestCase):
+
+    def test_bulk_operations(self):
+        tally = ValueSum()
+
+        with tally.on(Qux), patch.object(
+            tally, 'handle_changes', wraps=tally.handle_changes,
+        ) as handle_changes:
+            # Bulk create
+            Qux.objects.bulk_create([Qux(value=1), Qux(value=2)])
+            self.assertEqual(tally.tally, 3)
+            self.assertEqual(handle_changes.call_count, 1)
+            # Update
+            Qux.objects.filter(value=2).update(value=5)
+            self.assertEqual(tally.tally, 6)
+            self.assertEqual(handle_changes.call_count, 2)
+            # Bulk update
+            quxs = list(Qux.objects.order_by('value'))
+            for qux in quxs:
+                qux.value *= 2
+            Qux.objects.bulk_update(quxs, ['value'])
+            self.assertEqual(tally.tally, 12)
+            self.assertEqual(handle_changes.call_count, 3)
+            # Delete
+            Qux.objects.all().delete()
+            self.assertEqual(tally.tally, 0)
+            self.assertEqual(handle_changes.call_count, 4)
+            # Saving still works as usual
+            Qux(value=3).save()
+            self.assertEqual(tally.tally, 3)
+
+    def test_bulk_update_fields(self):
+        tally = ValueSum()
+        Qux.objects.bulk_create([Qux(value=1), Qux(value=2)])
+
+        with tally.on(Qux):
+            quxs = list(Qux.objects.order_by('value'))
+            for qux in quxs:
+                qux.value *= 2
+                qux.other = 1
+            Qux.objects.bulk_update(quxs, ['other'])
+            # Values were not written so they are not tallied
+            self.assertEqual(tally.tally, 0)
+            self.assertEqual(
+                list(Qux.objects.values_list('value', flat=True)), [1, 2],
+            )
+
+    def test_bulk_create_ignore_conflicts(self):
+        tally = ValueSum()
+
+        with tally.on(Qux):
+            with self.assertRaises(ValueError):
+                Qux.objects.bulk_create([Qux(value=1)], ignore_conflicts=True)
+        Qux.objects.bulk_create([Qux(value=1)], ignore_conflicts=True)
+        self.assertEqual(Qux.objects.count(), 1)
+
+    def test_no_listeners(self):
+        Qux.objects.bulk_create([Qux(value=1), Qux(value=2)])
+        with self.assertNumQueries(1):
+            Qux.objects.update(value=3)
+
+    def test_stored(self):
+        tally = StoredValueSum()
+
+        with tally.on(Qux):
+            Qux.objects.bulk_create([Qux(value=n) for n in range(10)])
+            self.assertEqual(Data.objects.get(name='value_sum').value, 45)
+            # Fetch old, update, fetch new, and a single update of the tally
+            with self.assertNumQueries(4):
+                Qux.objects.update(value=1)
+            self.assertEqual(Data.objects.get(name='value_sum').value, 10)
@@ -0,0 +1,109 @@
+import time
+from unittest import mock
+
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from django_tally import Tally, Sum
+from django_tally.data import DBStored
+from django_tally.data.cache import DataCache
+from django_tally.data.models import Data
+
+from .testapp.models import Foo
+
+
+class CachedValueSum(DBStored, Sum, Tally):
+
+    db_name = 'cached_value_sum'
+    db_notify = True
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class LocalValueSum(CachedValueSum):
+
+    db_name = 'local_value_sum'
+    db_notify = False
+
+
+class DataCacheTest(TransactionTestCase):
+
+    def setUp(self):
+        self.cache = DataCache(retry_interval=0.1)
+        self.assertTrue(self.cache.start(timeout=5))
+
+    def tearDown(self):
+        self.cache.stop()
+
+    def test_cache(self):
+        tally = CachedValueSum()
+
+        with tally.on(Foo):
+            self.assertEqual(self.cache.get('cached_value_sum'), 0)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.cache.get('cached_value_sum'), 0)
+            # Change is notified to the cache
+            Foo(value=3).save()
+            self.assertCached('cached_value_sum', 3)
+            # Other writes are notified as well
+            tally.rebuild(Foo.objects.none())
+            self.assertCached('cached_value_sum', 0)
+
+    def test_cache_own_writes(self):
+        tally = LocalValueSum()
+
+        with mock.patch('django_tally.data.db_stored.cache', self.cache):
+            with tally.on(Foo):
+                self.assertEqual(self.cache.get('local_value_sum'), 0)
+                # Writes of this process are evicted when they commit
+                with transaction.atomic():
+                    Foo(value=3).save()
+                    Foo(value=4).save()
+                self.assertEqual(self.cache.get('local_value_sum'), 7)
+                Foo(value=1).save()
+                self.assertEqual(self.cache.get('local_value_sum'), 8)
+                tally.rebuild(Foo.objects.none())
+                self.assertEqual(self.cache.get('local_value_sum'), 0)
+
+    def test_get_many(self):
+        Data.objects.create(name='foo', value=1)
+        Data.objects.create(name='bar', value=2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.cache.get_many(['foo', 'bar', 'baz']),
+                {'foo': 1, 'bar': 2},
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cache.get_many(['foo', 'bar']), {
+                'foo': 1, 'bar': 2,
+            })
+        with self.assertRaises(Data.DoesNotExist):
+            self.cache.get('baz')
+
+    def test_not_started(self):
+        Data.objects.create(name='foo', value=1)
+        cache = DataCache()
+        self.assertEqual(cache.get('foo'), 1)
+        # Values are not cached and no listener is started
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get('foo'), 1)
+        self.assertIsNone(cache._listener)
+
+    def test_no_cache_in_transaction(self):
+        Data.objects.create(name='foo', value=1)
+
+        with transaction.atomic():
+            Data.objects.filter(name='foo').update(value=2)
+            self.assertEqual(self.cache.get('foo'), 2)
+            transaction.set_rollback(True)
+
+        self.assertEqual(self.cache.get('foo'), 1)
+
+    def assertCached(self, name, value, timeout=5):
+        deadline = time.monotonic() + timeout
+        while self.cache.get(name) != value:
+            if time.monotonic() > deadline:
+                self.fail('{} was never evicted'.format(name))
+            time.sleep(0.01)
@@ -0,0 +1,148 @@
+from unittest.mock import patch
+
+from django.db import transaction
+from django.test import TransactionTestCase
+
+from django_tally import Tally, Sum
+
+from .testapp.models import Foo, Qux
+
+
+class CoalescedSum(Sum, Tally):
+
+    tracked_fields = ('value',)
+    coalesce = True
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class CoalesceTest(TransactionTestCase):
+
+    def test_coalesce(self):
+        tally = CoalescedSum()
+
+        with tally.on(Foo), patch.object(
+            tally, 'handle_change', wraps=tally.handle_change,
+        ) as handle_change:
+            with transaction.atomic():
+                foo1 = Foo(value=1)
+                foo1.save()
+                for value in range(2, 10):
+                    foo1.value = value
+                    foo1.save()
+                foo2 = Foo(value=1)
+                foo2.save()
+                foo2.delete()
+                self.assertEqual(tally.tally, 0)
+            self.assertEqual(tally.tally, 9)
+            # Created and deleted instance is netted away
+            self.assertEqual(handle_change.call_count, 1)
+
+            # Outside of a transaction changes are handled directly
+            foo1.value = 5
+            foo1.save()
+            self.assertEqual(tally.tally, 5)
+            self.assertEqual(handle_change.call_count, 2)
+
+    def test_rollback(self):
+        tally = CoalescedSum()
+
+        with tally.on(Foo):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Foo(value=1).save()
+                    raise ValueError
+            with transaction.atomic():
+                Foo(value=2).save()
+            self.assertEqual(tally.tally, 2)
+
+    def test_bulk(self):
+        tally = CoalescedSum()
+
+        with tally.on(Qux):
+            with transaction.atomic():
+                Qux.objects.bulk_create([Qux(value=1), Qux(value=2)])
+                Qux.objects.update(value=3)
+                self.assertEqual(tally.tally, 0)
+            self.assertEqual(tally.tally, 6)
+
+    def test_savepoint_rollback(self):
+        tally = CoalescedSum()
+
+        with tally.on(Foo):
+            with transaction.atomic():
+                foo = Foo(value=1)
+                foo.save()
+                with self.assertRaises(ValueError):
+                    with transaction.atomic():
+                        foo.value = 5
+                        foo.save()
+                        Foo(value=10).save()
+                        raise ValueError
+                # The rolled back value is not used as old value
+                foo.value = 2
+                foo.save()
+                with transaction.atomic():
+                    foo.value = 3
+                    foo.save()
+                # Change after the savepoint is netted after its changes
+                foo.value = 4
+                foo.save()
+                self.assertEqual(tally.tally, 0)
+            self.assertEqual(tally.tally, 4)
+
+            # Snapshots of rolled back changes are discarded too
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    foo.value = 6
+                    foo.save()
+                    Foo.objects.get(pk=foo.pk)
+                    raise ValueError
+            foo.value = 7
+            foo.save()
+            self.assertEqual(tally.tally, 7)
+
+    def test_savepoint_netted(self):
+        tally = CoalescedSum()
+
+        with tally.on(Foo), patch.object(
+            tally, 'handle_change', wraps=tally.handle_change,
+        ) as handle_change:
+            with transaction.atomic():
+                foo = Foo(value=1)
+                foo.save()
+                for value in range(2, 12):
+                    with transaction.atomic():
+                        foo.value = value
+                        foo.save()
+                # Change after the released savepoints
+                foo.value = 12
+                foo.save()
+            self.assertEqual(tally.tally, 12)
+            # Changes of all savepoints are netted into a single change
+            self.assertEqual(handle_change.call_count, 1)
+
+    def test_savepoint_per_item(self):
+        tally = CoalescedSum()
+
+        with tally.on(Foo):
+            foos = [Foo(value=1) for _ in range(50)]
+            for foo in foos:
+                foo.save()
+            with transaction.atomic():
+                for n, foo in enumerate(foos):
+                    try:
+                        with transaction.atomic():
+                            foo.value = 2
+                            foo.save()
+                            if n % 10 == 0:
+                                raise ValueError
+                    except ValueError:
+                        foo.value = 1
+                # Only the snapshots of committed savepoints are used
+                for foo in foos:
+                    foo.value = 3
+                    foo.save()
+                self.assertEqual(tally.tally, 50)
+            self.assertEqual(tally.tally, 150)
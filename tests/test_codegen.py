@@ -0,0 +1,109 @@
+import warnings
+from unittest import mock
+
+from django.test import TestCase
+
+from django_tally.user_def.lang import generate, run, KW, Env, LangException
+from django_tally.user_def.lang.codegen import MAX_DEPTH, Generator
+
+from . import test_lang
+
+
+class TestGeneratedLang(test_lang.TestLang):
+    """
+    Runs the tests of the interpreter on generated programs.
+    """
+
+    def runExpr(self, expr, *result):
+        res = generate(expr, self.env)(self.env)
+        if result:
+            self.assertEqual(res, result[0])
+
+    def runExprFail(self, expr, exc, msg=None, trace=None):
+        with self.assertRaises(LangException) as cm:
+            generate(expr, self.env)(self.env)
+        self.assertEqual(type(cm.exception.exc), exc)
+        if msg is not None:
+            self.assertEqual(str(cm.exception.exc), msg)
+        if trace is not None:
+            self.assertEqual(cm.exception.trace, trace)
+
+
+def nested(depth):
+    body = 1
+    for _ in range(depth):
+        body = [KW('+'), body, 1]
+    return body
+
+
+class TestCodegen(TestCase):
+
+    bodies = [
+        test_lang.sample,
+        [KW('-'), [KW('set'), 1, 2], [KW('set'), 2]],
+        [KW('<'), 1, 2, 1, [KW('/'), 1, 0]],
+        [KW('and'), 1, [KW('or'), None, 0, 'foo'], [KW('not'), None, 0]],
+        [KW('if'), [KW('list')], 1],
+        [KW('get'), [KW('dict'), 'foo', 1], 'bar', [KW('+'), 1, 1]],
+        [KW('get'), [KW('list'), 1, 2], -1, 3],
+        [
+            KW('do'),
+            [KW('def'), KW('col'), [KW('quote'), [[1], [2]]]],
+            [KW('for'), KW('x'), KW('col'), [KW('put'), KW('x'), 0, 3]],
+            [KW('for'), KW('x'), [KW('dict'), 1, 2], KW('x')],
+            [KW('list'), KW('col'), KW('x')],
+        ],
+        [KW('for'), KW('x'), [KW('list'), 1, 'foo'], [KW('+'), KW('x'), 1]],
+        [KW('put'), [KW('list')], 0, 1],
+        [KW('str'), [KW('get'), [KW('quote'), ['foo']], 0]],
+        [KW('+'), 1, KW('foo')],
+        nested(MAX_DEPTH * 2),
+    ]
+
+    def run_body(self, func, body):
+        env = Env()
+        try:
+            return func(body, env), None
+        except LangException as exc:
+            return None, (type(exc.exc), str(exc.exc), exc.trace)
+
+    def test_differential(self):
+        for body in self.bodies:
+            with self.subTest(body=body):
+                self.assertEqual(
+                    self.run_body(
+                        lambda body, env: generate(body, env)(env), body,
+                    ),
+                    self.run_body(run, body),
+                )
+
+    def test_deeply_nested(self):
+        self.assertEqual(generate(nested(100))(), 101)
+
+    def test_evaluation_order(self):
+        bodies = [
+            [KW('dict'), [KW('list')], 1, 'foo', [KW('def'), KW('x'), 1]],
+            [KW('set'), [KW('list')], [KW('def'), KW('x'), 1]],
+        ]
+        for body in bodies:
+            for func in (lambda body, env: generate(body, env)(env), run):
+                with self.subTest(body=body, func=func):
+                    env = Env()
+                    with self.assertRaises(LangException):
+                        func(body, env)
+                    # Evaluation stopped at the unhashable item
+                    self.assertNotIn('x', env)
+
+    def test_constant_subscript(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            program = generate([KW('get'), 1, 0])
+        self.assertEqual(caught, [])
+        with self.assertRaises(LangException):
+            program()
+
+    def test_unsupported_fallback(self):
+        with mock.patch.object(
+            Generator, 'generate_function', side_effect=TypeError,
+        ):
+            self.assertEqual(generate([KW('+'), 1, 2])(), 3)
@@ -0,0 +1,164 @@
+from django.test import TestCase
+
+from django_tally.user_def.lang import compile, run, KW, Env, LangException
+from django_tally.user_def.lang.compiler import CompiledFunc, Frame
+
+from . import test_lang
+
+
+class TestCompiledLang(test_lang.TestLang):
+    """
+    Runs the tests of the interpreter on compiled programs.
+    """
+
+    def runExpr(self, expr, *result):
+        res = compile(expr, self.env)(self.env)
+        if result:
+            self.assertEqual(res, result[0])
+
+    def runExprFail(self, expr, exc, msg=None, trace=None):
+        with self.assertRaises(LangException) as cm:
+            compile(expr, self.env)(self.env)
+        self.assertEqual(type(cm.exception.exc), exc)
+        if msg is not None:
+            self.assertEqual(str(cm.exception.exc), msg)
+        if trace is not None:
+            self.assertEqual(cm.exception.trace, trace)
+
+
+class TestCompiler(TestCase):
+
+    def test_defn_compiles_body(self):
+        env = Env()
+        compile(test_lang.sample, env)(env)
+        self.assertIsInstance(env['fib'], CompiledFunc)
+        self.assertEqual(run([KW('fib'), 10], env), 89)
+
+    def test_shadowed_builtin(self):
+        body = [
+            KW('do'),
+            [
+                KW('def'), KW('+'),
+                [KW('fn'), [KW('list'), KW('a'), KW('b')], 'plus'],
+            ],
+            [KW('+'), 1, 2],
+        ]
+        self.assertEqual(compile(body)(), 'plus')
+
+    def test_builtin_shadowed_by_env(self):
+        env = Env()
+        run([KW('defn'), KW('+'), [KW('list'), KW('x')], 'plus'], env)
+        self.assertEqual(compile([KW('+'), 1], env)(env), 'plus')
+
+    def test_builtin_shadowed_by_eval(self):
+        body = [
+            KW('do'),
+            [KW('eval'), [KW('quote'), [KW('def'), KW('-'), KW('+')]]],
+            [KW('-'), 1, 2],
+        ]
+        self.assertEqual(compile(body)(), 3)
+
+    def test_builtin_shadowed_by_alias(self):
+        body = [
+            KW('do'),
+            [KW('def'), KW('bind'), KW('def')],
+            [KW('bind'), KW('-'), KW('+')],
+            [KW('-'), 1, 2],
+        ]
+        self.assertEqual(compile(body)(), 3)
+
+    def test_for_copies_lists(self):
+        body = [
+            KW('do'),
+            [KW('def'), KW('col'), [KW('quote'), [[1], [2]]]],
+            [KW('for'), KW('x'), KW('col'), [KW('put'), KW('x'), 0, 3]],
+            KW('col'),
+        ]
+        self.assertEqual(compile(body)(), [[1], [2]])
+
+    def test_log(self):
+        with self.assertLogs('django_tally.user_def.lang.lang', 'ERROR'):
+            self.assertIsNone(compile([KW('/'), 1, 0])(log=True))
+
+    def test_frame_slots(self):
+        env = Env()
+        compile([
+            KW('defn'), KW('f'), [KW('list'), KW('x'), KW('_')],
+            [KW('def'), KW('y'), KW('x')],
+            [KW('for'), KW('z'), KW('x'), KW('z')],
+        ], env)(env)
+        self.assertEqual(env['f'].slots, {'x': 0, 'y': 1, 'z': 2})
+
+    def test_frame_unbound_slot(self):
+        body = [
+            KW('do'),
+            [KW('def'), KW('y'), 1],
+            [
+                KW('defn'), KW('f'), [KW('list')],
+                [KW('def'), KW('y'), [KW('+'), KW('y'), 1]],
+                KW('y'),
+            ],
+            [KW('list'), [KW('f')], KW('y')],
+        ]
+        self.assertEqual(compile(body)(), [2, 1])
+
+    def test_frame_closure(self):
+        body = [
+            KW('do'),
+            [
+                KW('defn'), KW('adder'), [KW('list'), KW('n')],
+                [KW('def'), KW('n'), [KW('*'), KW('n'), 2]],
+                [
+                    KW('fn'), [KW('list'), KW('m')],
+                    # Binds n in the frame of the inner function only
+                    [KW('def'), KW('n'), [KW('+'), KW('n'), KW('m')]],
+                ],
+            ],
+            [KW('def'), KW('add'), [KW('adder'), 5]],
+            [KW('list'), [KW('add'), 1], [KW('add'), 2]],
+        ]
+        self.assertEqual(compile(body)(), [11, 12])
+        self.assertEqual(compile(body)(), run(body))
+
+    def test_frame_undef(self):
+        body = [
+            KW('do'),
+            [KW('def'), KW('x'), 1],
+            [
+                KW('defn'), KW('f'), [KW('list'), KW('x')],
+                [KW('undef'), KW('x')],
+                [KW('def?'), KW('x')],
+            ],
+            [KW('f'), 2],
+        ]
+        self.assertEqual(compile(body)(), run(body))
+
+
+class TestFrame(TestCase):
+
+    def setUp(self):
+        self.frame = Frame({'foo': 0, 'bar': 1}, {'bar': 2, 'baz': 2})
+        self.frame['foo'] = 1
+
+    def test_get(self):
+        self.assertEqual(self.frame['foo'], 1)
+        self.assertEqual(self.frame['bar'], 2)
+        self.assertEqual(self.frame['baz'], 2)
+
+    def test_set(self):
+        self.frame['bar'] = 1
+        self.frame['other'] = 1
+        self.assertEqual(self.frame.values, [1, 1])
+        self.assertEqual(self.frame['other'], 1)
+
+    def test_del(self):
+        del self.frame['foo']
+        del self.frame['baz']
+        self.assertNotIn('foo', self.frame)
+        self.assertNotIn('baz', self.frame)
+
+    def test_iter(self):
+        self.assertEqual(set(self.frame), {'foo', 'bar', 'baz'})
+
+    def test_len(self):
+        self.assertEqual(len(self.frame), 3)
@@ -0,0 +1,111 @@
+import threading
+
+from django.test import TestCase
+
+from django_tally import Tally, Sum, Group, Concurrent
+
+from .testapp.models import Foo
+
+
+THREADS = 8
+CHANGES = 2000
+
+
+class Counter(Concurrent, Sum, Tally):
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class GroupCounter(Concurrent, Group, Sum, Tally):
+
+    def get_group_no_none(self, value):
+        return value % 3
+
+
+def run_threads(target):
+    threads = [
+        threading.Thread(target=target, args=(i,)) for i in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class ConcurrentTest(TestCase):
+
+    def test_aggregate(self):
+        counter = Counter()
+
+        def work(i):
+            for _ in range(CHANGES):
+                counter._handle(None, 2)
+                counter._handle(2, 1)
+
+        run_threads(work)
+        self.assertEqual(counter.tally, THREADS * CHANGES)
+
+    def test_aggregate_replace(self):
+        counter = Counter()
+        run_threads(lambda i: counter._handle(None, 1))
+        self.assertEqual(counter.tally, THREADS)
+        counter.reset()
+        self.assertEqual(counter.tally, 0)
+        counter._handle(None, 5)
+        self.assertEqual(counter.tally, 5)
+
+    def test_aggregate_stopped_threads(self):
+        counter = Counter()
+        for _ in range(3):
+            run_threads(lambda i: counter._handle(None, 1))
+        self.assertEqual(counter.tally, 3 * THREADS)
+        # Partials of stopped threads are folded into the base value
+        self.assertEqual(counter._Concurrent__partials, [])
+
+    def test_group(self):
+        counter = GroupCounter()
+
+        def work(i):
+            for j in range(CHANGES):
+                counter._handle(None, j)
+                counter._handle(j, j + 1)
+
+        run_threads(work)
+        expected = {0: 0, 1: 0, 2: 0}
+        for j in range(CHANGES):
+            expected[(j + 1) % 3] += (j + 1) * THREADS
+        self.assertEqual(counter.tally, expected)
+
+    def test_group_read(self):
+        counter = GroupCounter()
+        errors = []
+
+        def work(i):
+            if i == 0:
+                for _ in range(CHANGES):
+                    try:
+                        sum(counter.tally.values())
+                    except RuntimeError as e:
+                        errors.append(e)
+            else:
+                for j in range(CHANGES):
+                    counter._handle(None, i * CHANGES + j)
+
+        run_threads(work)
+        self.assertEqual(errors, [])
+        # Reading returns a copy
+        counter.tally[0] = None
+        self.assertNotEqual(counter.tally[0], None)
+
+    def test_models(self):
+        counter = Counter()
+        with counter.on(Foo):
+            foo = Foo(value=3)
+            foo.save()
+            self.assertEqual(counter.tally, 3)
+            foo.value = 5
+            foo.save()
+            self.assertEqual(counter.tally, 5)
+            foo.delete()
+            self.assertEqual(counter.tally, 0)
@@ -1,8 +1,14 @@
-from django.test import TestCase
+import time
+from unittest import mock
 
-from django_tally import Tally, Sum
-from django_tally.data import DBStored
-from django_tally.data.models import Data
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from django_tally import Tally, Aggregate, Sum, Product, Group
+from django_tally.data import DBStored, ensure_data_many
+from django_tally.data.db_stored import diff_json, _deleted
+from django_tally.data.models import Data, GroupData
 
 from .testapp.models import Foo
 
@@ -15,6 +21,123 @@ class StoredCounter(DBStored, Sum, Tally):
         return 0 if value is None else 1
 
 
+class StoredValueSum(DBStored, Sum, Tally):
+
+    db_name = 'value_sum'
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class StoredValueProduct(DBStored, Product, Tally):
+
+    db_name = 'value_product'
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class StoredGroupCounter(DBStored, Group, Sum, Tally):
+
+    db_name = 'group_counter'
+
+    def get_value(self, instance):
+        return instance.value
+
+    def get_group_no_none(self, value):
+        return 'even' if value % 2 == 0 else 'odd'
+
+    def aggregate_transform(self, value):
+        return 1
+
+
+class ShardedValueSum(StoredValueSum):
+
+    db_name = 'sharded_value_sum'
+    shards = 4
+
+
+class ShardedGroupCounter(StoredGroupCounter):
+
+    db_name = 'sharded_group_counter'
+    shards = 4
+
+
+class RowGroupCounter(StoredGroupCounter):
+
+    db_name = 'row_group_counter'
+    group_rows = True
+
+
+class RowGroupValueSum(DBStored, Group, Aggregate, Tally):
+
+    db_name = 'row_group_value_sum'
+    group_rows = True
+    aggregate_id = 0
+
+    def aggregate_add(self, aggregate, value):
+        return aggregate + value
+
+    def aggregate_sub(self, aggregate, value):
+        return aggregate - value
+
+    def get_value(self, instance):
+        return instance.value
+
+    def get_group_no_none(self, value):
+        return value % 3
+
+
+class PatchedValueCounter(DBStored, Tally):
+
+    db_name = 'patched_value_counter'
+    db_patch = True
+
+    def get_tally(self):
+        return {'total': 0, 'values': {}, 'padding': 'x' * 100}
+
+    def get_value(self, instance):
+        return instance.value
+
+    def handle_change(self, tally, old_value, new_value):
+        if old_value is not None:
+            key = str(old_value)
+            tally['values'][key] -= 1
+            if not tally['values'][key]:
+                del tally['values'][key]
+            tally['total'] -= 1
+        if new_value is not None:
+            key = str(new_value)
+            tally['values'][key] = tally['values'].get(key, 0) + 1
+            tally['total'] += 1
+        return tally
+
+
+class IntValueSum(StoredValueSum):
+
+    db_name = 'int_value_sum'
+    db_column = 'int_value'
+
+
+class FloatValueProduct(StoredValueProduct):
+
+    db_name = 'float_value_product'
+    db_column = 'float_value'
+
+
+class BufferedValueSum(StoredValueSum):
+
+    db_name = 'buffered_value_sum'
+    flush_events = 3
+
+
+class BackgroundValueSum(StoredValueSum):
+
+    db_name = 'background_value_sum'
+    flush_interval = 10
+    max_pending = 3
+
+
 class StoreTest(TestCase):
 
     def test_simple_store(self):
@@ -38,6 +161,357 @@ class StoreTest(TestCase):
             self.assertStored('counter', 0)
             self.assertEqual(counter.tally, None)
 
+    def test_delta(self):
+        tally = StoredValueSum()
+        self.assertEqual(tally.get_delta_operator(), '+')
+
+        with tally.on(Foo):
+            foo = Foo(value=3)
+            # A single update without reading the value first
+            with self.assertNumQueries(2):
+                foo.save()
+            self.assertStored('value_sum', 3)
+            foo.value = 5
+            foo.save()
+            self.assertStored('value_sum', 5)
+            # No change, no update
+            with self.assertNumQueries(1):
+                foo.save()
+            foo.delete()
+            self.assertStored('value_sum', 0)
+
+    def test_delta_product(self):
+        tally = StoredValueProduct()
+        self.assertEqual(tally.get_delta_operator(), '*')
+
+        with tally.on(Foo):
+            foo = Foo(value=4)
+            foo.save()
+            self.assertStored('value_product', 4)
+            foo.value = 2
+            foo.save()
+            self.assertStored('value_product', 2)
+
+    def test_delta_missing(self):
+        tally = StoredValueSum()
+        Data.objects.filter(name='value_sum').delete()
+
+        with tally.on(Foo):
+            with self.assertRaises(Data.DoesNotExist):
+                Foo(value=1).save()
+
+    def test_no_delta(self):
+        tally = StoredGroupCounter()
+        self.assertIsNone(tally.get_delta_operator())
+
+        with tally.on(Foo):
+            Foo(value=1).save()
+            self.assertStored('group_counter', {'odd': 1})
+
+    def test_shards(self):
+        tally = ShardedValueSum()
+        self.assertEqual(tally.get_shard_names(), [
+            'sharded_value_sum',
+            'sharded_value_sum#1',
+            'sharded_value_sum#2',
+            'sharded_value_sum#3',
+        ])
+        self.assertEqual(tally.get_stored(), 0)
+
+        with tally.on(Foo):
+            foos = [Foo(value=n) for n in range(20)]
+            for foo in foos:
+                foo.save()
+            self.assertEqual(tally.get_stored(), 190)
+            self.assertGreater(
+                Data.objects
+                .filter(name__startswith='sharded_value_sum')
+                .exclude(value=0)
+                .count(),
+                1,
+            )
+            for foo in foos[:10]:
+                foo.delete()
+            self.assertEqual(tally.get_stored(), 145)
+
+        tally.rebuild(Foo.objects.all())
+        self.assertStored('sharded_value_sum', 145)
+        self.assertStored('sharded_value_sum#1', 0)
+        self.assertEqual(tally.get_stored(), 145)
+
+    def test_shards_group(self):
+        tally = ShardedGroupCounter()
+        self.assertEqual(tally.get_stored(), {})
+
+        with tally.on(Foo):
+            foos = [Foo(value=n) for n in range(10)]
+            for foo in foos:
+                foo.save()
+            self.assertEqual(tally.get_stored(), {'even': 5, 'odd': 5})
+            foos[0].value = 1
+            foos[0].save()
+            self.assertEqual(tally.get_stored(), {'even': 4, 'odd': 6})
+
+    def test_shards_group_locked(self):
+        for tally in [ShardedGroupCounter(), StoredGroupCounter()]:
+            with self.subTest(tally=tally), tally.on(Foo):
+                with CaptureQueriesContext(connection) as queries:
+                    Foo(value=1).save()
+                selects = [
+                    query['sql'] for query in queries
+                    if query['sql'].startswith('SELECT') and
+                    '"data_data"' in query['sql']
+                ]
+                self.assertEqual(len(selects), 1)
+                self.assertTrue(selects[0].endswith('FOR UPDATE'))
+
+    def test_shards_no_aggregate(self):
+        class ShardedTally(DBStored, Tally):
+            db_name = 'sharded_tally'
+            shards = 2
+
+        with self.assertRaises(TypeError):
+            ShardedTally()
+
+    def test_group_rows(self):
+        tally = RowGroupCounter()
+        self.assertEqual(tally.get_delta_operator(), '+')
+        self.assertStored('row_group_counter', None)
+        self.assertEqual(tally.get_stored(), {})
+
+        with tally.on(Foo):
+            foo1 = Foo(value=1)
+            # A single upsert of the affected group
+            with self.assertNumQueries(2):
+                foo1.save()
+            foo2 = Foo(value=3)
+            foo2.save()
+            self.assertEqual(tally.get_stored(), {'odd': 2})
+            foo2.value = 4
+            foo2.save()
+            self.assertEqual(tally.get_stored(), {'odd': 1, 'even': 1})
+            self.assertEqual(tally.get_stored_group('even'), 1)
+            self.assertEqual(
+                set(
+                    GroupData.objects
+                    .filter(name='row_group_counter')
+                    .values_list('group_key', flat=True)
+                ),
+                {'"odd"', '"even"'},
+            )
+            foo1.delete()
+            self.assertEqual(tally.get_stored(), {'odd': 0, 'even': 1})
+
+        tally.rebuild(Foo.objects.all())
+        self.assertEqual(tally.get_stored(), {'even': 1})
+        self.assertEqual(tally.get_stored_group('odd'), 0)
+
+    def test_group_rows_generic(self):
+        tally = RowGroupValueSum()
+        self.assertIsNone(tally.get_delta_operator())
+
+        with tally.on(Foo):
+            foo1 = Foo(value=4)
+            foo1.save()
+            Foo(value=7).save()
+            Foo(value=2).save()
+            self.assertEqual(tally.get_stored(), {1: 11, 2: 2})
+            foo1.value = 5
+            foo1.save()
+            self.assertEqual(tally.get_stored(), {1: 7, 2: 7})
+
+    def test_group_rows_tuples(self):
+        class RowTupleCounter(RowGroupCounter):
+            db_name = 'row_tuple_counter'
+
+            def get_group_no_none(self, value):
+                return ('even' if value % 2 == 0 else 'odd', value > 2)
+
+        tally = RowTupleCounter()
+        with tally.on(Foo):
+            Foo(value=1).save()
+            Foo(value=4).save()
+            self.assertEqual(
+                tally.get_stored(), {('odd', False): 1, ('even', True): 1},
+            )
+            self.assertEqual(tally.get_stored_group(('even', True)), 1)
+
+    def test_group_rows_no_group(self):
+        class RowSum(StoredValueSum):
+            db_name = 'row_sum'
+            group_rows = True
+
+        with self.assertRaises(TypeError):
+            RowSum()
+
+    def test_ensure_data_many(self):
+        tallies = [StoredValueSum(), ShardedValueSum(), RowGroupCounter()]
+        Data.objects.filter(name='value_sum').update(value=5)
+        Data.objects.filter(name__startswith='sharded_value_sum').delete()
+
+        with self.assertNumQueries(2):
+            ensure_data_many(tallies)
+        self.assertStored('value_sum', 5)
+        self.assertStored('sharded_value_sum', 0)
+        self.assertStored('sharded_value_sum#3', 0)
+        self.assertStored('row_group_counter', None)
+
+    def test_db_column(self):
+        tally = IntValueSum()
+        product = FloatValueProduct()
+        data = Data.objects.get(name='int_value_sum')
+        self.assertEqual((data.value, data.int_value), (None, 0))
+        self.assertEqual(
+            Data.objects.get(name='float_value_product').float_value, 1.0,
+        )
+
+        with tally.on(Foo), product.on(Foo):
+            foo = Foo(value=3)
+            foo.save()
+            self.assertEqual(tally.get_stored(), 3)
+            self.assertEqual(product.get_stored(), 3.0)
+            foo.value = 2
+            foo.save()
+            Foo(value=5).save()
+            self.assertEqual(tally.get_stored(), 7)
+            self.assertEqual(product.get_stored(), 10.0)
+
+        self.assertEqual(
+            list(
+                Data.objects
+                .filter(int_value__isnull=False)
+                .order_by('-int_value')
+                .values_list('name', 'int_value')
+            ),
+            [('int_value_sum', 7)],
+        )
+
+        tally.rebuild(Foo.objects.filter(value=5))
+        self.assertEqual(tally.get_stored(), 5)
+
+    def test_db_column_switched(self):
+        # The row was stored in the value column before
+        with StoredValueSum().on(Foo):
+            Foo(value=3).save()
+
+        class SwitchedValueSum(IntValueSum):
+            db_name = 'value_sum'
+
+        class SwitchedValueProduct(FloatValueProduct):
+            db_name = 'value_sum'
+
+        tally = SwitchedValueSum()
+        with tally.on(Foo):
+            self.assertEqual(tally.get_stored(), 3)
+            Foo(value=2).save()
+            self.assertEqual(tally.get_stored(), 5)
+        data = Data.objects.get(name='value_sum')
+        self.assertEqual((data.value, data.int_value), (None, 5))
+
+        with SwitchedValueProduct().on(Foo):
+            Foo(value=2).save()
+        data = Data.objects.get(name='value_sum')
+        self.assertEqual(
+            (data.int_value, data.float_value), (None, 10.0),
+        )
+
+    def test_db_column_invalid(self):
+        class InvalidColumn(StoredValueSum):
+            db_column = 'foo'
+
+        class GroupColumn(StoredGroupCounter):
+            db_column = 'int_value'
+
+        with self.assertRaises(ValueError):
+            InvalidColumn()
+        with self.assertRaises(TypeError):
+            GroupColumn()
+
+    def test_unit_of_work(self):
+        tallies = [
+            StoredValueSum(), IntValueSum(), StoredValueProduct(),
+            FloatValueProduct(), StoredGroupCounter(), PatchedValueCounter(),
+        ]
+        subs = [tally.on(Foo) for tally in tallies]
+        for sub in subs:
+            sub.__enter__()
+        try:
+            # Insert, savepoint, lock changed rows, write changed rows, patch
+            # rows, write deltas for each of the 4 columns and operators, and
+            # release savepoint
+            with self.assertNumQueries(10):
+                foo = Foo(value=3)
+                foo.save()
+            foo.value = 4
+            foo.save()
+            Foo(value=2).save()
+        finally:
+            for sub in reversed(subs):
+                sub.__exit__(None, None, None)
+
+        self.assertStored('value_sum', 6)
+        self.assertStored('int_value_sum', None)
+        self.assertEqual(tallies[1].get_stored(), 6)
+        self.assertStored('value_product', 8)
+        self.assertEqual(tallies[3].get_stored(), 8.0)
+        self.assertStored('group_counter', {'odd': 0, 'even': 2})
+        self.assertStored('patched_value_counter', {
+            'total': 2, 'values': {'2': 1, '4': 1}, 'padding': 'x' * 100,
+        })
+
+    def test_diff_json(self):
+        self.assertEqual(diff_json({'a': 1}, {'a': 1}), [])
+        self.assertEqual(diff_json(None, {'a': 1}), [((), {'a': 1})])
+        self.assertEqual(
+            diff_json(
+                {'a': {'b': 1, 'c': 2}, 'd': [1, 2], 'e': [1]},
+                {'a': {'b': 1, 'f': 3}, 'd': [1, 3], 'e': [1, 2]},
+            ),
+            [
+                (('a', 'c'), _deleted),
+                (('a', 'f'), 3),
+                (('d', '1'), 3),
+                (('e',), [1, 2]),
+            ],
+        )
+
+    def test_patch(self):
+        tally = PatchedValueCounter()
+
+        with tally.on(Foo):
+            foo1 = Foo(value=1)
+            with CaptureQueriesContext(connection) as queries:
+                foo1.save()
+            update, = [
+                query['sql'] for query in queries
+                if 'UPDATE "data_data"' in query['sql']
+            ]
+            self.assertIn('jsonb_set', update)
+            self.assertNotIn('padding', update)
+            self.assertStored('patched_value_counter', {
+                'total': 1, 'values': {'1': 1}, 'padding': 'x' * 100,
+            })
+            foo2 = Foo(value=2)
+            foo2.save()
+            foo1.value = 2
+            foo1.save()
+            self.assertStored('patched_value_counter', {
+                'total': 2, 'values': {'2': 2}, 'padding': 'x' * 100,
+            })
+            foo1.delete()
+            foo2.delete()
+            self.assertStored('patched_value_counter', {
+                'total': 0, 'values': {}, 'padding': 'x' * 100,
+            })
+
+    def test_buffered_no_aggregate(self):
+        class BufferedTally(DBStored, Tally):
+            db_name = 'buffered_tally'
+            flush_events = 2
+
+        with self.assertRaises(TypeError):
+            BufferedTally()
+
     def assertStored(self, db_name, value):
         try:
             data = Data.objects.get(name=db_name)
@@ -45,3 +519,105 @@ class StoreTest(TestCase):
             self.fail('No data associated with {}'.format(db_name))
         else:
             self.assertEqual(data.value, value)
+
+
+class BackgroundFlushTest(TransactionTestCase):
+
+    def test_buffered(self):
+        tally = BufferedValueSum()
+
+        with tally.on(Foo):
+            foo1 = Foo(value=1)
+            foo1.save()
+            foo2 = Foo(value=2)
+            foo2.save()
+            self.assertEqual(
+                Data.objects.get(name='buffered_value_sum').value, 0,
+            )
+            # Third event flushes in the background
+            Foo(value=3).save()
+            self.assertStored('buffered_value_sum', 6)
+            foo2.delete()
+            tally.flush()
+            self.assertStored('buffered_value_sum', 4)
+            # Nothing to flush
+            with self.assertNumQueries(0):
+                tally.flush()
+        tally.stop()
+
+    def test_buffered_rollback(self):
+        tally = BufferedValueSum()
+
+        with tally.on(Foo):
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Foo(value=1).save()
+                    raise ValueError
+            Foo(value=2).save()
+            tally.flush()
+            self.assertStored('buffered_value_sum', 2)
+
+    def test_buffered_rollback_flush(self):
+        tally = BufferedValueSum()
+
+        with tally.on(Foo):
+            Foo(value=1).save()
+            # Enough events to flush, but they are rolled back
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    for value in range(2, 5):
+                        Foo(value=value).save()
+                    raise ValueError
+            # The committed change is still buffered
+            tally.flush()
+            self.assertStored('buffered_value_sum', 1)
+        tally.stop()
+
+    def test_flush_interval(self):
+        tally = BackgroundValueSum()
+
+        with tally.on(Foo):
+            Foo(value=1).save()
+            Foo(value=2).save()
+            self.assertStored('background_value_sum', 3)
+            # Backpressure wakes up the flusher right away
+            for value in range(3):
+                Foo(value=value).save()
+            self.assertStored('background_value_sum', 6)
+
+        tally.stop()
+        self.assertEqual(
+            Data.objects.get(name='background_value_sum').value, 6,
+        )
+
+    def test_max_pending(self):
+        tally = BackgroundValueSum()
+        # Only flush because the buffer is full
+        tally.flush_interval = 60000
+        tally.max_pending_wait = 200
+
+        with tally.on(Foo):
+            with mock.patch.object(
+                tally, '_store_delta', side_effect=DatabaseError,
+            ):
+                for value in range(3):
+                    Foo(value=value).save()
+                # The buffer is full and does not drain
+                start = time.monotonic()
+                Foo(value=3).save()
+                self.assertGreaterEqual(time.monotonic() - start, 0.2)
+            # The buffer drains once flushing works again
+            start = time.monotonic()
+            Foo(value=4).save()
+            self.assertLess(time.monotonic() - start, 0.2)
+            self.assertStored('background_value_sum', 6)
+
+        tally.stop()
+        self.assertStored('background_value_sum', 10)
+
+    def assertStored(self, db_name, value, timeout=5):
+        deadline = time.monotonic() + timeout
+        while Data.objects.get(name=db_name).value != value:
+            if time.monotonic() > deadline:
+                self.fail('{} was never flushed'.format(db_name))
+            time.sleep(0.01)
@@ -0,0 +1,56 @@
+from unittest.mock import patch
+
+from django.db.models.signals import post_save
+from django.test import TestCase
+
+from django_tally import Tally, Sum
+from django_tally import tally as tally_module
+
+from .testapp.models import Foo
+
+
+class ValueSum(Sum, Tally):
+
+    tracked_fields = ('value',)
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class CustomValueSum(ValueSum):
+
+    def get_value(self, instance):
+        return super().get_value(instance)
+
+
+class DispatcherTest(TestCase):
+
+    def test_single_receiver(self):
+        tallies = [ValueSum() for _ in range(10)]
+        subs = [tally.listen(Foo) for tally in tallies]
+        self.assertEqual(len(post_save._live_receivers(Foo)), 1)
+
+        Foo(value=3).save()
+        for tally in tallies:
+            self.assertEqual(tally.tally, 3)
+
+        for sub in subs:
+            sub.close()
+        self.assertFalse(post_save.has_listeners(Foo))
+
+    def test_shared_values(self):
+        tallies = [ValueSum(), ValueSum(), CustomValueSum()]
+
+        with patch.object(
+            tally_module, 'get_snapshot', wraps=tally_module.get_snapshot,
+        ) as get_snapshot:
+            subs = [tally.listen(Foo) for tally in tallies]
+            foo = Foo(value=3)
+            foo.save()
+            # Shared by the ValueSums, separate for the CustomValueSum
+            self.assertEqual(get_snapshot.call_count, 2)
+            for sub in subs:
+                sub.close()
+
+        for tally in tallies:
+            self.assertEqual(tally.tally, 3)
@@ -1,3 +1,6 @@
+import pickle
+from copy import copy, deepcopy
+
 from django.test import TestCase
 
 from django_tally.data.models import Data
@@ -104,6 +107,13 @@ class TestLang(TestCase):
         self.assertNotEqual(hash(KW('foo')), hash(KW('bar')))
         self.assertNotEqual(hash(KW('foo')), 'foo')
 
+    def test_kw_interned(self):
+        self.assertIs(KW('foo'), KW('foo'))
+        self.assertIs(decode('k:foo'), KW('foo'))
+        self.assertIs(copy(KW('foo')), KW('foo'))
+        self.assertIs(deepcopy([KW('foo')])[0], KW('foo'))
+        self.assertIs(pickle.loads(pickle.dumps(KW('foo'))), KW('foo'))
+
     def test_func_call_wrong_args(self):
         self.runExpr([KW('defn'), KW('id'), [KW('list'), KW('x')], 'x'])
         self.runExprFail([KW('id')], AssertionError)
@@ -583,6 +593,8 @@ class TestLang(TestCase):
     def test_get_tally(self):
         Data(name='foo', value='5').save()
         self.runExpr([KW('get_tally'), KW('foo')], 5)
+        Data(name='bar', int_value=6).save()
+        self.runExpr([KW('get_tally'), KW('bar')], 6)
         self.runExprFail([KW('get_tally')], TypeError)
         self.runExprFail([KW('get_tally'), 'foo'], TypeError)
 
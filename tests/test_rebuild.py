@@ -0,0 +1,131 @@
+from django.db.models import F, Value, IntegerField
+from django.db.models.functions import Mod
+from django.test import TestCase
+
+from django_tally import Tally, Sum, Group
+from django_tally.data import DBStored
+from django_tally.data.models import Data
+from django_tally.tally import get_snapshot
+
+from .testapp.models import Foo
+
+
+class ValueSum(Sum, Tally):
+
+    tracked_fields = ('value',)
+
+    def filter_value(self, value):
+        return value.value > 0
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class StoredParityCounter(DBStored, Group, Sum, Tally):
+
+    db_name = 'parity'
+    tracked_fields = ('value',)
+
+    def get_group_no_none(self, value):
+        return 'even' if value.value % 2 == 0 else 'odd'
+
+    def aggregate_transform(self, value):
+        return 1
+
+
+class RebuildTest(TestCase):
+
+    def setUp(self):
+        for value in range(-2, 10):
+            Foo(value=value).save()
+
+    def test_rebuild(self):
+        tally = ValueSum()
+        progress = []
+        tally.rebuild(Foo, chunk_size=5, progress=progress.append)
+        self.assertEqual(tally.tally, 45)
+        self.assertEqual(progress, [5, 10, 12])
+
+        # Snapshots are populated
+        foo = Foo.objects.get(value=9)
+        with tally.on(Foo):
+            store = tally._Tally__model_data
+            self.assertEqual(
+                store[Foo, foo.pk], get_snapshot(foo, ('value',)),
+            )
+            foo.value = 10
+            foo.save()
+        self.assertEqual(tally.tally, 46)
+
+    def test_rebuild_shared(self):
+        other = ValueSum()
+        tally = ValueSum()
+        tally.rebuild(Foo)
+        foo = Foo.objects.get(value=9)
+        with other.on(Foo), tally.on(Foo):
+            # The snapshots of the rebuild are added to the shared store
+            self.assertIs(tally._Tally__model_data, other._Tally__model_data)
+            self.assertIn((Foo, foo.pk), tally._Tally__model_data)
+
+    def test_rebuild_queryset(self):
+        tally = ValueSum(100)
+        tally.rebuild(
+            Foo.objects.filter(value__lt=3),
+            Foo.objects.filter(value__gte=8),
+        )
+        self.assertEqual(tally.tally, 20)
+
+    def test_rebuild_stored(self):
+        tally = StoredParityCounter()
+        tally.rebuild(Foo, chunk_size=5)
+        self.assertEqual(
+            Data.objects.get(name='parity').value,
+            {'even': 6, 'odd': 6},
+        )
+        self.assertEqual(tally.tally, None)
+
+
+class PushdownSum(ValueSum):
+
+    aggregate_expression = F('value')
+
+
+class PushdownParityCounter(Group, Sum, Tally):
+
+    tracked_fields = ('value',)
+    group_expression = Mod('value', Value(2, output_field=IntegerField()))
+    aggregate_expression = Value(1, output_field=IntegerField())
+
+    def get_group_no_none(self, value):
+        return value.value % 2
+
+    def aggregate_transform(self, value):
+        return 1
+
+
+class PushdownTest(TestCase):
+
+    def setUp(self):
+        for value in range(10):
+            Foo(value=value).save()
+
+    def test_sum(self):
+        tally = PushdownSum(100)
+        with self.assertNumQueries(1):
+            tally.rebuild(Foo.objects.filter(value__gt=0))
+        self.assertEqual(tally.tally, 45)
+
+        with self.assertNumQueries(1):
+            tally.rebuild(Foo.objects.filter(value__gt=10))
+        self.assertEqual(tally.tally, 0)
+
+    def test_group(self):
+        tally = PushdownParityCounter()
+        with self.assertNumQueries(1):
+            tally.rebuild(Foo)
+        self.assertEqual(tally.tally, {0: 5, 1: 5})
+
+        # Agrees with the tally computed in Python
+        tally.group_expression = None
+        tally.rebuild(Foo)
+        self.assertEqual(tally.tally, {0: 5, 1: 5})
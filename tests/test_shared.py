@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+import tempfile
+
+from django.test import TestCase
+
+from django_tally import Tally, Sum, Product, Group
+from django_tally.shared import MMapStored, get_map
+
+from .testapp.models import Foo
+
+
+class SharedCounter(MMapStored, Sum, Tally):
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class SharedProduct(MMapStored, Product, Tally):
+
+    def get_value(self, instance):
+        return instance.value
+
+
+class SharedGroupCounter(MMapStored, Group, Sum, Tally):
+
+    def get_value(self, instance):
+        return instance.value
+
+    def aggregate_transform(self, value):
+        return 1
+
+    def get_group_no_none(self, value):
+        return 'even' if value % 2 == 0 else 'odd'
+
+
+def count(tally, n):
+    for i in range(n):
+        tally._handle(None, 1)
+    os._exit(0)
+
+
+class MMapStoredTest(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def make(self, cls):
+        return type(cls.__name__, (cls,), {'mmap_path': self.path})()
+
+    def test_sum(self):
+        counter = self.make(SharedCounter)
+        other = self.make(SharedCounter)
+        self.assertEqual(counter.tally, 0)
+
+        with counter.on(Foo):
+            foo = Foo(value=3)
+            foo.save()
+            self.assertEqual(counter.tally, 3)
+            self.assertEqual(other.tally, 3)
+            foo.value = 5
+            foo.save()
+            self.assertEqual(other.tally, 5)
+            foo.delete()
+            self.assertEqual(other.tally, 0)
+
+        other.tally = 7
+        self.assertEqual(counter.tally, 7)
+        counter.reset()
+        self.assertEqual(other.tally, 0)
+
+    def test_product(self):
+        counter = self.make(SharedProduct)
+        self.assertEqual(counter.tally, 1)
+        counter._handle(None, 0.5)
+        self.assertEqual(counter.tally, 0.5)
+        counter._handle(None, 4)
+        self.assertEqual(counter.tally, 2)
+
+    def test_group(self):
+        counter = self.make(SharedGroupCounter)
+        other = self.make(SharedGroupCounter)
+        self.assertEqual(counter.tally, {})
+
+        with counter.on(Foo):
+            foo1 = Foo(value=1)
+            foo1.save()
+            foo2 = Foo(value=2)
+            foo2.save()
+            self.assertEqual(other.tally, {'odd': 1, 'even': 1})
+            foo2.value = 3
+            foo2.save()
+            self.assertEqual(other.tally, {'odd': 2, 'even': 0})
+
+    def test_processes(self):
+        counter = self.make(SharedCounter)
+        context = multiprocessing.get_context('fork')
+        processes = [
+            context.Process(target=count, args=(counter, 500))
+            for _ in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            self.assertEqual(process.exitcode, 0)
+        self.assertEqual(counter.tally, 2000)
+
+    def test_tuple_groups(self):
+        counter = self.make(SharedGroupCounter)
+        counter.get_group_no_none = lambda value: ('parity', value % 2)
+        counter._handle(None, 1)
+        counter._handle(None, 3)
+        self.assertEqual(counter.tally, {('parity', 1): 2})
+
+    def test_replaced_while_updating(self):
+        shared_map = get_map(self.path, 8)
+        shared_map.update(b'"foo"', lambda value: value + 1, 0)
+        find = shared_map._find
+
+        def find_replaced(key, *args, **kwargs):
+            index = find(key, *args, **kwargs)
+            # Another process replaces the map before the slot is locked
+            shared_map._find = find
+            shared_map.replace([(b'"bar"', 3)])
+            return index
+
+        shared_map._find = find_replaced
+        shared_map.update(b'"foo"', lambda value: value + 1, 0)
+        self.assertEqual(
+            sorted(shared_map.items()), [(b'"bar"', 3), (b'"foo"', 1)],
+        )
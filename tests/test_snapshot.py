@@ -0,0 +1,179 @@
+from django.test import TestCase
+
+from django_tally import Tally, Sum
+from django_tally.subscription import Subscription
+from django_tally.snapshot import (
+    SnapshotStore, LRUSnapshotStore, registry,
+)
+
+from .testapp.models import Foo
+
+
+class SnapshotStoreTest(TestCase):
+
+    def test_metrics(self):
+        store = SnapshotStore()
+        self.assertEqual(store.hit_rate, None)
+        store['foo'] = 1
+        self.assertEqual(store['foo'], 1)
+        self.assertEqual(store.get('bar'), None)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+        self.assertEqual(store.hit_rate, 0.5)
+        # Membership checks are not lookups
+        self.assertIn('foo', store)
+        self.assertEqual((store.hits, store.misses), (1, 1))
+
+    def test_max_entries(self):
+        store = LRUSnapshotStore(max_entries=2)
+        store['foo'] = 1
+        store['bar'] = 2
+        # Use foo so bar becomes least recently used
+        store['foo']
+        store['baz'] = 3
+        self.assertEqual(set(store), {'foo', 'baz'})
+        self.assertEqual(store.evictions, 1)
+
+    def test_max_bytes(self):
+        store = LRUSnapshotStore(max_bytes=2 * store_size((1, 2)))
+        store['foo'] = (1, 2)
+        store['bar'] = (1, 2)
+        self.assertEqual(set(store), {'foo', 'bar'})
+        store['baz'] = (1, 2)
+        self.assertEqual(set(store), {'bar', 'baz'})
+        self.assertEqual(store.evictions, 1)
+        # Overwriting does not count twice
+        store['baz'] = (1, 2)
+        self.assertEqual(set(store), {'bar', 'baz'})
+        del store['bar']
+        self.assertEqual(store.size, store_size((1, 2)))
+
+
+def store_size(snapshot):
+    return LRUSnapshotStore().get_size(snapshot)
+
+
+class FetchingCounter(Sum, Tally):
+
+    tracked_fields = ('value',)
+    fetch_missing = True
+
+    def get_snapshot_store(self):
+        return LRUSnapshotStore(max_entries=1)
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class BoundedCounter(FetchingCounter):
+
+    fetch_missing = None
+
+
+class FetchMissingTest(TestCase):
+
+    def test_fetch_missing(self, counter=None):
+        if counter is None:
+            counter = FetchingCounter()
+        foo1 = Foo(value=1)
+        foo1.save()
+
+        with counter.on(Foo):
+            # Instance loaded before listening
+            foo1.value = 2
+            foo1.save()
+            self.assertEqual(counter.tally, 1)
+            # Evict foo1 by creating another instance
+            foo2 = Foo(value=3)
+            foo2.save()
+            self.assertEqual(counter.tally, 4)
+            foo1.value = 4
+            foo1.save()
+            self.assertEqual(counter.tally, 6)
+            # Evict foo2 and delete it
+            foo2.delete()
+            self.assertEqual(counter.tally, 3)
+
+    def test_fetch_missing_bounded(self):
+        # Fetches by default since the store can evict snapshots
+        self.test_fetch_missing(BoundedCounter())
+
+    def test_fetch_missing_unbounded(self):
+        counter = ValueSum()
+        self.assertFalse(counter._fetches_missing())
+        counter.get_snapshot_store = lambda: LRUSnapshotStore()
+        counter.reset()
+        self.assertFalse(counter._fetches_missing())
+
+
+class ValueSum(Sum, Tally):
+
+    tracked_fields = ('value',)
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class SharedSnapshotTest(TestCase):
+
+    def test_shared(self):
+        spec = (ValueSum().get_value_spec(), False, (SnapshotStore,))
+        tally1 = ValueSum()
+        tally2 = ValueSum()
+
+        sub1 = tally1.listen(Foo)
+        self.assertIn(spec, registry)
+        foo = Foo(value=1)
+        foo.save()
+        # Loaded before tally2 started listening
+        foo = Foo.objects.get(pk=foo.pk)
+
+        sub2 = tally2.listen(Foo)
+        self.assertIs(
+            tally1._Tally__model_data,
+            tally2._Tally__model_data,
+        )
+        foo.value = 3
+        foo.save()
+        self.assertEqual(tally1.tally, 3)
+        self.assertEqual(tally2.tally, 2)
+
+        sub1.close()
+        self.assertIn(spec, registry)
+        sub2.close()
+        self.assertNotIn(spec, registry)
+        self.assertIsNot(
+            tally1._Tally__model_data,
+            tally2._Tally__model_data,
+        )
+
+    def test_not_shared(self):
+        tally1 = ValueSum()
+        tally2 = ValueSum()
+        tally2.share_snapshots = False
+
+        with tally1.on(Foo), tally2.on(Foo):
+            self.assertIsNot(
+                tally1._Tally__model_data,
+                tally2._Tally__model_data,
+            )
+
+    def test_not_shared_config(self):
+        tally = ValueSum()
+        coalescing = ValueSum()
+        coalescing.coalesce = True
+        bounded = ValueSum()
+        bounded.get_snapshot_store = lambda: LRUSnapshotStore(max_entries=1)
+        other_bounded = ValueSum()
+        other_bounded.get_snapshot_store = (
+            lambda: LRUSnapshotStore(max_entries=2)
+        )
+
+        tallies = [tally, coalescing, bounded, other_bounded]
+        sub = Subscription()
+        for t in tallies:
+            t.on(Foo, sub=sub)
+
+        with sub:
+            stores = {id(t._Tally__model_data) for t in tallies}
+            self.assertEqual(len(stores), 4)
+            self.assertEqual(bounded._Tally__model_data.max_entries, 1)
@@ -3,9 +3,11 @@ from unittest.mock import patch, Mock
 from django.db.models import Model
 from django.test import TestCase
 
-from django_tally import Tally
+from django_tally import Tally, Sum
+from django_tally.data.models import Data
+from django_tally.tally import get_snapshot
 
-from .testapp.models import Foo, Bar
+from .testapp.models import Foo, Bar, Baz
 
 
 class MyTally(Tally):
@@ -162,3 +164,63 @@ class TallyBasicsTest(TestCase):
         # Only old value
         tally._handle(None, None)
         self.assertEqual(tally.handle_change.call_count, 3)
+
+
+class ValueCounter(Sum, Tally):
+
+    tracked_fields = ('value',)
+
+    def aggregate_transform(self, value):
+        return value.value
+
+
+class TrackedFieldsTest(TestCase):
+
+    def test_snapshot(self):
+        foo = Foo(value=3)
+        snapshot = ValueCounter().get_value(foo)
+        self.assertEqual(type(snapshot).__name__, 'FooSnapshot')
+        self.assertEqual(snapshot, (3,))
+        self.assertEqual(snapshot.value, 3)
+
+    def test_snapshot_foreign_key(self):
+        foo = Foo(value=3)
+        foo.save()
+        baz = Baz(foo=foo)
+        snapshot = get_snapshot(baz, ('foo', 'file'))
+        self.assertEqual(snapshot.foo, foo.pk)
+        self.assertEqual(snapshot.file, None)
+
+    def test_tally(self):
+        counter = ValueCounter()
+
+        with counter.on(Foo):
+            # Create model
+            foo = Foo(value=3)
+            foo.save()
+            self.assertEqual(counter.tally, 3)
+            # Change loaded model
+            foo_ref = Foo.objects.get(pk=foo.pk)
+            foo_ref.value = 5
+            foo_ref.save()
+            self.assertEqual(counter.tally, 5)
+            # Delete model
+            foo_ref.delete()
+            self.assertEqual(counter.tally, 0)
+
+    def test_tally_mutated_in_place(self):
+        class ItemCounter(Sum, Tally):
+            tracked_fields = ('value',)
+
+            def aggregate_transform(self, value):
+                return len(value.value['items'])
+
+        counter = ItemCounter()
+        with counter.on(Data):
+            data = Data(name='items', value={'items': [1]})
+            data.save()
+            self.assertEqual(counter.tally, 1)
+            # The snapshot does not change with the instance
+            data.value['items'].append(2)
+            data.save()
+            self.assertEqual(counter.tally, 2)
@@ -1,11 +1,16 @@
+from unittest import mock
+
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.db.utils import ProgrammingError
 
 from django_tally.data.models import Data
 from django_tally.user_def.models import UserDefTally
-from django_tally.user_def.listen import listen, on
-from django_tally.user_def.lang import KW
+from django_tally.user_def.listen import listen, on, _accepts_ensure
+from django_tally.user_def.lang import KW, generate
 from django_tally.user_def.lang.json import encode
+from django_tally.user_def.scripts import ScriptCache
 
 from .testapp.models import Foo
 
@@ -60,10 +65,41 @@ class TestSimpleCounter(TestCase):
             foo.delete()
             self.assertStored('counter', 0)
 
+    def test_counter_generated(self):
+        with mock.patch.object(
+            UserDefTally.UserTally, 'compile_script', staticmethod(generate),
+        ):
+            self.test_counter()
+
     def test_counter_refreshed(self):
         self.counter.refresh_from_db()
         self.test_counter()
 
+    def test_scripts_cached(self):
+        other = UserDefTally.objects.get(pk=self.counter.pk)
+        other.db_name = 'other_counter'
+        tally = self.counter.as_tally(ensure=False)
+        other_tally = other.as_tally(ensure=False)
+        self.assertIs(tally._env, other_tally._env)
+        self.assertIs(tally._handle_change, other_tally._handle_change)
+        # Changed scripts are compiled again
+        other.get_tally = encode(1)
+        other_tally = other.as_tally(ensure=False)
+        self.assertIsNot(tally._env, other_tally._env)
+        self.assertEqual(other_tally.get_tally(), 1)
+
+    def test_scripts_cache_evicts(self):
+        cache = ScriptCache(max_entries=1)
+        bound = UserDefTally.UserTally.bound
+        env, _ = cache.get(None, self.counter.get_scripts(), bound)
+        self.assertIs(
+            cache.get(None, self.counter.get_scripts(), bound)[0], env,
+        )
+        cache.get(encode(1), self.counter.get_scripts(), bound)
+        self.assertIsNot(
+            cache.get(None, self.counter.get_scripts(), bound)[0], env,
+        )
+
     def test_listen(self):
         sub = listen(Foo)
 
@@ -129,6 +165,46 @@ class TestSimpleCounter(TestCase):
 
         sub.close()
 
+    def test_listen_ensure_bulk(self):
+        for n in range(10):
+            self.counter.pk = None
+            self.counter.db_name = 'counter{}'.format(n)
+            self.counter.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            sub = listen(Foo)
+        inserts = [
+            query for query in queries
+            if query['sql'].startswith('INSERT INTO "data_data"')
+        ]
+        self.assertEqual(len(inserts), 1)
+
+        self.assertStored('counter', 0)
+        for n in range(10):
+            self.assertStored('counter{}'.format(n), 0)
+        Foo(value=5).save()
+        self.assertStored('counter3', 5)
+
+        sub.close()
+
+    def test_listen_as_tally_without_ensure(self):
+        as_tally = UserDefTally.as_tally
+
+        def as_tally_without_ensure(self):
+            return as_tally(self)
+
+        with mock.patch.object(
+            UserDefTally, 'as_tally', as_tally_without_ensure,
+        ), mock.patch.dict(_accepts_ensure, clear=True):
+            sub = listen(Foo)
+            Foo(value=5).save()
+            self.assertStored('counter', 5)
+            sub.close()
+
+    def test_as_tally_no_ensure(self):
+        self.counter.as_tally(ensure=False)
+        self.assertFalse(Data.objects.filter(name='counter').exists())
+
     def test_listen_unmigrated_sender(self):
 
         error_table = 'sender'
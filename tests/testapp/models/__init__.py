@@ -1,6 +1,7 @@
 from .foo import Foo
 from .bar import Bar
 from .baz import Baz
+from .qux import Qux
 
 
-__all__ = [Foo, Bar, Baz]
+__all__ = [Foo, Bar, Baz, Qux]
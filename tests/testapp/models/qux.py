@@ -0,0 +1,11 @@
+from django.db import models
+
+from django_tally.bulk import TallyManager
+
+
+class Qux(models.Model):
+
+    value = models.IntegerField(default=1)
+    other = models.IntegerField(default=0)
+
+    objects = TallyManager()